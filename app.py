@@ -1,8 +1,33 @@
 # app.py
-from flask import Flask, render_template_string, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, stream_template, stream_with_context, request, redirect, url_for, flash, get_flashed_messages, jsonify, session, g, has_app_context
 import sqlite3
-import uuid
+import argparse
+import base64
+import csv
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from queue import LifoQueue, Queue, Empty, Full
 from datetime import datetime, timedelta
+from jinja2 import ChoiceLoader, DictLoader
 from werkzeug.security import generate_password_hash, check_password_hash
 
 DB = "appointments.db"
@@ -10,9 +35,314 @@ APP = Flask(__name__)
 APP.secret_key = "123456"
 APP.config["SESSION_TYPE"] = "filesystem"
 
+# connection pool / pragma settings
+APP.config["DB_POOL_SIZE"] = 8
+APP.config["DB_JOURNAL_MODE"] = "WAL"
+APP.config["DB_SYNCHRONOUS"] = "NORMAL"
+APP.config["DB_CACHE_SIZE"] = -16000          # negative = KiB, so ~16 MB page cache
+APP.config["DB_MMAP_SIZE"] = 128 * 1024 * 1024
+APP.config["DB_BUSY_TIMEOUT"] = 5000          # ms
+APP.config["DB_STATEMENT_CACHE"] = 128
+APP.config["STREAM_TEMPLATES"] = False     # stream page renders instead of buffering them
+APP.config["REFERENCE_CACHE_TTL"] = 300.0    # seconds before cached reference data is reloaded anyway
+APP.config["REFERENCE_CACHE_CHECK"] = 1.0    # seconds between cache_version checks against the db
+APP.config["SLOW_QUERY_MS"] = 200            # queries slower than this are logged
+APP.config["CHANGE_FEED_KEEP"] = 1000        # change events kept in memory and in change_log
+APP.config["CHANGE_FEED_POLL"] = 1.0         # seconds between change_log polls for other workers' writes
+APP.config["SSE_KEEPALIVE"] = 15.0           # seconds between keepalive comments on idle event streams
+APP.config["ARCHIVE_DB"] = None              # archive file; None = "<db>-archive.db" next to DB
+APP.config["ARCHIVE_AFTER_DAYS"] = 365       # finished appointments older than this are archived
+APP.config["ARCHIVE_BATCH_SIZE"] = 1000      # rows moved per write transaction
+APP.config["ARCHIVE_INTERVAL"] = 0           # seconds between background archive runs under runserver; 0 = off
+APP.config["AVAILABILITY_CACHE_ENTRIES"] = 4096  # (dentist, date) slot bitmaps kept per process
+APP.config["AVAILABILITY_CACHE_TTL"] = 30.0  # seconds before a cached bitmap is reloaded
+APP.config["WARM_AVAILABILITY_DAYS"] = 14    # days of bitmaps a worker loads before serving
+APP.config["PASSWORD_HASH_METHOD"] = "scrypt:32768:8:1"  # werkzeug method string; older hashes are redone at next login
+APP.config["AUTH_HASH_WORKERS"] = 2          # threads hashing passwords, per process
+APP.config["AUTH_HASH_QUEUE"] = 8            # hashes allowed to wait for a thread; past that logins get a 503
+APP.config["AUTH_HASH_TIMEOUT"] = 5.0        # seconds a request waits for its hash before giving up with a 503
+APP.config["AUTH_IP_BURST"] = 20             # login/register attempts per client address...
+APP.config["AUTH_IP_RATE"] = 0.2             # ...refilled at this many per second
+APP.config["AUTH_EMAIL_BURST"] = 5           # login attempts per email address...
+APP.config["AUTH_EMAIL_RATE"] = 1 / 60       # ...refilled at this many per second
+APP.config["BOOKING_GROUP_COMMIT"] = False     # bookings go through one writer thread, many per transaction
+APP.config["BOOKING_BATCH_SIZE"] = 64          # most bookings the writer commits at once
+APP.config["BOOKING_BATCH_WAIT"] = 0.001       # seconds the writer waits for more bookings to share a commit
+APP.config["BOOKING_QUEUE_LIMIT"] = 2000       # bookings waiting for the writer; past that they're refused
+APP.config["BOOKING_WRITE_TIMEOUT"] = 5.0      # seconds a booking waits for the writer before giving up with a 503
+APP.config["METRICS_DIR"] = None             # where pre-fork workers publish their metrics; serve() makes one
+APP.config["METRICS_PUBLISH_INTERVAL"] = 5.0  # seconds between a worker's metrics snapshots
+APP.config["PUBLIC_ID_KEY"] = None           # key behind the ids in urls and the apis; None = secret_key. Changing it breaks old links
+
+# ---------------- METRICS ----------------
+class Metrics:
+    """In-process counters and histograms, rendered in Prometheus text format."""
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self._help = {}
+        self._hist = {}       # name -> {labels: [bucket counts..., sum, count]}
+        self._counters = {}   # name -> {labels: value}
+        self._gauges = {}     # name -> {labels: value}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._hist.setdefault(name, {})
+            h = series.get(key)
+            if h is None:
+                h = series[key] = [0] * len(self.BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ""
+        body = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+        return "{" + body + "}"
+
+    def snapshot(self):
+        """Every series as plain data, for another process to render."""
+        with self._lock:
+            return {kind: {name: [[key, list(value) if kind == "hist" else value]
+                                  for key, value in series.items()]
+                           for name, series in getattr(self, "_" + kind).items()}
+                    for kind in ("hist", "counters", "gauges")}
+
+    def render(self, workers=None):
+        """Prometheus text for this process, or with `workers` ({worker:
+        snapshot()}) for all of them, each series labelled with its worker."""
+        if workers is None:
+            with self._lock:
+                series = {kind: {name: dict(s) for name, s in getattr(self, "_" + kind).items()}
+                          for kind in ("hist", "counters", "gauges")}
+        else:
+            series = {"hist": {}, "counters": {}, "gauges": {}}
+            for worker, snap in sorted(workers.items()):
+                for kind, names in snap.items():
+                    for name, values in names.items():
+                        merged = series[kind].setdefault(name, {})
+                        for key, value in values:
+                            merged[tuple(map(tuple, key)) + (("worker", worker),)] = value
+        hist, counters, gauges = series["hist"], series["counters"], series["gauges"]
+        out = []
+        for name in sorted(set(hist) | set(counters) | set(gauges)):
+            default = "histogram" if name in hist else "gauge" if name in gauges else "counter"
+            kind, text = self._help.get(name, (default, name))
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            for key, h in sorted(hist.get(name, {}).items()):
+                for bound, n in zip(self.BUCKETS, h):
+                    out.append(f"{name}_bucket{self._labels(key, [('le', bound)])} {n}")
+                out.append(f"{name}_bucket{self._labels(key, [('le', '+Inf')])} {h[-1]}")
+                out.append(f"{name}_sum{self._labels(key)} {h[-2]:.6f}")
+                out.append(f"{name}_count{self._labels(key)} {h[-1]}")
+            for key, value in sorted(counters.get(name, {}).items()):
+                out.append(f"{name}{self._labels(key)} {value}")
+            for key, value in sorted(gauges.get(name, {}).items()):
+                out.append(f"{name}{self._labels(key)} {value:.6f}")
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+METRICS.describe("http_request_duration_seconds", "histogram", "Request latency by endpoint")
+METRICS.describe("http_responses_total", "counter", "Responses by endpoint and status code")
+METRICS.describe("db_query_duration_seconds", "histogram", "Data-access call latency by query name")
+METRICS.describe("db_query_rows_total", "counter", "Rows returned by query name")
+METRICS.describe("db_slow_queries_total", "counter", "Queries over SLOW_QUERY_MS by query name")
+METRICS.describe("db_connection_acquire_seconds", "histogram", "Time to get a connection from the pool")
+METRICS.describe("template_render_seconds", "histogram", "Template render time by template")
+METRICS.describe("auth_refused_total", "counter", "Login/register attempts refused by reason")
+METRICS.describe("booking_batches_total", "counter", "Transactions committed by the booking writer")
+METRICS.describe("booking_batch_items_total", "counter", "Bookings applied by the booking writer")
+METRICS.describe("app_startup_seconds", "gauge", "Time spent per startup phase of this process")
+
+slow_query_log = logging.getLogger("app.slow_queries")
+
+class _QueryTiming:
+    rows = None
+
+@contextmanager
+def query_timer(name):
+    timing = _QueryTiming()
+    started = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        elapsed = time.perf_counter() - started
+        METRICS.observe("db_query_duration_seconds", elapsed, query=name)
+        if timing.rows:
+            METRICS.inc("db_query_rows_total", timing.rows, query=name)
+        if elapsed * 1000 >= APP.config["SLOW_QUERY_MS"]:
+            METRICS.inc("db_slow_queries_total", query=name)
+            slow_query_log.warning("slow query %s: %.1f ms", name, elapsed * 1000)
+
+def timed_query(fn):
+    # Times a data-access helper under its own name; list results count as rows.
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with query_timer(fn.__name__) as timing:
+            result = fn(*args, **kwargs)
+            if isinstance(result, list):
+                timing.rows = len(result)
+            return result
+    return wrapper
+
+@APP.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+
+@APP.after_request
+def count_response(response):
+    METRICS.inc("http_responses_total", endpoint=request.endpoint or "unmatched",
+                status=response.status_code)
+    return response
+
+@APP.teardown_request
+def observe_request_time(exc):
+    started = g.pop("_request_started", None)
+    if started is not None:
+        METRICS.observe("http_request_duration_seconds", time.perf_counter() - started,
+                        endpoint=request.endpoint or "unmatched", method=request.method)
+
 # ---------------- DATABASE ----------------
-def get_conn(timeout=5):
-    return sqlite3.connect(DB, timeout=timeout)
+class ConnectionPool:
+    """Keeps idle sqlite connections around so requests don't pay for connect + pragmas."""
+
+    def __init__(self, path, size=8, journal_mode="WAL", synchronous="NORMAL",
+                 cache_size=-16000, mmap_size=0, busy_timeout=5000, statement_cache=128, attach=None):
+        self.path = path
+        self.attach = dict(attach or {})   # schema name -> file, attached to every connection
+        self.size = size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.statement_cache = statement_cache
+        self._idle = LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path,
+                               timeout=self.busy_timeout / 1000.0,
+                               cached_statements=self.statement_cache,
+                               check_same_thread=False)
+        c = conn.cursor()
+        c.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        c.execute(f"PRAGMA synchronous={self.synchronous}")
+        c.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        c.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        c.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        for schema, path in self.attach.items():
+            c.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            c.execute(f"PRAGMA {schema}.journal_mode={self.journal_mode}")
+            c.execute(f"PRAGMA {schema}.synchronous={self.synchronous}")
+        c.close()
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+def archive_path():
+    return APP.config["ARCHIVE_DB"] or re.sub(r"(\.db)?$", "-archive.db", DB, count=1)
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DB or _pool.attach.get("archive") != archive_path():
+            if _pool is not None:
+                _pool.close_all()
+            cfg = APP.config
+            _pool = ConnectionPool(DB,
+                                   size=cfg["DB_POOL_SIZE"],
+                                   journal_mode=cfg["DB_JOURNAL_MODE"],
+                                   synchronous=cfg["DB_SYNCHRONOUS"],
+                                   cache_size=cfg["DB_CACHE_SIZE"],
+                                   mmap_size=cfg["DB_MMAP_SIZE"],
+                                   busy_timeout=cfg["DB_BUSY_TIMEOUT"],
+                                   statement_cache=cfg["DB_STATEMENT_CACHE"],
+                                   attach={"archive": archive_path()})
+        return _pool
+
+def close_pool():
+    """Close every pooled connection and this thread's own, so the next
+    get_conn() connects afresh. Call before forking: a sqlite connection
+    must never be used on both sides of a fork."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = _local.pool = None
+
+def get_conn():
+    # Inside a request the connection lives on `g` and goes back to the pool on
+    # teardown; outside one (init_db, CLI) each thread keeps its own.
+    pool = get_pool()
+    if has_app_context():
+        conn = g.get("_db_conn")
+        if conn is None:
+            started = time.perf_counter()
+            conn = g._db_conn = pool.acquire()
+            METRICS.observe("db_connection_acquire_seconds", time.perf_counter() - started)
+        return conn
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pool", None) is not pool:
+        conn = _local.conn = pool.acquire()
+        _local.pool = pool
+    return conn
+
+@APP.teardown_appcontext
+def release_conn(exc):
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        get_pool().release(conn)
 
 def init_db():
     with get_conn() as conn:
@@ -54,7 +384,734 @@ def init_db():
                 password TEXT NOT NULL
             )
         """)
+        for ddl in ARCHIVE_SCHEMA:
+            c.execute(ddl)
         conn.commit()
+    migrate()
+
+
+# Finished appointments moved out of the hot table by archive_appointments().
+# The archive file is attached to every connection as "archive"; rows keep
+# their appointment_id, which is also the rowid of their archive fts row.
+ARCHIVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS archive.appointments (
+        appointment_id INTEGER PRIMARY KEY,
+        patient_id INTEGER NOT NULL,
+        dentist_id INTEGER NOT NULL,
+        service TEXT,
+        date TEXT,
+        time TEXT,
+        status TEXT,
+        created_at TEXT,
+        starts_at TEXT NOT NULL DEFAULT '',
+        archived_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_start ON appointments(starts_at)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_dentist_start ON appointments(dentist_id, starts_at)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_patient ON appointments(patient_id)",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS archive.appointment_fts USING fts5(
+        patient_name, contact, dentist_name, specialty, service,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+]
+
+# Ordered schema migrations; MIGRATIONS[n] brings the db from user_version n to n+1.
+# Only ever append to this list.
+MIGRATIONS = [
+    # 1: indexes for the name lookup, the appointment joins and moderator filters
+    [
+        "CREATE INDEX IF NOT EXISTS idx_patient_name ON patient(name)",
+        "CREATE INDEX IF NOT EXISTS idx_appt_dentist_slot ON appointments(dentist_id, date, time)",
+        "CREATE INDEX IF NOT EXISTS idx_appt_patient ON appointments(patient_id)",
+        "CREATE INDEX IF NOT EXISTS idx_appt_status_date ON appointments(status, date)",
+    ],
+    # 2: keyset pagination order
+    [
+        "CREATE INDEX IF NOT EXISTS idx_appt_schedule ON appointments(date, time, appointment_id)",
+    ],
+    # 3: full-text search over the moderator search fields, one row per appointment
+    # (fts rowid = appointments rowid), kept in sync by triggers
+    [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS appointment_fts USING fts5(
+            patient_name, contact, dentist_name, specialty, service,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS appointment_fts_ai AFTER INSERT ON appointments BEGIN
+            INSERT INTO appointment_fts (rowid, patient_name, contact, dentist_name, specialty, service)
+            SELECT new.rowid,
+                   (SELECT name FROM patient WHERE patient_id = new.patient_id),
+                   (SELECT contact FROM patient WHERE patient_id = new.patient_id),
+                   (SELECT name FROM dentist WHERE dentist_id = new.dentist_id),
+                   (SELECT specialty FROM dentist WHERE dentist_id = new.dentist_id),
+                   new.service;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS appointment_fts_au
+        AFTER UPDATE OF patient_id, dentist_id, service ON appointments BEGIN
+            DELETE FROM appointment_fts WHERE rowid = old.rowid;
+            INSERT INTO appointment_fts (rowid, patient_name, contact, dentist_name, specialty, service)
+            SELECT new.rowid,
+                   (SELECT name FROM patient WHERE patient_id = new.patient_id),
+                   (SELECT contact FROM patient WHERE patient_id = new.patient_id),
+                   (SELECT name FROM dentist WHERE dentist_id = new.dentist_id),
+                   (SELECT specialty FROM dentist WHERE dentist_id = new.dentist_id),
+                   new.service;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS appointment_fts_ad AFTER DELETE ON appointments BEGIN
+            DELETE FROM appointment_fts WHERE rowid = old.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS patient_fts_au AFTER UPDATE OF name, contact ON patient BEGIN
+            UPDATE appointment_fts SET patient_name = new.name, contact = new.contact
+            WHERE rowid IN (SELECT rowid FROM appointments WHERE patient_id = new.patient_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS dentist_fts_au AFTER UPDATE OF name, specialty ON dentist BEGIN
+            UPDATE appointment_fts SET dentist_name = new.name, specialty = new.specialty
+            WHERE rowid IN (SELECT rowid FROM appointments WHERE dentist_id = new.dentist_id);
+        END
+        """,
+        # not rebuild_search_index(): appointment_id is still a uuid here
+        """
+        INSERT INTO appointment_fts (rowid, patient_name, contact, dentist_name, specialty, service)
+        SELECT a.rowid, p.name, p.contact, d.name, d.specialty, a.service
+        FROM appointments a
+        LEFT JOIN patient p ON a.patient_id = p.patient_id
+        LEFT JOIN dentist d ON a.dentist_id = d.dentist_id
+        """,
+    ],
+    # 4: at most one active (non-cancelled) appointment per dentist slot
+    [
+        lambda conn: cancel_duplicate_bookings(conn),
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_appt_active_slot
+        ON appointments(dentist_id, date, time) WHERE status != 'cancelled'
+        """,
+    ],
+    # 5: sortable start timestamp next to the display date/time columns
+    [
+        "ALTER TABLE appointments ADD COLUMN starts_at TEXT NOT NULL DEFAULT ''",
+        lambda conn: backfill_starts_at(conn),
+        "CREATE INDEX IF NOT EXISTS idx_appt_dentist_start ON appointments(dentist_id, starts_at)",
+        "CREATE INDEX IF NOT EXISTS idx_appt_start ON appointments(starts_at, appointment_id)",
+        "DROP INDEX IF EXISTS idx_appt_schedule",
+    ],
+    # 6: per-dataset version counters so every worker can tell its cache is stale
+    [
+        "CREATE TABLE IF NOT EXISTS cache_version (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR IGNORE INTO cache_version (name) VALUES ('dentists')",
+        """
+        CREATE TRIGGER IF NOT EXISTS dentist_version_ai AFTER INSERT ON dentist BEGIN
+            UPDATE cache_version SET version = version + 1 WHERE name = 'dentists';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS dentist_version_au AFTER UPDATE ON dentist BEGIN
+            UPDATE cache_version SET version = version + 1 WHERE name = 'dentists';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS dentist_version_ad AFTER DELETE ON dentist BEGIN
+            UPDATE cache_version SET version = version + 1 WHERE name = 'dentists';
+        END
+        """,
+    ],
+    # 7: change counter + timestamp for everything the appointment listings join,
+    # so conditional GETs can be answered without running the join
+    [
+        "ALTER TABLE cache_version ADD COLUMN changed_at TEXT",
+        "UPDATE cache_version SET changed_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')",
+        "INSERT OR IGNORE INTO cache_version (name, changed_at) "
+        "VALUES ('appointments', strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))",
+        "DROP TRIGGER IF EXISTS dentist_version_ai",
+        "DROP TRIGGER IF EXISTS dentist_version_au",
+        "DROP TRIGGER IF EXISTS dentist_version_ad",
+    ] + [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_version_{tag} AFTER {event} ON {table} BEGIN
+            UPDATE cache_version SET version = version + 1,
+                                     changed_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+            WHERE name = '{name}';
+        END
+        """
+        for table, name in (("dentist", "dentists"), ("appointments", "appointments"))
+        for tag, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE"))
+    ] + [
+        """
+        CREATE TRIGGER IF NOT EXISTS patient_version_au AFTER UPDATE ON patient BEGIN
+            UPDATE cache_version SET version = version + 1,
+                                     changed_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+            WHERE name = 'appointments';
+        END
+        """,
+    ],
+    # 8: plans flagged by check_query_plans(): the dentist list was a scan plus
+    # a sort, and a dentist's schedule sorted its appointment_id tie-break
+    [
+        "CREATE INDEX IF NOT EXISTS idx_dentist_name ON dentist(name)",
+        "DROP INDEX IF EXISTS idx_appt_dentist_start",
+        "CREATE INDEX IF NOT EXISTS idx_appt_dentist_start ON appointments(dentist_id, starts_at, appointment_id)",
+        # a rebuilt index has no stats, and without them the planner prefers it
+        # over idx_appt_start for the unfiltered schedule
+        "ANALYZE dentist",
+        "ANALYZE appointments",
+    ],
+    # 9: appointment counts per (day, dentist, status) for the dashboard stats,
+    # kept current by triggers; day is the date part of starts_at
+    [
+        """
+        CREATE TABLE IF NOT EXISTS appointment_counts (
+            day TEXT NOT NULL,
+            dentist_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (day, dentist_id, status)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS appointment_counts_ai AFTER INSERT ON appointments BEGIN
+            INSERT INTO appointment_counts (day, dentist_id, status, n)
+            VALUES (substr(new.starts_at, 1, 10), new.dentist_id, coalesce(new.status, ''), 1)
+            ON CONFLICT (day, dentist_id, status) DO UPDATE SET n = n + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS appointment_counts_au
+        AFTER UPDATE OF status, dentist_id, starts_at ON appointments
+        WHEN old.status IS NOT new.status OR old.dentist_id IS NOT new.dentist_id
+             OR substr(old.starts_at, 1, 10) IS NOT substr(new.starts_at, 1, 10)
+        BEGIN
+            UPDATE appointment_counts SET n = n - 1
+            WHERE day = substr(old.starts_at, 1, 10) AND dentist_id = old.dentist_id
+              AND status = coalesce(old.status, '');
+            DELETE FROM appointment_counts
+            WHERE day = substr(old.starts_at, 1, 10) AND dentist_id = old.dentist_id
+              AND status = coalesce(old.status, '') AND n <= 0;
+            INSERT INTO appointment_counts (day, dentist_id, status, n)
+            VALUES (substr(new.starts_at, 1, 10), new.dentist_id, coalesce(new.status, ''), 1)
+            ON CONFLICT (day, dentist_id, status) DO UPDATE SET n = n + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS appointment_counts_ad AFTER DELETE ON appointments BEGIN
+            UPDATE appointment_counts SET n = n - 1
+            WHERE day = substr(old.starts_at, 1, 10) AND dentist_id = old.dentist_id
+              AND status = coalesce(old.status, '');
+            DELETE FROM appointment_counts
+            WHERE day = substr(old.starts_at, 1, 10) AND dentist_id = old.dentist_id
+              AND status = coalesce(old.status, '') AND n <= 0;
+        END
+        """,
+        lambda conn: rebuild_status_counts(conn),
+    ],
+    # 10: change events for the live moderator dashboard; seq orders them
+    # across every worker writing to this db
+    [
+        """
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            op TEXT NOT NULL,
+            ids TEXT NOT NULL,
+            data TEXT,
+            at TEXT NOT NULL
+        )
+        """,
+    ],
+    # 11: archive_appointments() walks finished rows oldest first; on a small
+    # or fresh table the planner took idx_appt_status_date and sorted. Nothing
+    # else filters on (status, date) since the schedule moved to starts_at
+    [
+        """
+        CREATE INDEX IF NOT EXISTS idx_appt_archivable ON appointments(starts_at)
+        WHERE status IN ('completed', 'cancelled')
+        """,
+        "DROP INDEX IF EXISTS idx_appt_status_date",
+    ],
+    # 12: INTEGER PRIMARY KEY ids in place of the uuid4 TEXT keys; the old
+    # uuids resolve through legacy_ids, so links handed out before keep working
+    [
+        lambda conn: migrate_integer_keys(conn),
+        # every index already ends in the rowid, which is now appointment_id
+        "DROP INDEX IF EXISTS idx_appt_start",
+        "CREATE INDEX IF NOT EXISTS idx_appt_start ON appointments(starts_at)",
+        "DROP INDEX IF EXISTS idx_appt_dentist_start",
+        "CREATE INDEX IF NOT EXISTS idx_appt_dentist_start ON appointments(dentist_id, starts_at)",
+        lambda conn: rebuild_search_index(conn),
+        lambda conn: rebuild_status_counts(conn),
+        # events name the old ids
+        "DELETE FROM change_log",
+        "ANALYZE main",
+    ],
+    # 13: recurring appointments. A series holds its rule once and its
+    # occurrences are worked out per date window; only an occurrence that was
+    # moved, cancelled or otherwise changed gets an appointments row, tied back
+    # to the rule by (series_id, occurrence)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS appointment_series (
+            series_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            dentist_id INTEGER NOT NULL,
+            service TEXT NOT NULL,
+            time TEXT NOT NULL,
+            first_date TEXT NOT NULL,
+            interval_days INTEGER NOT NULL CHECK (interval_days > 0),
+            count INTEGER,
+            until TEXT,
+            last_date TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_series_last ON appointment_series(last_date)",
+        "CREATE INDEX IF NOT EXISTS idx_series_dentist_last ON appointment_series(dentist_id, last_date)",
+        "ALTER TABLE appointments ADD COLUMN series_id INTEGER",
+        "ALTER TABLE appointments ADD COLUMN occurrence INTEGER",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_appt_series_occurrence
+        ON appointments(series_id, occurrence) WHERE series_id IS NOT NULL
+        """,
+    ] + [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS appointment_series_version_{tag} AFTER {event} ON appointment_series BEGIN
+            UPDATE cache_version SET version = version + 1,
+                                     changed_at = strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+            WHERE name = 'appointments';
+        END
+        """
+        for tag, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE"))
+    ],
+    # 14: one active appointment per dentist and start time. The old index
+    # keyed the display date/time text, so "2027-05-17"/"05/17/2027" or
+    # "10:00 AM"/"10:00" were different slots; rows are rewritten to the
+    # canonical spelling first, then duplicates are cancelled as in 4
+    [
+        "DROP INDEX IF EXISTS idx_appt_active_slot",
+        lambda conn: normalise_booking_slots(conn),
+        lambda conn: cancel_duplicate_bookings(conn, ("starts_at",)),
+        "DROP INDEX IF EXISTS idx_appt_dentist_slot",
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_appt_active_start
+        ON appointments(dentist_id, starts_at) WHERE status != 'cancelled'
+        """,
+        "ANALYZE appointments",
+    ],
+]
+
+@timed_query
+def data_version(*names):
+    """(version string, last change as datetime) over the given cache_version rows."""
+    rows = get_conn().execute(statement("data_version", marks=len(names)), names).fetchall()
+    versions = dict((name, v) for name, v, _ in rows)
+    changed = max((c for _, _, c in rows if c), default=None)
+    tag = "-".join(str(versions.get(n, 0)) for n in names)
+    when = datetime.strptime(changed, "%Y-%m-%dT%H:%M:%SZ") if changed else None
+    return tag, when
+
+def backfill_starts_at(conn):
+    rows = conn.execute("SELECT rowid, date, time FROM appointments").fetchall()
+    conn.executemany("UPDATE appointments SET starts_at = ? WHERE rowid = ?",
+                     [(canonical_start(d, t), rowid) for rowid, d, t in rows])
+
+def cancel_duplicate_bookings(conn, slot=("date", "time")):
+    # Keep the earliest booking of each double-booked slot and cancel the rest,
+    # otherwise the unique index in migration 4 (14: keyed on starts_at) can't
+    # be built.
+    same_slot = "".join(f"AND b.{col} = appointments.{col} " for col in slot)
+    conn.execute(f"""
+        UPDATE appointments SET status = 'cancelled'
+        WHERE status != 'cancelled' AND EXISTS (
+            SELECT 1 FROM appointments b
+            WHERE b.dentist_id = appointments.dentist_id
+              {same_slot}
+              AND b.status != 'cancelled'
+              AND (b.created_at, b.appointment_id) < (appointments.created_at, appointments.appointment_id)
+        )
+    """)
+
+def normalise_booking_slots(conn):
+    # Rewrite date/time to ISO date + TIME_SLOTS entry where they parse, so
+    # rows booked under another spelling land on the same starts_at.
+    rows = conn.execute("SELECT appointment_id, date, time, starts_at FROM appointments").fetchall()
+    updates = []
+    for aid, date, time_str, starts_at in rows:
+        new = (normalise_date(date) or date, normalise_slot(time_str) or time_str)
+        new += (canonical_start(*new),)
+        if new != (date, time_str, starts_at):
+            updates.append(new + (aid,))
+    conn.executemany(statement("move_appointment"), updates)
+
+def rebuild_search_index(conn=None):
+    # refill the fts table from scratch, e.g. after a bulk load that dropped
+    # its insert trigger; fts rowid = appointment_id
+    conn = conn or get_conn()
+    conn.execute("DELETE FROM appointment_fts")
+    conn.execute("""
+        INSERT INTO appointment_fts (rowid, patient_name, contact, dentist_name, specialty, service)
+        SELECT a.appointment_id, p.name, p.contact, d.name, d.specialty, a.service
+        FROM appointments a
+        LEFT JOIN patient p ON a.patient_id = p.patient_id
+        LEFT JOIN dentist d ON a.dentist_id = d.dentist_id
+    """)
+
+def rebuild_status_counts(conn=None):
+    # recount appointment_counts from scratch, e.g. after a bulk load that
+    # dropped its insert trigger or if the table is ever suspected stale
+    conn = conn or get_conn()
+    # archived appointments keep counting, so stats cover the whole history
+    conn.execute("DELETE FROM appointment_counts")
+    conn.execute("""
+        INSERT INTO appointment_counts (day, dentist_id, status, n)
+        SELECT substr(starts_at, 1, 10), dentist_id, coalesce(status, ''), COUNT(*)
+        FROM (SELECT starts_at, dentist_id, status FROM main.appointments
+              UNION ALL
+              SELECT starts_at, dentist_id, status FROM archive.appointments)
+        GROUP BY 1, 2, 3
+    """)
+
+# migration 12: table -> (legacy_ids kind, new definition). AUTOINCREMENT so an
+# id is never handed out twice: public ids and archived rows outlive deletes.
+INTEGER_KEY_TABLES = {
+    "patient": ("patient", """
+        CREATE TABLE patient_new (
+            patient_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            age TEXT,
+            contact TEXT
+        )
+    """),
+    "dentist": ("dentist", """
+        CREATE TABLE dentist_new (
+            dentist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            specialty TEXT
+        )
+    """),
+    "users": ("user", """
+        CREATE TABLE users_new (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+    """),
+    "appointments": ("appointment", """
+        CREATE TABLE appointments_new (
+            appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER NOT NULL,
+            dentist_id INTEGER NOT NULL,
+            service TEXT,
+            date TEXT,
+            time TEXT,
+            status TEXT,
+            created_at TEXT,
+            starts_at TEXT NOT NULL DEFAULT '',
+            FOREIGN KEY(patient_id) REFERENCES patient(patient_id),
+            FOREIGN KEY(dentist_id) REFERENCES dentist(dentist_id)
+        )
+    """),
+}
+
+def migrate_integer_keys(conn):
+    # SQLite can't change a primary key in place, so each table is rebuilt as
+    # <table>_new and renamed over the old one. Rows are numbered in rowid
+    # (insertion) order and each old key is recorded in legacy_ids, through
+    # which the references in appointments are mapped. The triggers name the
+    # tables being dropped and would fail the renames, so they are dropped
+    # first and recreated from their saved sql at the end.
+    saved = conn.execute(
+        "SELECT type, name, sql FROM main.sqlite_master WHERE type IN ('index', 'trigger') "
+        f"AND sql IS NOT NULL AND tbl_name IN ({','.join('?' * len(INTEGER_KEY_TABLES))})",
+        list(INTEGER_KEY_TABLES)).fetchall()
+    for kind, name, _ in saved:
+        if kind == "trigger":
+            conn.execute(f"DROP TRIGGER {name}")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS legacy_ids (
+            kind TEXT NOT NULL,
+            uuid TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            PRIMARY KEY (kind, uuid)
+        ) WITHOUT ROWID
+    """)
+    for table, (kind, ddl) in INTEGER_KEY_TABLES.items():
+        key = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")][0]
+        conn.execute(f"""
+            INSERT OR IGNORE INTO legacy_ids (kind, uuid, id)
+            SELECT ?, uuid, id FROM (SELECT {key} AS uuid, row_number() OVER (ORDER BY rowid) AS id FROM {table})
+            WHERE uuid IS NOT NULL
+        """, (kind,))
+        conn.execute(ddl)
+    for table in ("patient", "dentist", "users"):
+        cols = [r[1] for r in conn.execute(f"PRAGMA main.table_info({table}_new)")]
+        conn.execute(f"INSERT INTO {table}_new ({','.join(cols)}) "
+                     f"SELECT row_number() OVER (ORDER BY rowid), {','.join(cols[1:])} FROM {table}")
+    # appointments whose patient or dentist row is gone get 0, which the
+    # listings' inner joins drop just as they dropped the dangling uuid
+    conn.execute("""
+        INSERT INTO appointments_new
+        (appointment_id, patient_id, dentist_id, service, date, time, status, created_at, starts_at)
+        SELECT row_number() OVER (ORDER BY a.rowid), coalesce(lp.id, 0), coalesce(ld.id, 0),
+               a.service, a.date, a.time, a.status, a.created_at, a.starts_at
+        FROM appointments a
+        LEFT JOIN legacy_ids lp ON lp.kind = 'patient' AND lp.uuid = a.patient_id
+        LEFT JOIN legacy_ids ld ON ld.kind = 'dentist' AND ld.uuid = a.dentist_id
+    """)
+    archive_keys = {r[1]: r[2] for r in conn.execute("PRAGMA archive.table_info(appointments)")}
+    if archive_keys.get("appointment_id", "").upper() == "TEXT":
+        # archived rows are numbered after the hot ones
+        base = conn.execute("SELECT coalesce(max(appointment_id), 0) FROM appointments_new").fetchone()[0]
+        conn.execute("""
+            INSERT OR IGNORE INTO legacy_ids (kind, uuid, id)
+            SELECT 'appointment', uuid, ? + id
+            FROM (SELECT appointment_id AS uuid, row_number() OVER (ORDER BY rowid) AS id FROM archive.appointments)
+            WHERE uuid IS NOT NULL
+        """, (base,))
+        conn.execute(ARCHIVE_SCHEMA[0].replace("archive.appointments", "archive.appointments_new"))
+        conn.execute("""
+            INSERT INTO archive.appointments_new
+            (appointment_id, patient_id, dentist_id, service, date, time, status, created_at, starts_at, archived_at)
+            SELECT ? + row_number() OVER (ORDER BY a.rowid), coalesce(lp.id, 0), coalesce(ld.id, 0),
+                   a.service, a.date, a.time, a.status, a.created_at, a.starts_at, a.archived_at
+            FROM archive.appointments a
+            LEFT JOIN legacy_ids lp ON lp.kind = 'patient' AND lp.uuid = a.patient_id
+            LEFT JOIN legacy_ids ld ON ld.kind = 'dentist' AND ld.uuid = a.dentist_id
+        """, (base,))
+        top = conn.execute("SELECT max(appointment_id) FROM archive.appointments_new").fetchone()[0]
+        conn.execute("DROP TABLE archive.appointments")
+        conn.execute("ALTER TABLE archive.appointments_new RENAME TO appointments")
+        for ddl in ARCHIVE_SCHEMA:
+            conn.execute(ddl)
+        conn.execute("DELETE FROM archive.appointment_fts")
+        conn.execute("""
+            INSERT INTO archive.appointment_fts (rowid, patient_name, contact, dentist_name, specialty, service)
+            SELECT a.appointment_id, p.name, p.contact, d.name, d.specialty, a.service
+            FROM archive.appointments a
+            LEFT JOIN patient_new p ON a.patient_id = p.patient_id
+            LEFT JOIN dentist_new d ON a.dentist_id = d.dentist_id
+        """)
+        if top:
+            # new hot ids must not run into archived ones
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'appointments_new'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('appointments_new', ?)", (top,))
+    for table in INTEGER_KEY_TABLES:
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    conn.execute("DROP TABLE IF EXISTS appointment_counts")
+    conn.execute("""
+        CREATE TABLE appointment_counts (
+            day TEXT NOT NULL,
+            dentist_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (day, dentist_id, status)
+        ) WITHOUT ROWID
+    """)
+    for _, _, sql in saved:
+        conn.execute(sql)
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate():
+    conn = get_conn()
+    version = schema_version(conn)
+    for target in range(version + 1, len(MIGRATIONS) + 1):
+        conn.execute("BEGIN")
+        try:
+            for step in MIGRATIONS[target - 1]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
+
+
+# ---------------- STATEMENTS ----------------
+# Every statement the data-access layer runs, by name, so check_query_plans()
+# can EXPLAIN all of them. {marks} and {columns} are filled in by statement().
+STATEMENTS = {
+    "find_patient_by_name": "SELECT patient_id,name,age,contact FROM patient WHERE name=?",
+    "insert_patient": "INSERT INTO patient (name,age,contact) VALUES (?,?,?)",
+    "insert_dentist": "INSERT INTO dentist (name,specialty) VALUES (?,?)",
+    "list_dentists": "SELECT dentist_id,name,specialty FROM dentist ORDER BY name",
+    "delete_dentist": "DELETE FROM dentist WHERE dentist_id = ?",
+    "insert_appointment": """
+        INSERT INTO appointments
+        (patient_id, dentist_id, service, date, time, status, created_at, starts_at)
+        VALUES (?,?,?,?,?,?,?,?)
+    """,
+    "appointment_slot": "SELECT dentist_id, date, time FROM appointments WHERE appointment_id = ?",
+    "appointment_states": "SELECT appointment_id, status, dentist_id, date, time FROM appointments "
+                          "WHERE appointment_id IN ({marks})",
+    "appointment_fields": "SELECT {columns} FROM appointments a "
+                          "JOIN patient p ON a.patient_id = p.patient_id "
+                          "JOIN dentist d ON a.dentist_id = d.dentist_id "
+                          "WHERE a.appointment_id = ?",
+    "archived_appointment_fields": "SELECT {columns} FROM archive.appointments a "
+                                   "JOIN patient p ON a.patient_id = p.patient_id "
+                                   "JOIN dentist d ON a.dentist_id = d.dentist_id "
+                                   "WHERE a.appointment_id = ?",
+    "set_appointment_status": "UPDATE appointments SET status = ? WHERE appointment_id = ?",
+    "move_appointment": "UPDATE appointments SET date = ?, time = ?, starts_at = ? WHERE appointment_id = ?",
+    "appointment_move_state": "SELECT status, dentist_id, date, time FROM appointments WHERE appointment_id = ?",
+    "appointment_series_link": "SELECT series_id FROM appointments WHERE appointment_id = ?",
+    "delete_appointment": "DELETE FROM appointments WHERE appointment_id = ?",
+    "booked_slots": "SELECT substr(starts_at, 1, 10), time FROM appointments "
+                    "WHERE dentist_id = ? AND starts_at >= ? AND starts_at < ? AND status != 'cancelled'",
+    "booked_slots_between": "SELECT dentist_id, substr(starts_at, 1, 10), time FROM appointments "
+                            "WHERE starts_at >= ? AND starts_at < ? AND status != 'cancelled'",
+    "status_counts": "SELECT day, dentist_id, status, n FROM appointment_counts WHERE day BETWEEN ? AND ?",
+    "dentist_status_counts": "SELECT day, dentist_id, status, n FROM appointment_counts "
+                             "WHERE day BETWEEN ? AND ? AND dentist_id = ?",
+    # a series' rows stay: archived, the occurrence they replace would come back
+    "archive_candidates": "SELECT appointment_id FROM main.appointments "
+                          "WHERE starts_at < ? AND status IN ('completed', 'cancelled') AND series_id IS NULL "
+                          "ORDER BY starts_at LIMIT ?",
+    "archive_copy": """
+        INSERT OR IGNORE INTO archive.appointments
+        (appointment_id, patient_id, dentist_id, service, date, time, status, created_at, starts_at, archived_at)
+        SELECT appointment_id, patient_id, dentist_id, service, date, time, status, created_at, starts_at, ?
+        FROM main.appointments WHERE appointment_id IN (SELECT value FROM json_each(?))
+    """,
+    "archive_fts_clear": "DELETE FROM archive.appointment_fts WHERE rowid IN (SELECT value FROM json_each(?))",
+    "archive_fts_copy": """
+        INSERT INTO archive.appointment_fts (rowid, patient_name, contact, dentist_name, specialty, service)
+        SELECT a.appointment_id, p.name, p.contact, d.name, d.specialty, a.service
+        FROM archive.appointments a
+        LEFT JOIN patient p ON a.patient_id = p.patient_id
+        LEFT JOIN dentist d ON a.dentist_id = d.dentist_id
+        WHERE a.appointment_id IN (SELECT value FROM json_each(?))
+    """,
+    "archive_delete": "DELETE FROM main.appointments WHERE appointment_id IN (SELECT value FROM json_each(?))",
+    "archive_recount": """
+        INSERT INTO appointment_counts (day, dentist_id, status, n)
+        SELECT substr(starts_at, 1, 10), dentist_id, coalesce(status, ''), COUNT(*)
+        FROM archive.appointments WHERE appointment_id IN (SELECT value FROM json_each(?))
+        GROUP BY 1, 2, 3
+        ON CONFLICT (day, dentist_id, status) DO UPDATE SET n = n + excluded.n
+    """,
+    "insert_series": """
+        INSERT INTO appointment_series
+        (patient_id, dentist_id, service, time, first_date, interval_days, count, until, last_date, status, created_at)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?)
+    """,
+    "series": "SELECT series_id, patient_id, dentist_id, service, time, first_date, interval_days, count, until, "
+              "last_date, status, created_at FROM appointment_series WHERE series_id = ?",
+    # series with an occurrence in [lo, hi], given as (lo, hi, hi, lo): the last
+    # step that fits before hi must not fall before lo
+    "series_between": "SELECT series_id, dentist_id, time, first_date, interval_days, last_date, status "
+                      "FROM appointment_series WHERE last_date >= ? AND first_date <= ? "
+                      "AND CAST(julianday(min(?, last_date)) - julianday(first_date) AS INTEGER) "
+                      "/ interval_days * interval_days >= julianday(max(?, first_date)) - julianday(first_date)",
+    "dentist_series_between": "SELECT series_id, dentist_id, time, first_date, interval_days, last_date, status "
+                              "FROM appointment_series WHERE dentist_id = ? AND last_date >= ? AND first_date <= ? "
+                              "AND CAST(julianday(min(?, last_date)) - julianday(first_date) AS INTEGER) "
+                              "/ interval_days * interval_days >= julianday(max(?, first_date)) - julianday(first_date)",
+    "set_series_status": "UPDATE appointment_series SET status = ? WHERE series_id = ?",
+    "series_exceptions": "SELECT series_id, occurrence FROM appointments "
+                         "WHERE series_id IN (SELECT value FROM json_each(?))",
+    "series_exception": "SELECT appointment_id FROM appointments WHERE series_id = ? AND occurrence = ?",
+    "insert_occurrence": """
+        INSERT INTO appointments
+        (patient_id, dentist_id, service, date, time, status, created_at, starts_at, series_id, occurrence)
+        VALUES (?,?,?,?,?,?,?,?,?,?)
+    """,
+    # occurrences without a row, given as json [[id, date, starts_at, series_id], ...],
+    # shaped like an appointments row so the listing columns apply unchanged;
+    # json_each has no stats, so CROSS JOIN keeps the planner driving from it
+    "occurrence_fields": """
+        SELECT {columns}, a.starts_at FROM (
+            SELECT json_extract(o.value, '$[0]') AS appointment_id, s.patient_id, s.dentist_id, s.service,
+                   json_extract(o.value, '$[1]') AS date, s.time, s.status, s.created_at,
+                   json_extract(o.value, '$[2]') AS starts_at
+            FROM json_each(?) o CROSS JOIN appointment_series s ON s.series_id = json_extract(o.value, '$[3]')
+        ) a
+        CROSS JOIN patient p ON a.patient_id = p.patient_id
+        CROSS JOIN dentist d ON a.dentist_id = d.dentist_id
+    """,
+    "log_change": "INSERT INTO change_log (entity, op, ids, data, at) VALUES (?,?,?,?,?)",
+    "prune_changes": "DELETE FROM change_log WHERE seq <= ?",
+    "changes_since": "SELECT seq, entity, op, ids, data FROM change_log WHERE seq > ? ORDER BY seq",
+    "last_change": "SELECT max(seq) FROM change_log",
+    "change_tail": "SELECT seq, entity, op, ids, data FROM change_log "
+                   "WHERE seq > (SELECT max(seq) FROM change_log) - ? ORDER BY seq",
+    "cache_version": "SELECT version FROM cache_version WHERE name = ?",
+    "data_version": "SELECT name, version, changed_at FROM cache_version WHERE name IN ({marks})",
+    "insert_user": "INSERT INTO users (name,email,password) VALUES (?,?,?)",
+    "user_by_email": "SELECT user_id,name,password FROM users WHERE email=?",
+    "set_user_password": "UPDATE users SET password = ? WHERE user_id = ?",
+    "legacy_id": "SELECT id FROM legacy_ids WHERE kind = ? AND uuid = ?",
+}
+
+def statement(name, marks=1, columns="*"):
+    return STATEMENTS[name].format(marks=",".join("?" * marks), columns=columns)
+
+# Plan steps a statement may take anyway. "scan" is a full table scan with no
+# index, "sort" a temp b-tree for ORDER BY/GROUP BY/DISTINCT.
+PLAN_ALLOW = {
+    # one row per cached table
+    "cache_version": {"scan"},
+    "data_version": {"scan"},
+    # fts5 rank is computed per match, no index can return rows in that order
+    "appointments_search": {"sort"},
+    # groups one archive batch
+    "archive_recount": {"sort"},
+}
+
+def _plan_cases():
+    for name in STATEMENTS:
+        yield name, statement(name, columns=", ".join(APPOINTMENT_COLUMNS))
+    # every shape appointments_query() can build
+    for search, dentist, bounded, after, limit, history in itertools.product((False, True), repeat=6):
+        key = (0.0 if search else "2000-01-01T08:00", "")
+        sql, _ = appointments_query("x" if search else "", after=key if after else None,
+                                    limit=PAGE_SIZE if limit else None,
+                                    start="2000-01-01" if bounded else None,
+                                    end="2000-01-31" if bounded else None,
+                                    dentist_id="d" if dentist else None, history=history)
+        flags = [f for f, on in (("dentist", dentist), ("range", bounded), ("after", after),
+                                 ("limit", limit), ("history", history)) if on]
+        yield f"appointments_{'search' if search else 'schedule'}({','.join(flags)})", sql
+
+def check_query_plans(conn=None):
+    """EXPLAIN QUERY PLAN every registered statement. Returns [(name, plan
+    lines, problems)]; problems lists the full scans and temp sorts not
+    allowed by PLAN_ALLOW. Run against a populated, ANALYZEd database -
+    on empty tables the planner has nothing to choose between."""
+    conn = conn or get_conn()
+    report = []
+    for name, sql in _plan_cases():
+        allowed = PLAN_ALLOW.get(name.partition("(")[0], set())
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, [None] * sql.count("?"))]
+        problems = []
+        for step in plan:
+            if "scan" not in allowed and re.fullmatch(r"SCAN \w+", step):
+                problems.append(step)
+            if "sort" not in allowed and "USE TEMP B-TREE" in step:
+                problems.append(step)
+        report.append((name, plan, problems))
+    return report
 
 
 # ---------------- METHODS ----------------
@@ -71,191 +1128,1431 @@ def generate_time_slots(start="08:00", end="18:00", interval_minutes=30):
 
 TIME_SLOTS = generate_time_slots()
 
-def add_patient(name, age="", contact=""):
-    pid = str(uuid.uuid4())
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("INSERT INTO patient (patient_id,name,age,contact) VALUES (?,?,?,?)",
-                  (pid, name, age, contact))
-    return pid
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%Y/%m/%d")
+TIME_FORMATS = ("%I:%M %p", "%H:%M")
 
-def find_patient_by_name(name):
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("SELECT patient_id,name,age,contact FROM patient WHERE name=?", (name,))
-        return c.fetchone()
+def normalise_date(date):
+    """ISO 'YYYY-MM-DD' for any of the accepted DATE_FORMATS, or None."""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime((date or "").strip(), fmt).date().isoformat()
+        except ValueError:
+            pass
+    return None
 
-def add_dentist(name, specialty="General"):
-    did = str(uuid.uuid4())
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("INSERT INTO dentist (dentist_id,name,specialty) VALUES (?,?,?)", (did, name, specialty))
-    return did
+# "HH:MM" -> TIME_SLOTS entry
+SLOT_CLOCKS = {datetime.strptime(t, "%I:%M %p").strftime("%H:%M"): t for t in TIME_SLOTS}
 
-def get_dentists():
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("SELECT dentist_id,name,specialty FROM dentist ORDER BY name")
-        return c.fetchall()
+def normalise_slot(time_str):
+    """The TIME_SLOTS entry for a time in any of the TIME_FORMATS, or None."""
+    for fmt in TIME_FORMATS:
+        try:
+            return SLOT_CLOCKS.get(datetime.strptime((time_str or "").strip(), fmt).strftime("%H:%M"))
+        except ValueError:
+            pass
+    return None
 
-def delete_dentist_by_id(did):
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("DELETE FROM dentist WHERE dentist_id = ?", (did,))
+def canonical_start(date, time_str):
+    """ISO-8601 'YYYY-MM-DDTHH:MM' for a form date + slot, so it sorts as text.
+    Unparseable input falls back to the raw date so the value is never NULL."""
+    clock = None
+    iso = normalise_date(date)
+    for fmt in TIME_FORMATS:
+        try:
+            clock = datetime.strptime((time_str or "").strip(), fmt).time()
+            break
+        except ValueError:
+            pass
+    if iso is None:
+        return date or ""
+    return f"{iso}T{(clock.strftime('%H:%M') if clock else '00:00')}"
 
-def add_appointment(patient_id, dentist_id, service, date, time_str):
-    aid = str(uuid.uuid4())
-    created_at = datetime.utcnow().isoformat()
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO appointments
-            (appointment_id, patient_id, dentist_id, service, date, time, status, created_at)
-            VALUES (?,?,?,?,?,?,?,?)
-        """, (aid, patient_id, dentist_id, service, date, time_str, "pending", created_at))
-    return aid
+# ---------------- AVAILABILITY ----------------
+class SlotAvailability:
+    """Occupancy bitmaps over the slot grid, one int per (dentist, date).
 
-def get_appointments(search=""):
-    with get_conn() as conn:
-        c = conn.cursor()
-        q = """
-            SELECT a.appointment_id,
-                   p.name, p.age, p.contact,
-                   a.service, a.date, a.time,
-                   d.name, d.specialty,
-                   a.status
-            FROM appointments a
-            JOIN patient p ON a.patient_id = p.patient_id
-            JOIN dentist d ON a.dentist_id = d.dentist_id
-        """
-        if search:
-            q += " WHERE p.name LIKE ? OR d.name LIKE ? OR a.service LIKE ?"
-            c.execute(q, (f"%{search}%", f"%{search}%", f"%{search}%"))
-        else:
-            c.execute(q)
-        return c.fetchall()
+    Bit i is set when TIME_SLOTS[i] holds a non-cancelled appointment or
+    recurring occurrence. Entries are loaded from the db on demand, kept in an
+    LRU of `max_entries` and reloaded after `ttl` seconds so bookings made
+    by other worker processes show up.
+    """
 
-def update_appointment_status(aid, status):
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("UPDATE appointments SET status = ? WHERE appointment_id = ?", (status, aid))
+    def __init__(self, slots, max_entries=4096, ttl=30.0):
+        self.slots = list(slots)
+        self.index = {t: i for i, t in enumerate(self.slots)}
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cache = OrderedDict()    # (dentist_id, date) -> (bitmap, loaded_at)
+        self._lock = threading.Lock()
 
-def delete_appointment(aid):
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("DELETE FROM appointments WHERE appointment_id = ?", (aid,))
+    def _get(self, key, now):
+        entry = self._cache.get(key)
+        if entry is None or now - entry[1] > self.ttl:
+            return None
+        self._cache.move_to_end(key)
+        return entry[0]
+
+    def _put(self, key, bitmap, now):
+        self._cache[key] = (bitmap, now)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    @staticmethod
+    def _dates(start, end):
+        d0 = datetime.strptime(start, "%Y-%m-%d").date()
+        d1 = datetime.strptime(end, "%Y-%m-%d").date()
+        return [(d0 + timedelta(days=i)).isoformat() for i in range((d1 - d0).days + 1)]
+
+    def bitmaps(self, dentist_id, start, end):
+        """Bitmaps for every date in [start, end] (YYYY-MM-DD strings)."""
+        dates = self._dates(start, end)
+        now = time.monotonic()
+        out = {}
+        with self._lock:
+            for day in dates:
+                out[day] = self._get((dentist_id, day), now)
+        missing = [day for day, bm in out.items() if bm is None]
+        if missing:
+            loaded = dict.fromkeys(missing, 0)
+            with query_timer("availability_load") as timing:
+                rows = get_conn().execute(statement("booked_slots"),
+                                          (dentist_id, missing[0], missing[-1] + "~")).fetchall()
+                # recurring occurrences without a row of their own hold their slot too
+                rows += [o[4:6] for o in expand_series(get_conn(), missing[0], missing[-1], dentist_id)
+                         if o[6] != "cancelled"]
+                timing.rows = len(rows)
+            for day, slot in rows:
+                i = self.index.get(slot)
+                if day in loaded and i is not None:
+                    loaded[day] |= 1 << i
+            with self._lock:
+                for day, bm in loaded.items():
+                    self._put((dentist_id, day), bm, now)
+            out.update(loaded)
+        return out
+
+    def bitmaps_many(self, dentist_ids, start, end):
+        """{dentist_id: {date: bitmap}} over [start, end]. If anything is
+        uncached, the whole range is loaded for all dentists in one query."""
+        dates = self._dates(start, end)
+        now = time.monotonic()
+        out = {did: {} for did in dentist_ids}
+        missing = False
+        with self._lock:
+            for did in dentist_ids:
+                for day in dates:
+                    bm = out[did][day] = self._get((did, day), now)
+                    missing = missing or bm is None
+        if not missing:
+            return out
+        out = {did: dict.fromkeys(dates, 0) for did in dentist_ids}
+        with query_timer("availability_load_range") as timing:
+            rows = get_conn().execute(statement("booked_slots_between"), (start, end + "~")).fetchall()
+            rows += [o[3:6] for o in expand_series(get_conn(), start, end) if o[6] != "cancelled"]
+            timing.rows = len(rows)
+        for did, day, slot in rows:
+            days = out.get(did)
+            i = self.index.get(slot)
+            if days is not None and day in days and i is not None:
+                days[day] |= 1 << i
+        with self._lock:
+            for did, days in out.items():
+                for day, bm in days.items():
+                    self._put((did, day), bm, now)
+        return out
+
+    def bitmap(self, dentist_id, date):
+        with self._lock:
+            bm = self._get((dentist_id, date), time.monotonic())
+        if bm is None:
+            bm = self.bitmaps(dentist_id, date, date)[date]
+        return bm
+
+    def free_slots(self, dentist_id, date):
+        bm = self.bitmap(dentist_id, date)
+        return [t for i, t in enumerate(self.slots) if not bm >> i & 1]
+
+    def is_free(self, dentist_id, date, time_str):
+        i = self.index.get(time_str)
+        return i is None or not self.bitmap(dentist_id, date) >> i & 1
+
+    def mark(self, dentist_id, date, time_str):
+        # Only a cached entry is touched; an uncached one loads fresh next time.
+        i = self.index.get(time_str)
+        if i is None:
+            return
+        with self._lock:
+            entry = self._cache.get((dentist_id, date))
+            if entry is not None:
+                self._cache[(dentist_id, date)] = (entry[0] | 1 << i, entry[1])
+
+    def invalidate(self, dentist_id, date):
+        # A slot can hold more than one row (legacy double bookings), so freeing
+        # a bit is left to a reload rather than cleared in place.
+        with self._lock:
+            self._cache.pop((dentist_id, date), None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+AVAILABILITY = SlotAvailability(TIME_SLOTS, max_entries=APP.config["AVAILABILITY_CACHE_ENTRIES"],
+                                ttl=APP.config["AVAILABILITY_CACHE_TTL"])
+AVAILABILITY_MAX_DAYS = 62
+
+EARLIEST_CHUNK_DAYS = 7      # days of bitmaps loaded per step of the earliest-slot search
+EARLIEST_MAX_DAYS = 92
+EARLIEST_MAX_RESULTS = 50
+
+def earliest_free_slots(start, end, limit=5, specialty=None, now=None):
+    """The `limit` earliest free (dentist, date, slot) over [start, end],
+    optionally only dentists of `specialty`. Each dentist's free slots are
+    walked lazily in time order and merged on a heap; bitmaps are loaded a
+    week at a time, so a busy clinic's first free slots cost one small range
+    query. Slots earlier than `now` (default: the current time) are skipped."""
+    now = now or datetime.now()
+    today, clock = now.date().isoformat(), now.strftime("%H:%M")
+    slot_clock = [datetime.strptime(t, "%I:%M %p").strftime("%H:%M") for t in AVAILABILITY.slots]
+    dentists = [d for d in get_dentists()
+                if not specialty or (d[2] or "").lower() == specialty.lower()]
+    ids = [d[0] for d in dentists]
+    full = (1 << len(AVAILABILITY.slots)) - 1
+    found = []
+    day = max(datetime.strptime(start, "%Y-%m-%d").date(), now.date())
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    while day <= last and len(found) < limit and ids:
+        chunk_end = min(last, day + timedelta(days=EARLIEST_CHUNK_DAYS - 1))
+        maps = AVAILABILITY.bitmaps_many(ids, day.isoformat(), chunk_end.isoformat())
+
+        def free(did, name, spec):
+            for date, bm in maps[did].items():
+                if bm == full:
+                    continue
+                for i, t in enumerate(AVAILABILITY.slots):
+                    if not bm >> i & 1 and (date != today or slot_clock[i] > clock):
+                        yield date, i, name, did, spec
+
+        for date, i, name, did, spec in itertools.islice(
+                heapq.merge(*(free(*d) for d in dentists)), limit - len(found)):
+            found.append({"dentist_id": did, "dentist": name, "specialty": spec,
+                          "date": date, "time": AVAILABILITY.slots[i]})
+        day = chunk_end + timedelta(days=1)
+    return found
+
+# ---------------- REFERENCE DATA CACHE ----------------
+class ReferenceCache:
+    """Read-through cache for small tables that rarely change (dentists, ...).
+
+    Writers in this process call invalidate(); writes from other processes
+    are picked up through the cache_version row that triggers bump, which is
+    re-read at most every `check_interval` seconds. Entries also expire after
+    `ttl` seconds as a fallback.
+    """
+
+    def __init__(self, ttl=300.0, check_interval=1.0):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}   # name -> [value, loaded_at, version, checked_at]
+        self._lock = threading.Lock()
+
+    def _db_version(self, name):
+        row = get_conn().execute(statement("cache_version"), (name,)).fetchone()
+        return row[0] if row else 0
+
+    def get(self, name, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None and now - entry[1] <= self.ttl:
+            if now - entry[3] < self.check_interval:
+                self.hits += 1
+                return entry[0]
+            if self._db_version(name) == entry[2]:
+                entry[3] = now
+                self.hits += 1
+                return entry[0]
+        self.misses += 1
+        version = self._db_version(name)
+        value = loader()
+        with self._lock:
+            self._entries[name] = [value, now, version, now]
+        return value
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "entries": sorted(self._entries),
+        }
+
+REFERENCE_CACHE = ReferenceCache(ttl=APP.config["REFERENCE_CACHE_TTL"],
+                                 check_interval=APP.config["REFERENCE_CACHE_CHECK"])
+
+# ---------------- CHANGE FEED ----------------
+def log_change(conn, entity, op, ids, **data):
+    # Call inside the write transaction, so the event commits (and gets its
+    # seq) with the change itself. Old rows are trimmed as new ones arrive.
+    c = conn.execute(statement("log_change"), (entity, op, json.dumps(list(ids)),
+                                               json.dumps(data) if data else None,
+                                               datetime.utcnow().isoformat()))
+    conn.execute(statement("prune_changes"), (c.lastrowid - APP.config["CHANGE_FEED_KEEP"],))
+
+class ChangeFeed:
+    """In-process tail of change_log. Writers call notify() after committing,
+    which pulls their event (and anything other workers committed before it)
+    right away; waiting subscribers poll every `poll_interval` to pick up
+    other workers' writes. Reads use their own short-lived pool connection,
+    so an open event stream never holds one."""
+
+    def __init__(self, keep=1000, poll_interval=1.0):
+        self.keep = keep
+        self.poll_interval = poll_interval
+        self._events = OrderedDict()   # seq -> event, oldest first
+        self._last_seq = None          # newest seq pulled from change_log
+        self._floor = None             # every event after this seq is held
+        self._polled_at = 0.0
+        self._cond = threading.Condition()
+        self._sync_lock = threading.Lock()
+
+    def sync(self):
+        with self._sync_lock:
+            pool = get_pool()
+            conn = pool.acquire()
+            try:
+                if self._last_seq is None:
+                    # start from what change_log still holds rather than its
+                    # head: a subscriber whose cursor came from another worker
+                    # can resume here instead of starting over
+                    rows = conn.execute(statement("change_tail"), (self.keep,)).fetchall()
+                    head = rows[0][0] - 1 if rows else conn.execute(statement("last_change")).fetchone()[0] or 0
+                else:
+                    rows = conn.execute(statement("changes_since"), (self._last_seq,)).fetchall()
+            finally:
+                pool.release(conn)
+            with self._cond:
+                if self._last_seq is None:
+                    self._last_seq = self._floor = head
+                for seq, entity, op, ids, data in rows:
+                    self._events[seq] = {"seq": seq, "entity": entity, "op": op, "ids": json.loads(ids),
+                                         "data": json.loads(data) if data else {}}
+                    self._last_seq = seq
+                while len(self._events) > self.keep:
+                    self._floor, _ = self._events.popitem(last=False)
+                self._polled_at = time.monotonic()
+                self._cond.notify_all()
+
+    notify = sync
+
+    def head(self):
+        if self._last_seq is None:
+            self.sync()
+        return self._last_seq
+
+    def wait(self, after, timeout):
+        """Events with seq > after, blocking up to `timeout` seconds for the
+        first one ([] if none came). None if events after `after` have
+        already been dropped, and the subscriber has to start over."""
+        self.head()
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if after < self._floor:
+                    return None
+                ready = []
+                for seq in reversed(self._events):
+                    if seq <= after:
+                        break
+                    ready.append(self._events[seq])
+                if ready:
+                    ready.reverse()
+                    return ready
+                now = time.monotonic()
+                if now >= deadline:
+                    return []
+                until_poll = self._polled_at + self.poll_interval - now
+                if until_poll > 0:
+                    self._cond.wait(min(until_poll, deadline - now))
+                    continue
+            self.sync()
+
+    def reset(self):
+        with self._cond:
+            self._events.clear()
+            self._last_seq = self._floor = None
+
+CHANGES = ChangeFeed(keep=APP.config["CHANGE_FEED_KEEP"], poll_interval=APP.config["CHANGE_FEED_POLL"])
+
+def public_event(event):
+    # a change event as subscribers see it, with public ids
+    data = dict(event["data"])
+    if "dentist_id" in data:
+        data["dentist_id"] = public_id("dentist", data["dentist_id"])
+    return dict(event, ids=[public_id(event["entity"], i) for i in event["ids"]], data=data)
+
+# ---------------- PUBLIC IDS ----------------
+# Rows are keyed by small sequential integers, which would let anyone count
+# or walk the appointments. URLs and the APIs carry an opaque 11-character
+# token instead: the id run through a keyed 64-bit Feistel permutation, then
+# base64url. Nothing is stored; decoding is the same few hashes in reverse.
+# Uuids from before migration 12 still resolve, through legacy_ids.
+PUBLIC_ID_ROUNDS = 4
+_PUBLIC_ID_RE = re.compile(r"[A-Za-z0-9_-]{11}")
+
+@functools.lru_cache(maxsize=16)
+def _public_id_key(secret, kind):
+    return hashlib.blake2b(f"{kind}:{secret}".encode(), digest_size=32).digest()
+
+def _feistel_round(key, i, half):
+    digest = hashlib.blake2b(half.to_bytes(4, "big") + bytes([i]), key=key, digest_size=4).digest()
+    return int.from_bytes(digest, "big")
+
+@functools.lru_cache(maxsize=65536)
+def _encode_id(key, n):
+    left, right = n >> 32, n & 0xFFFFFFFF
+    for i in range(PUBLIC_ID_ROUNDS):
+        left, right = right, left ^ _feistel_round(key, i, right)
+    return base64.urlsafe_b64encode((left << 32 | right).to_bytes(8, "big")).decode().rstrip("=")
+
+def _decode_id(key, token):
+    if not _PUBLIC_ID_RE.fullmatch(token):
+        return None
+    x = int.from_bytes(base64.urlsafe_b64decode(token + "="), "big")
+    left, right = x >> 32, x & 0xFFFFFFFF
+    for i in reversed(range(PUBLIC_ID_ROUNDS)):
+        left, right = right ^ _feistel_round(key, i, left), left
+    n = left << 32 | right
+    # the last character carries 2 spare bits; only the canonical spelling counts
+    if not 0 < n < 1 << 63 or _encode_id(key, n) != token:
+        return None
+    return n
+
+def public_id(kind, n):
+    """Opaque url-safe id of row `n` of `kind` (appointment, dentist, patient, user)."""
+    return _encode_id(_public_id_key(APP.config["PUBLIC_ID_KEY"] or APP.secret_key, kind), n)
+
+def parse_id(kind, token):
+    """Row id behind a public id or a pre-migration uuid; None if it names nothing."""
+    token = str(token or "").strip()
+    n = _decode_id(_public_id_key(APP.config["PUBLIC_ID_KEY"] or APP.secret_key, kind), token)
+    if n is None and token:
+        row = get_conn().execute(statement("legacy_id"), (kind, token)).fetchone()
+        n = row[0] if row else None
+    return n
+
+APP.add_template_filter(lambda n, kind: public_id(kind, n), "public_id")
+
+# ---------------- AUTH THROTTLING ----------------
+class Overloaded(Exception):
+    """Work refused to protect capacity; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class TokenBuckets:
+    """Per-key rate limits: each key may spend `burst` tokens at once, and
+    gets `rate` back per second. Keys past `max_keys` are dropped oldest
+    first; a dropped key is the same as a full bucket."""
+
+    def __init__(self, burst, rate, max_keys=10000):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """0 if a token was taken, else the seconds until one is due."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+class BoundedExecutor:
+    """Runs cpu-heavy calls (password hashing) on `workers` threads with at
+    most `queue` more waiting. Past that, submit() raises Overloaded at once
+    rather than queueing, so a burst of logins costs a bounded amount of cpu
+    and the request threads serving bookings keep theirs."""
+
+    def __init__(self, workers=2, queue=8, timeout=5.0, name="hash"):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._pending = 0
+        self._avg = 0.1      # moving average of seconds per call, for Retry-After
+        self._lock = threading.Lock()
+
+    def _call(self, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._avg += (time.perf_counter() - started - self._avg) * 0.2
+                self._pending -= 1
+            self._slots.release()
+
+    def retry_after(self):
+        with self._lock:
+            return max(1, math.ceil(self._avg * self._pending / self.workers))
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded(self.retry_after())
+        with self._lock:
+            self._pending += 1
+        return self._executor.submit(self._call, fn, args)
+
+    def run(self, fn, *args):
+        """fn(*args) on a pool thread; Overloaded if it can't be queued or
+        doesn't finish within `timeout` (the call itself still completes)."""
+        future = self.submit(fn, *args)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise Overloaded(self.retry_after()) from None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+def _auth_limits():
+    cfg = APP.config
+    return (TokenBuckets(cfg["AUTH_IP_BURST"], cfg["AUTH_IP_RATE"]),
+            TokenBuckets(cfg["AUTH_EMAIL_BURST"], cfg["AUTH_EMAIL_RATE"]),
+            BoundedExecutor(cfg["AUTH_HASH_WORKERS"], cfg["AUTH_HASH_QUEUE"], cfg["AUTH_HASH_TIMEOUT"]))
+
+AUTH_IP_LIMIT, AUTH_EMAIL_LIMIT, AUTH_HASHER = _auth_limits()
+auth_log = logging.getLogger("app.auth")
 
 # ---------------- USERS ----------------
 def register_user(name, email, password):
-    uid = str(uuid.uuid4())
-    hashed = generate_password_hash(password)
+    """New user's id. Raises Overloaded when the hashing pool is full."""
+    hashed = AUTH_HASHER.run(generate_password_hash, password, APP.config["PASSWORD_HASH_METHOD"])
     with get_conn() as conn:
         c = conn.cursor()
-        c.execute("INSERT INTO users (user_id,name,email,password) VALUES (?,?,?,?)",
-                  (uid, name, email, hashed))
-    return uid
+        c.execute(statement("insert_user"), (name, email, hashed))
+    return c.lastrowid
 
 def login_user(email, password):
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("SELECT user_id,name,password FROM users WHERE email=?", (email,))
-        user = c.fetchone()
-        if user and check_password_hash(user[2], password):
-            return user
+    """(user_id, name, hash) if the password matches, else None. Raises
+    Overloaded when the hashing pool is full. A hash made with another
+    PASSWORD_HASH_METHOD is redone in the background on success."""
+    user = get_conn().execute(statement("user_by_email"), (email,)).fetchone()
+    if user and AUTH_HASHER.run(check_password_hash, user[2], password):
+        if user[2].split("$", 1)[0] != APP.config["PASSWORD_HASH_METHOD"]:
+            try:
+                AUTH_HASHER.submit(_rehash_password, user[0], password)
+            except Overloaded:
+                pass   # next login tries again
+        return user
     return None
 
-# ---------- data access ----------
-def add_patient(name, age="", contact=""):
-    pid = str(uuid.uuid4())
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO patient (patient_id,name,age,contact) VALUES (?,?,?,?)",
-            (pid, name, age, contact)
-        )
-    return pid
-
-
-def add_patient(name, age="", contact=""):
-    pid = str(uuid.uuid4())
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO patient (patient_id,name,age,contact) VALUES (?,?,?,?)",
-            (pid, name, age, contact)
-        )
-    return pid
-
+def _rehash_password(user_id, password):
+    # runs on a hashing thread, outside any request, so it takes its own connection
+    hashed = generate_password_hash(password, APP.config["PASSWORD_HASH_METHOD"])
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        with conn:
+            conn.execute(statement("set_user_password"), (hashed, user_id))
+    except sqlite3.Error:
+        auth_log.exception("rehash of user %s failed", user_id)
+    finally:
+        pool.release(conn)
 
+# ---------- data access ----------
+@timed_query
 def add_dentist(name, specialty="General"):
-    did = str(uuid.uuid4())
     with get_conn() as conn:
         c = conn.cursor()
-        c.execute(
-            "INSERT INTO dentist (dentist_id,name,specialty) VALUES (?,?,?)",
-            (did, name, specialty)
-        )
+        c.execute(statement("insert_dentist"), (name, specialty))
+        did = c.lastrowid
+        log_change(conn, "dentist", "insert", [did], name=name, specialty=specialty)
+    REFERENCE_CACHE.invalidate("dentists")
+    CHANGES.notify()
     return did
 
 
-def get_dentists():
+@timed_query
+def _load_dentists():
     with get_conn() as conn:
         c = conn.cursor()
-        c.execute(
-            "SELECT dentist_id,name,specialty FROM dentist ORDER BY name"
-        )
+        c.execute(statement("list_dentists"))
         return c.fetchall()
 
 
+def get_dentists():
+    return REFERENCE_CACHE.get("dentists", _load_dentists)
+
+
+@timed_query
 def delete_dentist_by_id(did):
     with get_conn() as conn:
         c = conn.cursor()
-        c.execute(
-            "DELETE FROM dentist WHERE dentist_id = ?",
-            (did,)
-        )
+        c.execute(statement("delete_dentist"), (did,))
+        if c.rowcount:
+            log_change(conn, "dentist", "delete", [did])
+    REFERENCE_CACHE.invalidate("dentists")
+    CHANGES.notify()
 
-def add_appointment(patient_id, dentist_id, service, date, time_str):
-    aid = str(uuid.uuid4())
-    created_at = datetime.utcnow().isoformat()
-    with get_conn() as conn:
-        c = conn.cursor()
-        c.execute("""
-            INSERT INTO appointments
-            (appointment_id, patient_id, dentist_id, service, date, time, status, created_at)
-            VALUES (?,?,?,?,?,?,?,?)
-        """, (aid, patient_id, dentist_id, service, date, time_str, "pending", created_at))
-    return aid
+def fts_query(text):
+    # every word becomes a quoted prefix term, so user input can't inject fts syntax
+    return " ".join(f'"{t}"*' for t in re.findall(r"\w+", text))
+
+APPOINTMENT_COLUMNS = [
+    "a.appointment_id",
+    "p.name", "p.age", "p.contact",
+    "a.service", "a.date", "a.time",
+    "d.name", "d.specialty",
+    "a.status",
+]
 
-def get_appointments(search=""):
+def appointments_query(search="", after=None, limit=None, start=None, end=None, dentist_id=None,
+                       columns=None, history=False):
+    # Without a search, rows come back in (starts_at, appointment_id) order;
+    # with one, by fts relevance. Either way the sort key is appended as the
+    # last column, and `after` is (key, appointment_id) of the last row already
+    # seen, so each page is a seek. start/end are inclusive YYYY-MM-DD bounds
+    # on starts_at and, like dentist_id, resolve to an index range.
+    # `columns` must start with a.appointment_id (default APPOINTMENT_COLUMNS).
+    # With `history` the same query runs over the hot and archive tables and
+    # the two ordered halves are merged (UNION ALL); the CROSS JOINs keep each
+    # half driven by its appointments index even while the archive has no stats.
+    # Returns (sql, params), or None when the search can't match anything.
+    columns = columns or APPOINTMENT_COLUMNS
+    match = fts_query(search) if search else None
+    if search and not match:
+        return None
+    if not history:
+        q, params = _appointments_branch(columns, match, after, start, end, dentist_id)
+        sort_key = "f.rank" if search else "a.starts_at"
+        q += f" ORDER BY {sort_key}, a.appointment_id"
+    else:
+        hot, params = _appointments_branch(columns, match, after, start, end, dentist_id, "main.")
+        cold, more = _appointments_branch(columns, match, after, start, end, dentist_id, "archive.")
+        q = f"{hot} UNION ALL {cold} ORDER BY {len(columns) + 1}, 1"
+        params += more
+    if limit:
+        q += " LIMIT ?"
+        params.append(limit)
+    return q, params
+
+def _appointments_branch(columns, match, after, start, end, dentist_id, schema=""):
+    join = "CROSS JOIN" if schema else "JOIN"
+    cols = "SELECT " + ", ".join(columns)
+    joins = f"""
+        {join} patient p ON a.patient_id = p.patient_id
+        {join} dentist d ON a.dentist_id = d.dentist_id
+    """
+    where, params = [], []
+    if match:
+        q = cols + f", f.rank FROM {schema}appointment_fts f {join} {schema}appointments a ON a.rowid = f.rowid" + joins
+        where.append("f.appointment_fts MATCH ?" if schema else "appointment_fts MATCH ?")
+        params.append(match)
+        sort_key = "f.rank"
+    else:
+        q = cols + f", a.starts_at FROM {schema}appointments a" + joins
+        sort_key = "a.starts_at"
+    if dentist_id:
+        where.append("a.dentist_id = ?")
+        params.append(dentist_id)
+    if start:
+        where.append("a.starts_at >= ?")
+        params.append(start)
+    if end:
+        # end is inclusive: '~' sorts after the 'T' of any time on that day
+        where.append("a.starts_at < ?")
+        params.append(end + "~")
+    if after:
+        where.append(f"({sort_key}, a.appointment_id) > (?,?)")
+        params += list(after)
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    return q, params
+
+@timed_query
+def get_appointments(search="", after=None, limit=None, start=None, end=None, dentist_id=None,
+                     columns=None, history=False):
+    query = appointments_query(search, after, limit, start, end, dentist_id, columns, history)
+    if query is None:
+        return []
     with get_conn() as conn:
         c = conn.cursor()
-        q = """
-            SELECT a.appointment_id,
-                   p.name, p.age, p.contact,
-                   a.service, a.date, a.time,
-                   d.name, d.specialty,
-                   a.status
-            FROM appointments a
-            JOIN patient p ON a.patient_id = p.patient_id
-            JOIN dentist d ON a.dentist_id = d.dentist_id
-        """
-        if search:
-            q += " WHERE p.name LIKE ? OR d.name LIKE ? OR a.service LIKE ?"
-            c.execute(q, (f"%{search}%", f"%{search}%", f"%{search}%"))
-        else:
-            c.execute(q)
-        return c.fetchall()
+        c.execute(*query)
+        rows = c.fetchall()
+        if not search:
+            # recurring occurrences without a row of their own join the schedule;
+            # on a full page only those up to its last row's day can make it in
+            if limit and len(rows) == limit:
+                end = min(end or "9999-12-31", rows[-1][-1][:10])
+            more = occurrence_rows(conn, columns, after, limit, start, end, dentist_id)
+            if more:
+                rows = sorted(rows + more, key=lambda r: (r[-1], r[0]))[:limit]
+        return rows
 
-def update_appointment_status(aid, status):
-		with get_conn() as conn:
-				c = conn.cursor()
-				c.execute("UPDATE appointments SET status = ? WHERE id = ?", (status, aid))
+def iter_appointments(search="", start=None, end=None, dentist_id=None, chunk_size=1000, history=False):
+    # Same rows as get_appointments, pulled from the cursor in chunks so a full
+    # export never sits in memory at once.
+    query = appointments_query(search, start=start, end=end, dentist_id=dentist_id, history=history)
+    if query is None:
+        return
+    occurrences = () if search else iter_occurrence_rows(get_conn(), start=start, end=end,
+                                                         dentist_id=dentist_id, chunk_size=chunk_size)
+    c = get_conn().cursor()
+    c.execute(*query)
+
+    def chunks():
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+    yield from heapq.merge(chunks(), occurrences, key=lambda r: (r[-1], r[0]))
+
+# ---------- pagination ----------
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(key):
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+    except ValueError:
+        return None
+    # (starts_at or search rank, appointment id); anything else was not made here
+    if not isinstance(key, list) or len(key) != 2:
+        return None
+    sort_key, aid = key
+    if isinstance(sort_key, bool) or not isinstance(sort_key, (str, int, float)):
+        return None
+    if isinstance(aid, bool) or not isinstance(aid, int):
+        return None
+    return sort_key, aid
+
+def get_appointments_page(search="", cursor=None, page_size=PAGE_SIZE, start=None, end=None,
+                          dentist_id=None, columns=None, history=False):
+    after = decode_cursor(cursor)
+    # a search cursor carries a numeric rank, a schedule cursor a timestamp
+    if after and isinstance(after[0], str) == bool(search):
+        after = None
+    rows = get_appointments(search, after=after, limit=page_size + 1, start=start, end=end,
+                            dentist_id=dentist_id, columns=columns, history=history)
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor((last[-1], last[0]))
+    return rows, next_cursor
+
+def date_args():
+    # inclusive YYYY-MM-DD range from ?from=&to=; anything else is ignored
+    bounds = []
+    for name in ("from", "to"):
+        value = request.args.get(name, "").strip()
+        try:
+            bounds.append(datetime.strptime(value, "%Y-%m-%d").date().isoformat())
+        except ValueError:
+            bounds.append(None)
+    return tuple(bounds)
+
+def history_arg():
+    # ?history=1 widens appointment reads to the archive
+    return request.args.get("history", "") in ("1", "true", "on")
+
+def page_args():
+    try:
+        per_page = int(request.args.get("per_page", PAGE_SIZE))
+    except ValueError:
+        per_page = PAGE_SIZE
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+    return request.args.get("after", ""), per_page
+
+def _appointment_slot(c, aid):
+		c.execute(statement("appointment_slot"), (aid,))
+		return c.fetchone()
+
+@timed_query
 def delete_appointment(aid):
+		# None, or why the appointment wasn't deleted. A series' occurrence
+		# can't be removed without its rule bringing it back, so deleting one
+		# cancels it instead, which the state machine may refuse
+		link = None if aid >= OCCURRENCE_ID_BASE else \
+				get_conn().execute(statement("appointment_series_link"), (aid,)).fetchone()
+		if aid >= OCCURRENCE_ID_BASE or (link and link[0]):
+				return change_statuses([aid], "cancelled")[aid]
 		with get_conn() as conn:
 				c = conn.cursor()
-				c.execute("DELETE FROM appointments WHERE id = ?", (aid,))
+				slot = _appointment_slot(c, aid)
+				c.execute(statement("delete_appointment"), (aid,))
+				if slot:
+						log_change(conn, "appointment", "delete", [aid])
+		if slot:
+				AVAILABILITY.invalidate(slot[0], slot[1])
+				CHANGES.notify()
+		return None if slot else "Not found"
+
+def _insert_booking(conn, name, age, contact, dentist_id, service, date, time_str):
+    # find-or-create the patient and insert the appointment inside the
+    # caller's transaction; IntegrityError if the slot is taken, by a row
+    # (the unique index) or by a recurring occurrence
+    if series_holds_slot(conn, dentist_id, date, time_str):
+        raise sqlite3.IntegrityError("slot held by a recurring series")
+    pid = _patient_id(conn, name, age, contact)
+    c = conn.cursor()
+    c.execute(statement("insert_appointment"),
+              (pid, dentist_id, service, date, time_str, "pending", datetime.utcnow().isoformat(),
+               canonical_start(date, time_str)))
+    aid = c.lastrowid
+    log_change(conn, "appointment", "insert", [aid], dentist_id=dentist_id, date=date, time=time_str)
+    return aid
+
+@timed_query
+def book_appointment(name, age, contact, dentist_id, service, date, time_str):
+    """Find-or-create the patient and insert the appointment in one write
+    transaction. Returns the new appointment id, or None if the slot is taken.
+    With BOOKING_GROUP_COMMIT the transaction is shared with the other
+    bookings queued at the same moment (see BookingWriter), and Overloaded
+    is raised when the queue is full or the writer doesn't answer within
+    BOOKING_WRITE_TIMEOUT. The date may be in any of the
+    DATE_FORMATS and the time any spelling of a TIME_SLOTS entry; both are
+    stored canonical, and anything else raises ValueError."""
+    date, time_str = normalise_date(date), normalise_slot(time_str)
+    if date is None:
+        raise ValueError("Unknown date")
+    if time_str is None:
+        raise ValueError("Unknown time slot")
+    if APP.config["BOOKING_GROUP_COMMIT"]:
+        future = BOOKING_WRITER.submit(name, age, contact, dentist_id, service, date, time_str)
+        try:
+            return future.result(APP.config["BOOKING_WRITE_TIMEOUT"])
+        except FutureTimeout:
+            # a booking the writer hasn't picked up yet is dropped; one it is
+            # already writing may still go through
+            future.cancel()
+            raise Overloaded(1) from None
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        aid = _insert_booking(conn, name, age, contact, dentist_id, service, date, time_str)
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        AVAILABILITY.mark(dentist_id, date, time_str)
+        return None
+    except Exception:
+        conn.rollback()
+        raise
+    AVAILABILITY.mark(dentist_id, date, time_str)
+    CHANGES.notify()
+    return aid
+
+booking_log = logging.getLogger("app.booking")
+
+class BookingWriter:
+    """Group commit for bookings. Request threads queue their booking and
+    wait on a Future; one writer thread takes whatever has queued up (up to
+    `batch_size`, waiting at most `max_wait` for more after the first) and
+    applies it in a single transaction, so a burst pays one commit and one
+    trip through the write lock per batch instead of per booking. Each
+    booking runs under its own savepoint: one that hits a taken slot
+    (including a slot taken earlier in the same batch) resolves to None
+    and the rest still commit. If the transaction itself fails, every
+    booking in it gets the error. Futures are resolved as soon as the
+    transaction ends; one cancelled before its batch starts is skipped."""
+
+    def __init__(self, batch_size=64, max_wait=0.001, limit=2000):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = Queue(maxsize=limit)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, *booking):
+        """Future for _insert_booking(conn, *booking): the appointment id,
+        or None if the slot is taken. Overloaded if the queue is full."""
+        future = Future()
+        try:
+            self._queue.put_nowait((booking, future))
+        except Full:
+            raise Overloaded(1) from None
+        # started on first use, so it runs in the process that books (a
+        # thread doesn't survive fork)
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="booking-writer", daemon=True)
+                    self._thread.start()
+        return future
+
+    def stop(self):
+        """Let the writer finish what is queued, then exit."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._apply(batch)
+            except Exception as e:
+                # the writer must outlive a bad batch, and nobody may be left waiting
+                booking_log.exception("booking batch failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _apply(self, batch):
+        batch = [(booking, future) for booking, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        pool = get_pool()
+        conn = None
+        results = []
+        committed = False
+        try:
+            conn = pool.acquire()
+            with query_timer("booking_batch"):
+                conn.execute("BEGIN IMMEDIATE")
+                for booking, _ in batch:
+                    conn.execute("SAVEPOINT booking")
+                    try:
+                        results.append(_insert_booking(conn, *booking))
+                    except sqlite3.IntegrityError:
+                        conn.execute("ROLLBACK TO booking")
+                        results.append(None)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO booking")
+                        results.append(e)
+                    conn.execute("RELEASE booking")
+                conn.commit()
+                committed = True
+        except Exception as e:
+            if conn is not None:
+                conn.rollback()
+            results = [e] * len(batch)
+        finally:
+            if conn is not None:
+                pool.release(conn)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        if not committed:
+            return
+        # cache and feed upkeep; the bookings are already answered
+        try:
+            METRICS.inc("booking_batches_total")
+            METRICS.inc("booking_batch_items_total", len(batch))
+            # a rolled-back booking (taken slot or error) leaves its slot as it was
+            for (booking, _), result in zip(batch, results):
+                if result is not None and not isinstance(result, Exception):
+                    AVAILABILITY.mark(booking[3], booking[5], booking[6])
+            CHANGES.notify()
+        except Exception:
+            booking_log.exception("post-commit bookkeeping failed")
+
+def _booking_writer():
+    cfg = APP.config
+    return BookingWriter(cfg["BOOKING_BATCH_SIZE"], cfg["BOOKING_BATCH_WAIT"], cfg["BOOKING_QUEUE_LIMIT"])
+
+BOOKING_WRITER = _booking_writer()
+
+APPOINTMENT_STATUSES = ("pending", "approved", "completed", "cancelled")
+STATUS_TRANSITIONS = {
+    "pending": {"approved", "cancelled"},
+    "approved": {"completed", "cancelled"},
+    "completed": set(),
+    "cancelled": set(),
+}
+MAX_BATCH = 500
+
+@timed_query
+def change_statuses(aids, status):
+    """Move every appointment in `aids` to `status` in one write transaction,
+    skipping those the state machine doesn't allow. Returns {aid: error or None}."""
+    results = {}
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # an occurrence id stands for its exception row once it has one;
+        # one without gets that row written here, with the new status
+        rowids, occurrences = {}, {}
+        for aid in aids:
+            occurrence = _occurrence(conn, aid) if aid >= OCCURRENCE_ID_BASE else (aid,)
+            if occurrence and occurrence[0]:
+                rowids[aid] = occurrence[0]
+            elif occurrence:
+                occurrences[aid] = occurrence
+        current = {row[0]: row[1:] for row in conn.execute(
+            statement("appointment_states", marks=len(rowids)), list(rowids.values()))}
+        for aid, (_, series, _, day) in occurrences.items():
+            current[aid] = (series[10], series[2], day, series[4])
+        todo = []
+        for aid in aids:
+            key = rowids.get(aid, aid)
+            row = current.get(key)
+            if row is None:
+                results[aid] = "Not found"
+            elif status not in STATUS_TRANSITIONS.get(row[0], ()):
+                results[aid] = f"Cannot go from {row[0]} to {status}"
+            else:
+                results[aid] = None
+                todo.append(key)
+        conn.executemany(statement("set_appointment_status"),
+                         [(status, key) for key in todo if key not in occurrences])
+        for key in todo:
+            if key in occurrences:
+                _materialise(conn, occurrences[key], status)
+        if todo:
+            log_change(conn, "appointment", "update", todo, status=status)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for aid in todo:
+        _, dentist_id, date, time_str = current[aid]
+        if status == "cancelled":
+            AVAILABILITY.invalidate(dentist_id, date)
+        else:
+            AVAILABILITY.mark(dentist_id, date, time_str)
+    if todo:
+        CHANGES.notify()
+    return results
+
+# ---------- recurring series ----------
+# A series (say braces adjustments every 4 weeks for two years) is one
+# appointment_series row: the slot, the first date, the interval and how many
+# occurrences. Occurrences are computed for whatever date window is asked for
+# and share the appointment id space from OCCURRENCE_ID_BASE up, so they list,
+# link and take actions like any appointment. Changing one (a status, a move,
+# a delete) writes its exception row, an ordinary appointment carrying
+# (series_id, occurrence); from then on the occurrence id names that row.
+OCCURRENCE_ID_BASE = 1 << 62
+MAX_SERIES_OCCURRENCES = 520
+SERIES_STATUSES = ("approved", "cancelled")
+
+def occurrence_id(series_id, k):
+    return OCCURRENCE_ID_BASE | series_id << 16 | k
+
+def split_occurrence_id(aid):
+    return (aid - OCCURRENCE_ID_BASE) >> 16, aid & 0xFFFF
+
+def _iso_day(value):
+    # strict YYYY-MM-DD; fromisoformat alone would take other shapes
+    if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", value or ""):
+        raise ValueError(f"not a YYYY-MM-DD date: {value!r}")
+    return datetime.fromisoformat(value).date()
+
+@functools.lru_cache(maxsize=64)
+def _slot_clock(time_str):
+    return canonical_start("2000-01-01", time_str)[10:]
+
+def series_dates(first, interval, last, start=None, end=None):
+    """(k, YYYY-MM-DD) of the occurrences from `first` to `last` every
+    `interval` days that fall in [start, end] (None: unbounded), generated
+    in order."""
+    lo, hi = max(first, start or first), min(last, end or last)
+    if lo > hi:
+        return
+    # stored and already-checked dates; fromisoformat is far cheaper than strptime
+    d0 = datetime.fromisoformat(first).date()
+    k0 = -(-(datetime.fromisoformat(lo).date() - d0).days // interval)
+    k1 = (datetime.fromisoformat(hi).date() - d0).days // interval
+    for k in range(k0, k1 + 1):
+        yield k, (d0 + timedelta(days=k * interval)).isoformat()
+
+def expand_series(conn, start=None, end=None, dentist_id=None):
+    """Occurrences without a row of their own, of every series overlapping
+    [start, end] (inclusive YYYY-MM-DD, None: unbounded), generated lazily
+    in (starts_at, id) order as (starts_at, id, series_id, dentist_id, date,
+    time, status) tuples. Cancelled ones are included."""
+    lo, hi = start or "0000-01-01", end or "9999-12-31"
+    bounds = (lo, hi, hi, lo)
+    if dentist_id:
+        series = conn.execute(statement("dentist_series_between"), (dentist_id,) + bounds).fetchall()
+    else:
+        series = conn.execute(statement("series_between"), bounds).fetchall()
+    if not series:
+        return iter(())
+    changed = set(conn.execute(statement("series_exceptions"), (json.dumps([s[0] for s in series]),)))
+
+    def occurrences(sid, did, time_str, first, interval, last, status):
+        clock = _slot_clock(time_str)
+        for k, day in series_dates(first, interval, last, start, end):
+            if (sid, k) not in changed:
+                yield day + clock, occurrence_id(sid, k), sid, did, day, time_str, status
+
+    return heapq.merge(*(occurrences(*s) for s in series))
+
+def series_holds_slot(conn, dentist_id, date, time_str):
+    """True if an active occurrence without a row of its own sits in the slot."""
+    if not re.fullmatch(r"\d{4}-\d{2}-\d{2}", date or ""):
+        return False
+    return any(o[5] == time_str and o[6] != "cancelled"
+               for o in expand_series(conn, date, date, dentist_id))
+
+def occurrence_rows(conn, columns=None, after=None, limit=None, start=None, end=None, dentist_id=None):
+    """Listing rows for the occurrences without a row of their own, shaped
+    and ordered like get_appointments() without a search."""
+    if after and isinstance(after[0], str):
+        # nothing before the cursor's day can come after it
+        start = max(start or "", after[0][:10])
+    occurrences = expand_series(conn, start, end, dentist_id)
+    if after:
+        occurrences = itertools.dropwhile(lambda o: (o[0], o[1]) <= tuple(after), occurrences)
+    occurrences = list(itertools.islice(occurrences, limit))
+    return _occurrence_fields(conn, occurrences, columns) if occurrences else []
+
+def iter_occurrence_rows(conn, start=None, end=None, dentist_id=None, chunk_size=1000):
+    """occurrence_rows() for a whole range, generated `chunk_size` occurrences
+    at a time, so an export holds one chunk rather than every occurrence."""
+    occurrences = expand_series(conn, start, end, dentist_id)
+    while True:
+        chunk = list(itertools.islice(occurrences, chunk_size))
+        if not chunk:
+            return
+        yield from _occurrence_fields(conn, chunk)
+
+def _occurrence_fields(conn, occurrences, columns=None):
+    # listing rows for expand_series() tuples, in (starts_at, id) order
+    payload = json.dumps([[aid, day, starts, sid] for starts, aid, sid, _, day, _, _ in occurrences])
+    rows = conn.execute(statement("occurrence_fields", columns=", ".join(columns or APPOINTMENT_COLUMNS)),
+                        (payload,)).fetchall()
+    rows.sort(key=lambda r: (r[-1], r[0]))
+    return rows
+
+def _occurrence(conn, aid):
+    # (exception row id or None, series row, k, date) for an occurrence id;
+    # None if the series doesn't exist or has no occurrence k
+    sid, k = split_occurrence_id(aid)
+    series = conn.execute(statement("series"), (sid,)).fetchone()
+    if series is None:
+        return None
+    first, interval, last = series[5], series[6], series[9]
+    day = (_iso_day(first) + timedelta(days=k * interval)).isoformat()
+    if day > last:
+        return None
+    row = conn.execute(statement("series_exception"), (sid, k)).fetchone()
+    return (row[0] if row else None), series, k, day
+
+def _materialise(conn, occurrence, status, date=None, time_str=None):
+    # write the exception row for a virtual occurrence; IntegrityError if
+    # the (new) slot is taken
+    _, series, k, day = occurrence
+    sid, patient_id, dentist_id, service, slot = series[:5]
+    date, time_str = date or day, time_str or slot
+    c = conn.execute(statement("insert_occurrence"),
+                     (patient_id, dentist_id, service, date, time_str, status, datetime.utcnow().isoformat(),
+                      canonical_start(date, time_str), sid, k))
+    return c.lastrowid
+
+def occurrence_record(conn, occurrence, columns):
+    # one occurrence without a row as an appointment_fields row (plus starts_at)
+    _, series, k, day = occurrence
+    payload = json.dumps([[occurrence_id(series[0], k), day, canonical_start(day, series[4]), series[0]]])
+    return conn.execute(statement("occurrence_fields", columns=columns), (payload,)).fetchone()
+
+def _patient_id(conn, name, age, contact):
+    row = conn.execute(statement("find_patient_by_name"), (name,)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute(statement("insert_patient"), (name, age, contact)).lastrowid
+
+@timed_query
+def create_series(name, age, contact, dentist_id, service, first_date, time_str, interval_days,
+                  count=None, until=None):
+    """Book a recurring appointment: `count` occurrences, or as many as fit
+    up to `until`, every `interval_days` from `first_date` at `time_str`.
+    Returns (series_id, None), or (None, [taken dates]) when any occurrence
+    would land on a booked slot, in which case nothing is written. Raises
+    ValueError for a rule that can't be booked."""
+    try:
+        d0 = _iso_day(first_date)
+        end = _iso_day(until) if until else None
+    except ValueError:
+        raise ValueError("Dates must be YYYY-MM-DD") from None
+    if time_str not in TIME_SLOTS:
+        raise ValueError("Unknown time slot")
+    if not 1 <= interval_days <= 365:
+        raise ValueError("Interval must be 1-365 days")
+    n = count if count else (end - d0).days // interval_days + 1 if end else 0
+    if not 2 <= n <= MAX_SERIES_OCCURRENCES:
+        raise ValueError(f"A series needs 2-{MAX_SERIES_OCCURRENCES} occurrences")
+    last = (d0 + timedelta(days=(n - 1) * interval_days)).isoformat()
+    dates = [day for _, day in series_dates(first_date, interval_days, last)]
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        taken = {day for day, t in conn.execute(statement("booked_slots"),
+                                                (dentist_id, first_date, last + "~"))
+                 if t == time_str}
+        taken.update(o[4] for o in expand_series(conn, first_date, last, dentist_id)
+                     if o[5] == time_str and o[6] != "cancelled")
+        conflicts = [day for day in dates if day in taken]
+        if conflicts:
+            conn.rollback()
+            return None, conflicts
+        pid = _patient_id(conn, name, age, contact)
+        sid = conn.execute(statement("insert_series"),
+                           (pid, dentist_id, service, time_str, first_date, interval_days, count or None,
+                            until or None, last, "pending", datetime.utcnow().isoformat())).lastrowid
+        log_change(conn, "appointment", "insert", [occurrence_id(sid, 0)], dentist_id=dentist_id,
+                   date=first_date, time=time_str, series=n)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for day in dates:
+        AVAILABILITY.mark(dentist_id, day, time_str)
+    CHANGES.notify()
+    return sid, None
+
+@timed_query
+def get_series(sid):
+    """The series row as a dict, or None."""
+    row = get_conn().execute(statement("series"), (sid,)).fetchone()
+    if row is None:
+        return None
+    keys = ("id", "patient_id", "dentist_id", "service", "time", "first_date", "interval_days", "count",
+            "until", "last_date", "status", "created_at")
+    series = dict(zip(keys, row))
+    series["occurrences"] = sum(1 for _ in series_dates(series["first_date"], series["interval_days"],
+                                                       series["last_date"]))
+    return series
+
+@timed_query
+def set_series_status(sid, status):
+    """Approve or cancel every occurrence of the series that has no row of
+    its own. Returns an error message or None."""
+    if status not in SERIES_STATUSES:
+        return f"status must be one of {', '.join(SERIES_STATUSES)}"
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        series = conn.execute(statement("series"), (sid,)).fetchone()
+        if series is None:
+            conn.rollback()
+            return "Not found"
+        if status not in STATUS_TRANSITIONS.get(series[10], ()):
+            conn.rollback()
+            return f"Cannot go from {series[10]} to {status}"
+        conn.execute(statement("set_series_status"), (status, sid))
+        log_change(conn, "series", "update", [sid], status=status)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for _, day in series_dates(series[5], series[6], series[9]):
+        AVAILABILITY.invalidate(series[2], day)
+    CHANGES.notify()
+    return None
+
+@timed_query
+def move_appointment(aid, date, time_str):
+    """Move a pending or approved appointment (or occurrence) to another
+    slot. Returns an error message or None."""
+    try:
+        _iso_day(date)
+    except ValueError:
+        return "date must be YYYY-MM-DD"
+    if time_str not in TIME_SLOTS:
+        return "Unknown time slot"
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # a page may show an occurrence under its occurrence id or its
+        # exception row's id; the event names both
+        ids = [aid]
+        occurrence = None
+        if aid >= OCCURRENCE_ID_BASE:
+            occurrence = _occurrence(conn, aid)
+            if occurrence is None:
+                conn.rollback()
+                return "Not found"
+            if occurrence[0]:
+                aid, occurrence = occurrence[0], None
+                ids.append(aid)
+        if occurrence:
+            series = occurrence[1]
+            old = (series[10], series[2], occurrence[3], series[4])
+        else:
+            old = conn.execute(statement("appointment_move_state"), (aid,)).fetchone()
+            if old is None:
+                conn.rollback()
+                return "Not found"
+        status, dentist_id = old[0], old[1]
+        if status not in ("pending", "approved"):
+            conn.rollback()
+            return f"Cannot move a {status} appointment"
+        if series_holds_slot(conn, dentist_id, date, time_str):
+            conn.rollback()
+            return "Slot already taken"
+        if occurrence:
+            ids.append(_materialise(conn, occurrence, status, date, time_str))
+        else:
+            conn.execute(statement("move_appointment"), (date, time_str, canonical_start(date, time_str), aid))
+        log_change(conn, "appointment", "move", ids, status=status, date=date, time=time_str)
+        conn.commit()
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return "Slot already taken"
+    except Exception:
+        conn.rollback()
+        raise
+    AVAILABILITY.invalidate(dentist_id, old[2])
+    AVAILABILITY.mark(dentist_id, date, time_str)
+    CHANGES.notify()
+    return None
+
+# ---------- stats ----------
+@timed_query
+def status_counts(start, end, dentist_id=None):
+    """[(day, dentist_id, status, count)] for the inclusive YYYY-MM-DD range,
+    read from the trigger-maintained appointment_counts table, plus the
+    recurring occurrences that have no row to count."""
+    if dentist_id:
+        rows = get_conn().execute(statement("dentist_status_counts"), (start, end, dentist_id)).fetchall()
+    else:
+        rows = get_conn().execute(statement("status_counts"), (start, end)).fetchall()
+    counts = None
+    for _, _, _, did, day, _, status in expand_series(get_conn(), start, end, dentist_id):
+        if counts is None:
+            counts = {row[:3]: row[3] for row in rows}
+        counts[(day, did, status)] = counts.get((day, did, status), 0) + 1
+    return rows if counts is None else [key + (n,) for key, n in sorted(counts.items())]
+
+def dashboard_stats(today=None):
+    """Headline numbers for the moderator dashboard: pending approvals today,
+    and per dentist this week (Mon-Sun) the booked share of the slot grid and
+    cancellations."""
+    today = today or datetime.now().date()
+    week_start = today - timedelta(days=today.weekday())
+    week_end = week_start + timedelta(days=6)
+    capacity = len(TIME_SLOTS) * 7
+    names = {d[0]: d[1] for d in get_dentists()}
+    per_dentist = {did: {"booked": 0, "cancelled": 0} for did in names}
+    pending_today = 0
+    for day, did, status, n in status_counts(week_start.isoformat(), week_end.isoformat()):
+        counts = per_dentist.setdefault(did, {"booked": 0, "cancelled": 0})
+        if status == "cancelled":
+            counts["cancelled"] += n
+        else:
+            counts["booked"] += n
+        if status == "pending" and day == today.isoformat():
+            pending_today += n
+    dentists = [{"id": did, "name": names.get(did, "(removed)"), "booked": c["booked"], "cancelled": c["cancelled"],
+                 "utilisation": round(c["booked"] / capacity, 4)}
+                for did, c in per_dentist.items()]
+    dentists.sort(key=lambda d: d["name"])
+    return {
+        "today": today.isoformat(),
+        "week": [week_start.isoformat(), week_end.isoformat()],
+        "pending_today": pending_today,
+        "booked_week": sum(d["booked"] for d in dentists),
+        "cancelled_week": sum(d["cancelled"] for d in dentists),
+        "dentists": dentists,
+    }
+
+# ---------- archive ----------
+archive_log = logging.getLogger("app.archive")
+
+@timed_query
+def archive_appointments(older_than_days=None, batch_size=None):
+    """Move completed and cancelled appointments that started more than
+    `older_than_days` ago into the archive db, `batch_size` rows per write
+    transaction so bookings aren't locked out for long. Each batch copies
+    before it deletes and the copy ignores rows already archived, so an
+    interrupted run is simply repeated. Returns the number of rows moved."""
+    days = APP.config["ARCHIVE_AFTER_DAYS"] if older_than_days is None else older_than_days
+    batch_size = batch_size or APP.config["ARCHIVE_BATCH_SIZE"]
+    cutoff = (datetime.now().date() - timedelta(days=days)).isoformat()
+    conn = get_conn()
+    moved = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [r[0] for r in conn.execute(statement("archive_candidates"), (cutoff, batch_size))]
+            if ids:
+                batch = json.dumps(ids)
+                conn.execute(statement("archive_copy"), (datetime.utcnow().isoformat(), batch))
+                conn.execute(statement("archive_fts_clear"), (batch,))
+                conn.execute(statement("archive_fts_copy"), (batch,))
+                # the delete trigger takes the rows out of appointment_counts;
+                # put them back, archived appointments still count
+                conn.execute(statement("archive_delete"), (batch,))
+                conn.execute(statement("archive_recount"), (batch,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved += len(ids)
+        if len(ids) < batch_size:
+            break
+    if moved:
+        # keep the archive's planner stats roughly current without reading all of it
+        conn.execute("PRAGMA archive.analysis_limit = 1000")
+        conn.execute("ANALYZE archive")
+        conn.commit()
+    return moved
+
+def start_archiver(interval):
+    """Run archive_appointments() every `interval` seconds on a daemon thread."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                moved = archive_appointments()
+                if moved:
+                    archive_log.info("archived %d appointments", moved)
+            except sqlite3.Error:
+                archive_log.exception("archive run failed")
+    thread = threading.Thread(target=loop, name="archiver", daemon=True)
+    thread.start()
+    return thread
 
 # ---------- Flask templates ----------
 BASE_TEMPLATE = """
@@ -386,7 +2683,13 @@ body {
 
 
 <div class="container-narrow my-4">
-	{{ content | safe }}
+	{% for category, message in get_flashed_messages(with_categories=true) %}
+	<div class="alert alert-{{ category }} alert-dismissible fade show" role="alert">
+		{{ message }}
+		<button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>
+	</div>
+	{% endfor %}
+	{% block content %}{% endblock %}
 </div>
 
 <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js"></script>
@@ -395,6 +2698,29 @@ body {
 """
 
 # Register and Log-in
+REGISTER_TEMPLATE = """{% extends "base.html" %}
+{% block content %}
+<h2>Register</h2>
+<form method="post">
+<div class="mb-2"><input class="form-control" name="name" placeholder="Name" required></div>
+<div class="mb-2"><input class="form-control" name="email" placeholder="Email" type="email" required></div>
+<div class="mb-2"><input class="form-control" name="password" placeholder="Password" type="password" required></div>
+<button class="btn btn-accent w-100">Register</button>
+<p class="mt-2">Already have an account? <a href="{{ url_for('login') }}">Login</a></p>
+</form>
+{% endblock %}
+"""
+
+def auth_refused(template, status, retry_after, reason):
+    # 429 for a client over its rate, 503 when hashing is saturated; either
+    # way the answer comes before any hashing work is done
+    METRICS.inc("auth_refused_total", reason=reason)
+    flash("Too many attempts, please try again later" if status == 429
+          else "The server is busy, please try again shortly", "danger")
+    resp = APP.make_response((render(template), status))
+    resp.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return resp
+
 @APP.route("/register", methods=["GET","POST"])
 def register():
     if request.method=="POST":
@@ -404,6 +2730,9 @@ def register():
         if not (name and email and password):
             flash("Fill all fields", "warning")
             return redirect(url_for("register"))
+        wait = AUTH_IP_LIMIT.take(request.remote_addr)
+        if wait:
+            return auth_refused("register.html", 429, wait, "ip")
         try:
             register_user(name,email,password)
             flash("Registration successful! Login now.", "success")
@@ -411,24 +2740,37 @@ def register():
         except sqlite3.IntegrityError:
             flash("Email already exists", "danger")
             return redirect(url_for("register"))
-    content = render_template_string("""
-<h2>Register</h2>
+        except Overloaded as e:
+            return auth_refused("register.html", 503, e.retry_after, "overloaded")
+    return render("register.html")
+
+LOGIN_TEMPLATE = """{% extends "base.html" %}
+{% block content %}
+<h2>Login</h2>
 <form method="post">
-<div class="mb-2"><input class="form-control" name="name" placeholder="Name" required></div>
 <div class="mb-2"><input class="form-control" name="email" placeholder="Email" type="email" required></div>
 <div class="mb-2"><input class="form-control" name="password" placeholder="Password" type="password" required></div>
-<button class="btn btn-accent w-100">Register</button>
-<p class="mt-2">Already have an account? <a href="{{ url_for('login') }}">Login</a></p>
+<button class="btn btn-accent w-100">Login</button>
+<p class="mt-2">Don't have an account? <a href="{{ url_for('register') }}">Register</a></p>
 </form>
-""")
-    return render_template_string(BASE_TEMPLATE, content=content)
+{% endblock %}
+"""
 
 @APP.route("/login", methods=["GET","POST"])
 def login():
     if request.method=="POST":
         email = request.form.get("email","").strip()
         password = request.form.get("password","").strip()
-        user = login_user(email,password)
+        wait = AUTH_IP_LIMIT.take(request.remote_addr)
+        if wait:
+            return auth_refused("login.html", 429, wait, "ip")
+        wait = AUTH_EMAIL_LIMIT.take(email.lower())
+        if wait:
+            return auth_refused("login.html", 429, wait, "email")
+        try:
+            user = login_user(email,password)
+        except Overloaded as e:
+            return auth_refused("login.html", 503, e.retry_after, "overloaded")
         if user:
             session["user_id"] = user[0]
             session["user_name"] = user[1]
@@ -437,16 +2779,7 @@ def login():
         else:
             flash("Invalid email or password", "danger")
             return redirect(url_for("login"))
-    content = render_template_string("""
-<h2>Login</h2>
-<form method="post">
-<div class="mb-2"><input class="form-control" name="email" placeholder="Email" type="email" required></div>
-<div class="mb-2"><input class="form-control" name="password" placeholder="Password" type="password" required></div>
-<button class="btn btn-accent w-100">Login</button>
-<p class="mt-2">Don't have an account? <a href="{{ url_for('register') }}">Register</a></p>
-</form>
-""")
-    return render_template_string(BASE_TEMPLATE, content=content)
+    return render("login.html")
 
 @APP.route("/logout")
 def logout():
@@ -455,38 +2788,13 @@ def logout():
     return redirect(url_for("home"))
 
 # Routes
-@APP.route("/book", methods=["GET", "POST"])
-def index():
-		dentists = get_dentists()
-		if request.method == "POST":
-				name = request.form.get("patient_name","").strip()
-				age = request.form.get("age","").strip()
-				contact = request.form.get("contact","").strip()
-				dentist_id = request.form.get("dentist","").strip()
-				service = request.form.get("service","").strip()
-				date = request.form.get("date","").strip()
-				time_slot = request.form.get("time","").strip()
-
-				if not (name and age and contact and dentist_id and service and date and time_slot):
-						flash("Please fill all fields", "warning")
-						return redirect(url_for("index"))
-
-				existing = find_patient_by_name(name)
-				if existing:
-						pid = existing[0]
-				else:
-						pid = add_patient(name, age, contact)
-
-				add_appointment(pid, dentist_id, service, date, time_slot)
-				flash("Appointment added — pending approval", "success")
-				return redirect(url_for("index"))
-
-		content = render_template_string("""
+BOOK_TEMPLATE = """{% extends "base.html" %}
+{% block content %}
 <div class="row g-4 align-items-start">
 	<div class="col-lg-4">
 		<div class="card p-4">
 			<h5 class="section-title">Book Appointment</h5>
-			<form method="get" action="{{ url_for('index') }}">
+			<form method="post" action="{{ url_for('index') }}">
 				<div class="mb-2">
 					<label class="form-label">Patient Name</label>
 					<input class="form-control" name="patient_name" required>
@@ -497,10 +2805,10 @@ def index():
 				</div>
 				<div class="mt-2">
 					<label class="form-label">Dentist</label>
-					<select name="dentist" class="form-select" required>
+					<select id="dentist_select" name="dentist" class="form-select" required>
 						<option value="">Select dentist</option>
 						{% for d in dentists %}
-							<option value="{{ d[0] }}">{{ d[1] }} ({{ d[2] }})</option>
+							<option value="{{ d[0]|public_id('dentist') }}">{{ d[1] }} ({{ d[2] }})</option>
 						{% endfor %}
 					</select>
 				</div>
@@ -518,9 +2826,9 @@ def index():
 					<input id="service_custom" name="service" class="form-control" placeholder="Or enter custom service">
 				</div>
 				<div class="row mt-2">
-					<div class="col"><label class="form-label">Date</label><input type="date" class="form-control" name="date" required></div>
+					<div class="col"><label class="form-label">Date</label><input id="date_input" type="date" class="form-control" name="date" required></div>
 					<div class="col"><label class="form-label">Time</label>
-						<select name="time" class="form-select" required>
+						<select id="time_select" name="time" class="form-select" required>
 							<option value="">Select</option>
 							{% for t in time_slots %}
 								<option value="{{ t }}">{{ t }}</option>
@@ -528,6 +2836,12 @@ def index():
 						</select>
 					</div>
 				</div>
+				<div class="row mt-2">
+					<div class="col"><label class="form-label">Repeat every (weeks)</label><input type="number" min="1" max="52" class="form-control" name="repeat_weeks" placeholder="No repeat"></div>
+					<div class="col"><label class="form-label">Visits</label><input type="number" min="2" max="520" class="form-control" name="repeat_count"></div>
+				</div>
+				<button type="button" class="btn btn-outline-primary w-100 mt-3" onclick="findEarliest()">Find earliest available</button>
+				<div id="earliestList" class="list-group mt-2"></div>
 				<button class="btn btn-accent w-100 mt-3">Book Appointment</button>
 			</form>
 			<p class="muted small mt-2 text-center">Clinic Hours: 08:00 AM – 06:00 PM</p>
@@ -558,6 +2872,10 @@ def index():
 					</tbody>
 				</table>
 			</div>
+			<div class="d-flex justify-content-end gap-2">
+				{% if request.args.get('after') %}<a class="btn btn-sm btn-outline-secondary" href="{{ url_for('index', per_page=per_page) }}">First page</a>{% endif %}
+				{% if next_cursor %}<a class="btn btn-sm btn-outline-primary" href="{{ url_for('index', after=next_cursor, per_page=per_page) }}">Next page</a>{% endif %}
+			</div>
 		</div>
 	</div>
 </div>
@@ -568,58 +2886,212 @@ const customBox = document.getElementById('service_custom');
 dropdown.addEventListener('change', () => {
 	if (!customBox.value) customBox.value = dropdown.value;
 });
+
+const dentistSel = document.getElementById('dentist_select');
+const dateInput = document.getElementById('date_input');
+const timeSel = document.getElementById('time_select');
+async function refreshSlots(){
+	if (!dentistSel.value || !dateInput.value) return;
+	const params = new URLSearchParams({ dentist: dentistSel.value, start: dateInput.value });
+	const res = await fetch('{{ url_for('api_availability') }}?' + params);
+	const j = await res.json();
+	if (!j.success) return;
+	const free = j.days[dateInput.value] || [];
+	timeSel.innerHTML = '<option value="">' + (free.length ? 'Select' : 'No free slots') + '</option>';
+	for (const t of free) timeSel.add(new Option(t, t));
+}
+dentistSel.addEventListener('change', refreshSlots);
+dateInput.addEventListener('change', refreshSlots);
+
+async function findEarliest(){
+	const list = document.getElementById('earliestList');
+	const params = new URLSearchParams({ service: customBox.value || dropdown.value, limit: 5 });
+	if (dateInput.value) params.set('from', dateInput.value);
+	const res = await fetch('{{ url_for('api_earliest_slots') }}?' + params);
+	const j = await res.json();
+	list.innerHTML = '';
+	if (!j.success || !j.data.length) {
+		list.innerHTML = '<div class="list-group-item small text-muted">No free slots found</div>';
+		return;
+	}
+	for (const s of j.data) {
+		const item = document.createElement('button');
+		item.type = 'button';
+		item.className = 'list-group-item list-group-item-action small';
+		item.textContent = `${s.date} ${s.time} · ${s.dentist} (${s.specialty})`;
+		item.onclick = async () => {
+			dentistSel.value = s.dentist_id;
+			dateInput.value = s.date;
+			await refreshSlots();
+			timeSel.value = s.time;
+			list.innerHTML = '';
+		};
+		list.appendChild(item);
+	}
+}
 </script>
-""", dentists=dentists, time_slots=TIME_SLOTS, rows=get_appointments())
-		return render_template_string(BASE_TEMPLATE, content=content)
+{% endblock %}
+"""
 
-# Moderator Route
-@APP.route("/moderator", methods=["GET", "POST"])
-def moderator():
-		search_query = request.args.get("q","")
-		rows = get_appointments(search_query)
+@APP.route("/book", methods=["GET", "POST"])
+def index():
 		dentists = get_dentists()
-		content = render_template_string("""
+		if request.method == "POST":
+				name = request.form.get("patient_name","").strip()
+				age = request.form.get("age","").strip()
+				contact = request.form.get("contact","").strip()
+				dentist_id = parse_id("dentist", request.form.get("dentist",""))
+				service = request.form.get("service","").strip()
+				date = request.form.get("date","").strip()
+				time_slot = request.form.get("time","").strip()
+
+				if not (name and age and contact and dentist_id and service and date and time_slot):
+						flash("Please fill all fields", "warning")
+						return redirect(url_for("index"))
+				date, time_slot = normalise_date(date), normalise_slot(time_slot)
+				if date is None:
+						flash("Please enter a valid date", "warning")
+						return redirect(url_for("index"))
+				if time_slot is None:
+						flash("Please pick one of the listed time slots", "warning")
+						return redirect(url_for("index"))
+
+				if not AVAILABILITY.is_free(dentist_id, date, time_slot):
+						flash("That time slot is already taken, please pick another", "warning")
+						return redirect(url_for("index"))
+
+				try:
+						weeks = int(request.form.get("repeat_weeks") or 0)
+						visits = int(request.form.get("repeat_count") or 0)
+				except ValueError:
+						flash("Repeat every and visits must be whole numbers", "warning")
+						return redirect(url_for("index"))
+				if weeks:
+						try:
+								sid, taken = create_series(name, age, contact, dentist_id, service, date, time_slot,
+														   7 * weeks, count=visits)
+						except ValueError as e:
+								flash(str(e), "warning")
+								return redirect(url_for("index"))
+						if taken:
+								flash("Already booked on " + ", ".join(taken[:5]) + (" and more" if len(taken) > 5 else ""),
+									  "warning")
+								return redirect(url_for("index"))
+						flash(f"{visits} appointments booked, every {weeks} weeks — pending approval", "success")
+						return redirect(url_for("index"))
+
+				try:
+						aid = book_appointment(name, age, contact, dentist_id, service, date, time_slot)
+				except Overloaded:
+						flash("Booking is very busy right now, please try again in a moment", "warning")
+						return redirect(url_for("index"))
+				if aid is None:
+						flash("That time slot is already taken, please pick another", "warning")
+						return redirect(url_for("index"))
+				flash("Appointment added — pending approval", "success")
+				return redirect(url_for("index"))
+
+		after, per_page = page_args()
+		today = datetime.now().date().isoformat()
+		rows, next_cursor = get_appointments_page(cursor=after, page_size=per_page, start=today)
+		return render("book.html", dentists=dentists, time_slots=TIME_SLOTS, rows=rows, next_cursor=next_cursor, per_page=per_page)
+
+# Moderator Route
+MODERATOR_TEMPLATE = """{% extends "base.html" %}
+{% block content %}
 <div class="d-flex justify-content-between align-items-center mb-3">
 	<h3>Moderator Dashboard</h3>
 	<div>
 		<a class="btn btn-outline-primary me-2" href="{{ url_for('index') }}">Home</a>
+		<a class="btn btn-outline-secondary me-2" href="{{ url_for('export_appointments', q=request.args.get('q',''), **{'from': request.args.get('from',''), 'to': request.args.get('to',''), 'history': request.args.get('history','')}) }}">Export CSV</a>
 		<button class="btn btn-accent" data-bs-toggle="modal" data-bs-target="#manageDentistsModal">Manage Dentists</button>
 	</div>
 </div>
 
+<div class="row g-3 mb-3">
+	<div class="col-md-4">
+		<div class="card p-3 h-100">
+			<div class="small text-muted">Pending approvals today</div>
+			<div class="fs-3 fw-bold" id="statPending">{{ stats.pending_today }}</div>
+			<div class="small text-muted mt-2">This week: <span id="statBooked">{{ stats.booked_week }}</span> booked, <span id="statCancelled">{{ stats.cancelled_week }}</span> cancelled</div>
+		</div>
+	</div>
+	<div class="col-md-8">
+		<div class="card p-3 h-100">
+			<div class="small text-muted mb-2">Utilisation {{ stats.week[0] }} to {{ stats.week[1] }}</div>
+			<div id="utilisation">
+			{% for d in stats.dentists %}
+			<div class="d-flex align-items-center gap-2 small mb-1">
+				<span class="text-truncate" style="width: 40%">{{ d.name }}</span>
+				<div class="progress flex-grow-1" style="height: 8px">
+					<div class="progress-bar" style="width: {{ (d.utilisation * 100)|round(1) }}%"></div>
+				</div>
+				<span style="width: 9em" class="text-end">{{ (d.utilisation * 100)|round(1) }}% &middot; {{ d.cancelled }} cxl</span>
+			</div>
+			{% else %}
+			<div class="small text-muted">No dentists yet</div>
+			{% endfor %}
+			</div>
+		</div>
+	</div>
+</div>
+
+<div id="liveNotice" class="alert alert-info d-none">
+	<span id="liveNoticeText"></span> <a href="">Refresh</a>
+</div>
+
 <form class="mb-3" method="get" action="{{ url_for('moderator') }}">
 	<div class="input-group">
 		<input class="form-control" type="text" name="q" placeholder="Search patient/dentist/service" value="{{ request.args.get('q','') }}">
+		<input class="form-control" type="date" name="from" title="From" value="{{ request.args.get('from','') }}">
+		<input class="form-control" type="date" name="to" title="To" value="{{ request.args.get('to','') }}">
+		<div class="input-group-text">
+			<input class="form-check-input mt-0 me-1" type="checkbox" name="history" value="1" id="historyBox" {% if request.args.get('history') %}checked{% endif %}>
+			<label for="historyBox" class="small">Include history</label>
+		</div>
 		<button class="btn btn-primary" type="submit">Search</button>
 	</div>
 </form>
 
 <div class="card p-3">
+	<div class="d-flex gap-2 mb-2">
+		<span class="align-self-center small text-muted"><span id="selectedCount">0</span> selected</span>
+		<button class="btn btn-sm btn-success" onclick="batchStatus('approved')">Approve selected</button>
+		<button class="btn btn-sm btn-info" onclick="batchStatus('completed')">Complete selected</button>
+		<button class="btn btn-sm btn-warning" onclick="batchStatus('cancelled')">Cancel selected</button>
+	</div>
 	<div class="table-responsive">
 		<table class="table table-striped">
 			<thead><tr>
+				<th><input type="checkbox" class="form-check-input" id="selectAll"></th>
 				<th>Patient</th><th>Age</th><th>Contact</th><th>Service</th><th>Date</th><th>Time</th><th>Dentist</th><th>Status</th><th>Actions</th>
 			</tr></thead>
 			<tbody>
 				{% for r in rows %}
-				<tr>
+				{% set aid = r[0]|public_id('appointment') %}
+				<tr data-id="{{ aid }}">
+					<td><input type="checkbox" class="form-check-input row-select" value="{{ aid }}"></td>
 					<td>{{ r[1] }}</td><td>{{ r[2] }}</td><td>{{ r[3] }}</td><td>{{ r[4] }}</td>
-					<td>{{ r[5] }}</td><td>{{ r[6] }}</td><td>{{ r[7] }} ({{ r[8] }})</td><td>{{ r[9] }}</td>
+					<td class="date-cell">{{ r[5] }}</td><td class="time-cell">{{ r[6] }}</td><td>{{ r[7] }} ({{ r[8] }})</td><td class="status-cell">{{ r[9] }}</td>
 					<td>
 						<div class="btn-group btn-group-sm">
-							<a class="btn btn-sm btn-success" href="{{ url_for('action', aid=r[0], status='approved') }}">Approve</a>
-							<a class="btn btn-sm btn-info" href="{{ url_for('action', aid=r[0], status='completed') }}">Complete</a>
-							<a class="btn btn-sm btn-warning" href="{{ url_for('action', aid=r[0], status='cancelled') }}">Cancel</a>
-							<a class="btn btn-sm btn-danger" href="{{ url_for('delete', aid=r[0]) }}" onclick="return confirm('Delete appointment?')">Delete</a>
+							<a class="btn btn-sm btn-success" href="{{ url_for('action', aid=aid, status='approved') }}" onclick="return rowStatus(this, 'approved')">Approve</a>
+							<a class="btn btn-sm btn-info" href="{{ url_for('action', aid=aid, status='completed') }}" onclick="return rowStatus(this, 'completed')">Complete</a>
+							<a class="btn btn-sm btn-warning" href="{{ url_for('action', aid=aid, status='cancelled') }}" onclick="return rowStatus(this, 'cancelled')">Cancel</a>
+							<a class="btn btn-sm btn-danger" href="{{ url_for('delete', aid=aid) }}" onclick="return confirm('Delete appointment?') && rowDelete(this)">Delete</a>
 						</div>
 					</td>
 				</tr>
 				{% else %}
-				<tr><td colspan="9" class="text-center muted">No appointments</td></tr>
+				<tr><td colspan="10" class="text-center muted">No appointments</td></tr>
 				{% endfor %}
 			</tbody>
 		</table>
 	</div>
+	<div class="d-flex justify-content-end gap-2">
+		{% if request.args.get('after') %}<a class="btn btn-sm btn-outline-secondary" href="{{ url_for('moderator', q=request.args.get('q',''), per_page=per_page, **{'from': request.args.get('from',''), 'to': request.args.get('to',''), 'history': request.args.get('history','')}) }}">First page</a>{% endif %}
+		{% if next_cursor %}<a class="btn btn-sm btn-outline-primary" href="{{ url_for('moderator', q=request.args.get('q',''), after=next_cursor, per_page=per_page, **{'from': request.args.get('from',''), 'to': request.args.get('to',''), 'history': request.args.get('history','')}) }}">Next page</a>{% endif %}
+	</div>
 </div>
 
 <!-- Manage Dentists Modal -->
@@ -643,12 +3115,13 @@ def moderator():
 					<label class="form-label">Existing Dentists</label>
 					<ul id="dentistList" class="list-group">
 						{% for d in dentists %}
-							<li class="list-group-item d-flex justify-content-between align-items-center">
+							{% set did = d[0]|public_id('dentist') %}
+							<li class="list-group-item d-flex justify-content-between align-items-center" data-id="{{ did }}">
 								{{ d[1] }} ({{ d[2] }})
-								<button class="btn btn-sm btn-danger" onclick="deleteDentist('{{ d[0] }}')">Delete</button>
+								<button class="btn btn-sm btn-danger" onclick="deleteDentist('{{ did }}')">Delete</button>
 							</li>
 						{% else %}
-							<li class="list-group-item text-muted">No dentists yet</li>
+							<li class="list-group-item text-muted" id="noDentists">No dentists yet</li>
 						{% endfor %}
 					</ul>
 				</div>
@@ -659,6 +3132,76 @@ def moderator():
 </div>
 
 <script>
+const rowBoxes = () => Array.from(document.querySelectorAll('.row-select'));
+function updateSelected(){
+		document.getElementById('selectedCount').textContent = rowBoxes().filter(b => b.checked).length;
+}
+document.getElementById('selectAll').addEventListener('change', e => {
+		rowBoxes().forEach(b => b.checked = e.target.checked);
+		updateSelected();
+});
+rowBoxes().forEach(b => b.addEventListener('change', updateSelected));
+async function batchStatus(status){
+		const ids = rowBoxes().filter(b => b.checked).map(b => b.value);
+		if(!ids.length){ alert('Select at least one appointment'); return; }
+		const res = await fetch('{{ url_for('api_batch_status') }}', {
+			method:'POST', headers: {'Content-Type':'application/json'},
+			body: JSON.stringify({ ids, status })
+		});
+		const j = await res.json();
+		(j.results || []).filter(r => r.success).forEach(r => setRowStatus(r.id, status));
+		const failed = (j.results || []).filter(r => !r.success);
+		if(failed.length) alert(failed.length + ' not updated:\\n' + failed.map(r => r.error).join('\\n'));
+}
+// Row actions go through the JSON API and patch the row in place; the links
+// still work as plain GETs without javascript.
+const rowOf = el => el.closest('tr[data-id]');
+function setRowStatus(id, status){
+		const row = document.querySelector(`tr[data-id="${CSS.escape(id)}"]`);
+		if(row) row.querySelector('.status-cell').textContent = status;
+}
+function setRowSlot(id, date, time, status){
+		const row = document.querySelector(`tr[data-id="${CSS.escape(id)}"]`);
+		if(!row) return;
+		row.querySelector('.date-cell').textContent = date;
+		row.querySelector('.time-cell').textContent = time;
+		row.querySelector('.status-cell').textContent = status;
+}
+function removeRow(id){
+		const row = document.querySelector(`tr[data-id="${CSS.escape(id)}"]`);
+		if(row){ row.remove(); updateSelected(); }
+}
+function rowStatus(el, status){
+		const id = rowOf(el).dataset.id;
+		fetch('{{ url_for('api_list_appointments') }}/' + encodeURIComponent(id), {
+			method:'PATCH', headers: {'Content-Type':'application/json'},
+			body: JSON.stringify({ status })
+		}).then(r => r.json()).then(j => j.success ? setRowStatus(id, status) : alert('Error: ' + j.error));
+		return false;
+}
+function rowDelete(el){
+		const id = rowOf(el).dataset.id;
+		fetch('{{ url_for('api_list_appointments') }}/' + encodeURIComponent(id), { method:'DELETE' })
+			.then(r => r.json()).then(j => j.success ? removeRow(id) : alert('Error: ' + j.error));
+		return false;
+}
+function addDentistItem(id, name, specialty){
+		if(document.querySelector(`#dentistList li[data-id="${CSS.escape(id)}"]`)) return;
+		document.getElementById('noDentists')?.remove();
+		const li = document.createElement('li');
+		li.className = 'list-group-item d-flex justify-content-between align-items-center';
+		li.dataset.id = id;
+		li.textContent = `${name} (${specialty}) `;
+		const btn = document.createElement('button');
+		btn.className = 'btn btn-sm btn-danger';
+		btn.textContent = 'Delete';
+		btn.onclick = () => deleteDentist(id);
+		li.appendChild(btn);
+		document.getElementById('dentistList').appendChild(li);
+}
+function removeDentistItem(id){
+		document.querySelector(`#dentistList li[data-id="${CSS.escape(id)}"]`)?.remove();
+}
 async function addDentist(){
 		const name = document.getElementById('dentistName').value.trim();
 		const specialty = document.getElementById('dentistSpecialty').value.trim() || "General";
@@ -668,7 +3211,11 @@ async function addDentist(){
 			body: JSON.stringify({ name, specialty })
 		});
 		const j = await res.json();
-		if(j.success) location.reload();
+		if(j.success){
+			addDentistItem(j.id, name, specialty);
+			document.getElementById('dentistName').value = '';
+			document.getElementById('dentistSpecialty').value = '';
+		}
 		else alert('Error: ' + j.error);
 }
 async function deleteDentist(id){
@@ -678,18 +3225,64 @@ async function deleteDentist(id){
 			body: JSON.stringify({ id })
 		});
 		const j = await res.json();
-		if(j.success) location.reload();
+		if(j.success) removeDentistItem(id);
 		else alert('Error: ' + j.error);
 }
+
+// Live updates from other moderators (and this one's other tabs)
+let newAppointments = 0;
+let statsTimer = null;
+function refreshStats(){
+		clearTimeout(statsTimer);
+		statsTimer = setTimeout(async () => {
+			const j = await (await fetch('{{ url_for('api_stats') }}')).json();
+			if(!j.success) return;
+			document.getElementById('statPending').textContent = j.pending_today;
+			document.getElementById('statBooked').textContent = j.booked_week;
+			document.getElementById('statCancelled').textContent = j.cancelled_week;
+		}, 500);
+}
+const events = new EventSource('{{ url_for('moderator_events', after=live_seq) }}');
+events.addEventListener('appointment', e => {
+		const ev = JSON.parse(e.data);
+		if(ev.op === 'update') ev.ids.forEach(id => setRowStatus(id, ev.data.status));
+		else if(ev.op === 'move') ev.ids.forEach(id => setRowSlot(id, ev.data.date, ev.data.time, ev.data.status));
+		else if(ev.op === 'delete') ev.ids.forEach(removeRow);
+		else if(ev.op === 'insert'){
+			newAppointments += ev.ids.length;
+			document.getElementById('liveNoticeText').textContent = newAppointments + ' new appointment(s) booked.';
+			document.getElementById('liveNotice').classList.remove('d-none');
+		}
+		refreshStats();
+});
+events.addEventListener('dentist', e => {
+		const ev = JSON.parse(e.data);
+		if(ev.op === 'insert') addDentistItem(ev.ids[0], ev.data.name, ev.data.specialty);
+		else if(ev.op === 'delete') ev.ids.forEach(removeDentistItem);
+});
+// the server no longer holds the events we missed; start over
+events.addEventListener('reset', () => location.reload());
 </script>
-""", rows=rows, dentists=dentists)
-		return render_template_string(BASE_TEMPLATE, content=content)
+{% endblock %}
+"""
+
+@APP.route("/moderator", methods=["GET", "POST"])
+def moderator():
+		# taken before the reads, so the event stream replays anything that lands in between
+		live_seq = CHANGES.head()
+		search_query = request.args.get("q","")
+		after, per_page = page_args()
+		start, end = date_args()
+		rows, next_cursor = get_appointments_page(search_query, cursor=after, page_size=per_page,
+												  start=start, end=end, history=history_arg())
+		dentists = get_dentists()
+		return render("moderator.html", rows=rows, dentists=dentists, next_cursor=next_cursor, per_page=per_page,
+					  stats=dashboard_stats(), live_seq=live_seq)
 
 # Route 
 
-@APP.route("/", methods=["GET"])
-def home():
-	content = render_template_string("""
+HOME_TEMPLATE = """{% extends "base.html" %}
+{% block content %}
 <div class="container-narrow">
 
 <!-- HERO -->
@@ -786,24 +3379,74 @@ def home():
 </div>
 
 </div>
-""")
-	return render_template_string(BASE_TEMPLATE, content=content)
+{% endblock %}
+"""
+
+@APP.route("/", methods=["GET"])
+def home():
+	# the landing page has no per-request data, so render it once and reuse the
+	# html; the cached copy never holds flashes, a visit that has some to show
+	# (e.g. after login) renders its own
+	if get_flashed_messages():
+		return render("home.html")
+	html = PRERENDERED.get("home.html")
+	if html is None:
+		started = time.perf_counter()
+		html = PRERENDERED["home.html"] = render_template(TEMPLATE_CACHE["home.html"])
+		METRICS.observe("template_render_seconds", time.perf_counter() - started, template="home.html")
+	return html
 
 
 
 
 @APP.route("/action/<aid>/<status>")
 def action(aid, status):
-		update_appointment_status(aid, status)
+		aid = parse_id("appointment", aid)
+		error = change_statuses([aid], status)[aid] if aid else "Not found"
+		if error:
+				flash(error, "danger")
+				return redirect(url_for("moderator"))
 		flash("Status updated", "success")
 		return redirect(url_for("moderator"))
 
 @APP.route("/delete/<aid>")
 def delete(aid):
-		delete_appointment(aid)
-		flash("Appointment deleted", "info")
+		aid = parse_id("appointment", aid)
+		error = delete_appointment(aid) if aid else "Not found"
+		if error:
+				flash(f"Appointment not deleted: {error}", "warning")
+		else:
+				flash("Appointment deleted", "info")
 		return redirect(url_for("moderator"))
 
+# Live moderator updates
+@APP.route("/moderator/events")
+def moderator_events():
+		# EventSource sends Last-Event-ID when it reconnects; the page passes
+		# ?after= for the first connect
+		try:
+				after = int(request.headers.get("Last-Event-ID") or request.args.get("after", ""))
+		except ValueError:
+				after = CHANGES.head()
+		keepalive = APP.config["SSE_KEEPALIVE"]
+
+		def stream():
+				seq = after
+				yield "retry: 3000\n\n"
+				while True:
+						events = CHANGES.wait(seq, keepalive)
+						if events is None:
+								yield "event: reset\ndata: {}\n\n"
+								return
+						if not events:
+								yield ": keepalive\n\n"
+						for e in events:
+								seq = e["seq"]
+								yield f"id: {seq}\nevent: {e['entity']}\ndata: {json.dumps(public_event(e))}\n\n"
+
+		return APP.response_class(stream(), mimetype="text/event-stream",
+								  headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # Dentist API
 @APP.route("/api/dentist/add", methods=["POST"])
 def api_add_dentist():
@@ -812,23 +3455,814 @@ def api_add_dentist():
 		specialty = data.get("specialty","General").strip()
 		if not name: return jsonify(success=False, error="Missing name")
 		try:
-				add_dentist(name, specialty)
-				return jsonify(success=True)
+				did = add_dentist(name, specialty)
+				return jsonify(success=True, id=public_id("dentist", did))
 		except Exception as e:
 				return jsonify(success=False, error=str(e))
 
 @APP.route("/api/dentist/delete", methods=["POST"])
 def api_delete_dentist():
 		data = request.get_json() or {}
-		did = data.get("id")
-		if not did: return jsonify(success=False, error="Missing id")
+		if not data.get("id"): return jsonify(success=False, error="Missing id")
+		did = parse_id("dentist", data["id"])
+		if not did: return jsonify(success=False, error="Not found")
 		try:
 				delete_dentist_by_id(did)
 				return jsonify(success=True)
 		except Exception as e:
 				return jsonify(success=False, error=str(e))
 
+# Export
+EXPORT_COLUMNS = ["appointment_id", "patient", "age", "contact", "service", "date", "time",
+                  "dentist", "specialty", "status"]
+
+@APP.route("/export/appointments")
+def export_appointments():
+		fmt = request.args.get("format", "csv")
+		if fmt not in ("csv", "ndjson"):
+				return jsonify(success=False, error="format must be csv or ndjson"), 400
+		search = request.args.get("q", "")
+		start, end = date_args()
+		history = history_arg()
+
+		def generate():
+				buf = io.StringIO()
+				writer = csv.writer(buf)
+				if fmt == "csv":
+						writer.writerow(EXPORT_COLUMNS)
+				for n, row in enumerate(iter_appointments(search, start=start, end=end, history=history), 1):
+						row = (public_id("appointment", row[0]),) + row[1:10]
+						if fmt == "csv":
+								writer.writerow(row)
+						else:
+								buf.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n")
+						if n % 500 == 0:
+								yield buf.getvalue()
+								buf.seek(0)
+								buf.truncate()
+				yield buf.getvalue()
+
+		mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+		return APP.response_class(stream_with_context(generate()), mimetype=mimetype,
+								  headers={"Content-Disposition": f"attachment; filename=appointments.{fmt}"})
+
+# Appointments API
+API_FIELDS = {
+    "id": "a.appointment_id",
+    "patient": "p.name",
+    "age": "p.age",
+    "contact": "p.contact",
+    "service": "a.service",
+    "date": "a.date",
+    "time": "a.time",
+    "starts_at": "a.starts_at",
+    "dentist_id": "a.dentist_id",
+    "dentist": "d.name",
+    "specialty": "d.specialty",
+    "status": "a.status",
+    "created_at": "a.created_at",
+}
+# fields holding a row id, and the kind of public id they are sent as
+API_ID_FIELDS = {"id": "appointment", "dentist_id": "dentist"}
+
+def _api_record(fields, values):
+    record = dict(zip(fields, values))
+    for f, kind in API_ID_FIELDS.items():
+        if f in record:
+            record[f] = public_id(kind, record[f])
+    return record
+
+def _api_fields():
+    requested = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    unknown = [f for f in requested if f not in API_FIELDS]
+    return (requested or list(API_FIELDS)), unknown
+
+def _conditional(fn=None, *, daily=False):
+    # ETag/Last-Modified come from the cache_version counters bumped by
+    # triggers; a matching client gets a 304 before any appointment query runs.
+    # daily: the response also depends on today's date, so the date is part of
+    # the ETag and local midnight counts as a change.
+    if fn is None:
+        return functools.partial(_conditional, daily=daily)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        tag, changed = data_version("appointments", "dentists")
+        if daily:
+            today = datetime.now().date()
+            tag = f"{tag}-{today:%Y%m%d}"
+            midnight = datetime.utcfromtimestamp(time.mktime(today.timetuple()))
+            changed = max(changed, midnight) if changed else midnight
+        etag = f"{tag}-{zlib.crc32(request.full_path.encode()):08x}"
+        if request.if_none_match:
+            if request.if_none_match.contains(etag):
+                return APP.response_class(status=304, headers={"ETag": f'"{etag}"'})
+        elif changed and request.if_modified_since and changed <= request.if_modified_since.replace(tzinfo=None):
+            return APP.response_class(status=304, headers={"ETag": f'"{etag}"'})
+        resp = APP.make_response(fn(*args, **kwargs))
+        if resp.status_code == 200:
+            resp.set_etag(etag)
+            if changed:
+                resp.last_modified = changed
+        return resp
+    return wrapper
+
+@APP.route("/api/appointments", methods=["GET"])
+@_conditional
+def api_list_appointments():
+		fields, unknown = _api_fields()
+		if unknown: return jsonify(success=False, error=f"Unknown fields: {', '.join(unknown)}"), 400
+		after, per_page = page_args()
+		start, end = date_args()
+		dentist_id = None
+		if request.args.get("dentist"):
+				dentist_id = parse_id("dentist", request.args["dentist"])
+				if not dentist_id: return jsonify(success=True, data=[], next=None)
+		columns = ["a.appointment_id"] + [API_FIELDS[f] for f in fields]
+		rows, next_cursor = get_appointments_page(request.args.get("q", ""), cursor=after, page_size=per_page,
+												  start=start, end=end, dentist_id=dentist_id,
+												  columns=columns, history=history_arg())
+		data = [_api_record(fields, r[1:len(fields) + 1]) for r in rows]
+		return jsonify(success=True, data=data, next=next_cursor)
+
+@APP.route("/api/appointments/<aid>", methods=["GET"])
+@_conditional
+def api_get_appointment(aid):
+		fields, unknown = _api_fields()
+		if unknown: return jsonify(success=False, error=f"Unknown fields: {', '.join(unknown)}"), 400
+		columns = ", ".join(API_FIELDS[f] for f in fields)
+		aid = parse_id("appointment", aid)
+		if not aid: return jsonify(success=False, error="Not found"), 404
+		if aid >= OCCURRENCE_ID_BASE:
+				occurrence = _occurrence(get_conn(), aid)
+				if occurrence is None: return jsonify(success=False, error="Not found"), 404
+				if not occurrence[0]:
+						return jsonify(success=True, data=_api_record(fields, occurrence_record(get_conn(), occurrence, columns)))
+				aid = occurrence[0]
+		row = get_conn().execute(statement("appointment_fields", columns=columns), (aid,)).fetchone()
+		if row is None and history_arg():
+				row = get_conn().execute(statement("archived_appointment_fields", columns=columns), (aid,)).fetchone()
+		if row is None: return jsonify(success=False, error="Not found"), 404
+		return jsonify(success=True, data=_api_record(fields, row))
+
+@APP.route("/api/appointments", methods=["POST"])
+def api_create_appointment():
+		data = request.get_json() or {}
+		values = {k: str(data.get(k, "")).strip()
+				  for k in ("patient_name", "age", "contact", "dentist_id", "service", "date", "time")}
+		missing = [k for k in ("patient_name", "dentist_id", "service", "date", "time") if not values[k]]
+		if missing: return jsonify(success=False, error=f"Missing {', '.join(missing)}"), 400
+		dentist_id = parse_id("dentist", values["dentist_id"])
+		if not dentist_id: return jsonify(success=False, error="Unknown dentist_id"), 400
+		try:
+				aid = book_appointment(values["patient_name"], values["age"], values["contact"],
+									   dentist_id, values["service"], values["date"], values["time"])
+		except ValueError as e:
+				return jsonify(success=False, error=str(e)), 400
+		except Overloaded as e:
+				return jsonify(success=False, error="Busy, try again"), 503, {"Retry-After": str(e.retry_after)}
+		if aid is None: return jsonify(success=False, error="Slot already taken"), 409
+		return jsonify(success=True, id=public_id("appointment", aid)), 201
+
+@APP.route("/api/appointments/<aid>", methods=["PATCH"])
+def api_update_appointment(aid):
+		data = request.get_json() or {}
+		status = str(data.get("status", "")).strip()
+		date = str(data.get("date", "")).strip()
+		time_slot = str(data.get("time", "")).strip()
+		if (status or not date) and status not in APPOINTMENT_STATUSES:
+				return jsonify(success=False, error=f"status must be one of {', '.join(APPOINTMENT_STATUSES)}"), 400
+		if (date or time_slot) and not (re.fullmatch(r"\d{4}-\d{2}-\d{2}", date) and time_slot in TIME_SLOTS):
+				return jsonify(success=False, error="date must be YYYY-MM-DD and time one of the slots"), 400
+		aid = parse_id("appointment", aid)
+		error = None if aid else "Not found"
+		if not error and date:
+				error = move_appointment(aid, date, time_slot)
+		if not error and status:
+				error = change_statuses([aid], status)[aid]
+		if error == "Not found": return jsonify(success=False, error=error), 404
+		if error: return jsonify(success=False, error=error), 409
+		return jsonify(success=True)
+
+@APP.route("/api/appointments/<aid>", methods=["DELETE"])
+def api_delete_appointment(aid):
+		aid = parse_id("appointment", aid)
+		error = delete_appointment(aid) if aid else "Not found"
+		if error == "Not found": return jsonify(success=False, error=error), 404
+		if error: return jsonify(success=False, error=error), 409
+		return jsonify(success=True)
+
+@APP.route("/api/appointments/status", methods=["POST"])
+def api_batch_status():
+		data = request.get_json() or {}
+		ids = data.get("ids") or []
+		status = str(data.get("status", "")).strip()
+		if status not in APPOINTMENT_STATUSES:
+				return jsonify(success=False, error=f"status must be one of {', '.join(APPOINTMENT_STATUSES)}"), 400
+		if not isinstance(ids, list) or not ids or len(ids) > MAX_BATCH:
+				return jsonify(success=False, error=f"ids must be a list of 1-{MAX_BATCH} appointment ids"), 400
+		ids = {token: parse_id("appointment", token) for token in dict.fromkeys(str(i) for i in ids)}
+		found = [aid for aid in ids.values() if aid]
+		results = change_statuses(found, status) if found else {}
+		errors = {token: results[aid] if aid else "Not found" for token, aid in ids.items()}
+		return jsonify(success=all(e is None for e in errors.values()),
+					   results=[{"id": token, "success": err is None, "error": err} for token, err in errors.items()])
+
+# Recurring series API
+SERIES_ID_FIELDS = {"id": "series", "patient_id": "patient", "dentist_id": "dentist"}
+
+def _series_record(series):
+		return dict(series, **{f: public_id(kind, series[f]) for f, kind in SERIES_ID_FIELDS.items()})
+
+@APP.route("/api/series", methods=["POST"])
+def api_create_series():
+		data = request.get_json() or {}
+		values = {k: str(data.get(k, "")).strip()
+				  for k in ("patient_name", "age", "contact", "dentist_id", "service", "date", "time", "until")}
+		missing = [k for k in ("patient_name", "dentist_id", "service", "date", "time") if not values[k]]
+		if missing: return jsonify(success=False, error=f"Missing {', '.join(missing)}"), 400
+		dentist_id = parse_id("dentist", values["dentist_id"])
+		if not dentist_id: return jsonify(success=False, error="Unknown dentist_id"), 400
+		try:
+				interval = int(data.get("interval_days") or 0)
+				count = int(data.get("count") or 0)
+		except (TypeError, ValueError):
+				return jsonify(success=False, error="interval_days and count must be integers"), 400
+		try:
+				sid, taken = create_series(values["patient_name"], values["age"], values["contact"], dentist_id,
+										   values["service"], values["date"], values["time"], interval,
+										   count=count or None, until=values["until"] or None)
+		except ValueError as e:
+				return jsonify(success=False, error=str(e)), 400
+		if taken: return jsonify(success=False, error="Slots already taken", conflicts=taken), 409
+		return jsonify(success=True, id=public_id("series", sid), data=_series_record(get_series(sid))), 201
+
+@APP.route("/api/series/<sid>", methods=["GET"])
+@_conditional
+def api_get_series(sid):
+		sid = parse_id("series", sid)
+		series = get_series(sid) if sid else None
+		if series is None: return jsonify(success=False, error="Not found"), 404
+		return jsonify(success=True, data=_series_record(series))
+
+@APP.route("/api/series/<sid>", methods=["PATCH"])
+def api_update_series(sid):
+		data = request.get_json() or {}
+		sid = parse_id("series", sid)
+		error = set_series_status(sid, str(data.get("status", "")).strip()) if sid else "Not found"
+		if error == "Not found": return jsonify(success=False, error=error), 404
+		if error: return jsonify(success=False, error=error), 409 if error.startswith("Cannot") else 400
+		return jsonify(success=True)
+
+# Stats API
+@APP.route("/api/stats", methods=["GET"])
+@_conditional(daily=True)
+def api_stats():
+		stats = dashboard_stats()
+		for d in stats["dentists"]:
+				d["id"] = public_id("dentist", d["id"])
+		return jsonify(success=True, **stats)
+
+@APP.route("/api/stats/daily", methods=["GET"])
+@_conditional
+def api_stats_daily():
+		start, end = date_args()
+		if not (start and end): return jsonify(success=False, error="from and to must be YYYY-MM-DD"), 400
+		if (datetime.strptime(end, "%Y-%m-%d") - datetime.strptime(start, "%Y-%m-%d")).days > 366:
+				return jsonify(success=False, error="Range must be at most 366 days"), 400
+		dentist_id = None
+		if request.args.get("dentist"):
+				dentist_id = parse_id("dentist", request.args["dentist"])
+				if not dentist_id: return jsonify(success=True, data=[])
+		rows = status_counts(start, end, dentist_id)
+		return jsonify(success=True, data=[{"date": day, "dentist_id": public_id("dentist", did), "status": status,
+											"count": n} for day, did, status, n in rows])
+
+# Metrics
+@APP.route("/metrics", methods=["GET"])
+def metrics():
+		# under serve() a scrape reaches one worker at random; it answers for all
+		if APP.config["METRICS_DIR"] and WORKER is not None:
+				publish_metrics()
+				return APP.response_class(METRICS.render(collect_metrics()), mimetype="text/plain; version=0.0.4")
+		return APP.response_class(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+# Cache stats
+@APP.route("/api/cache/stats", methods=["GET"])
+def api_cache_stats():
+		return jsonify(success=True, reference=REFERENCE_CACHE.stats())
+
+# Availability API
+@APP.route("/api/availability", methods=["GET"])
+def api_availability():
+		did = request.args.get("dentist", "").strip()
+		start = request.args.get("start", "").strip()
+		end = request.args.get("end", "").strip() or start
+		if not (did and start): return jsonify(success=False, error="Missing dentist or start"), 400
+		dentist_id = parse_id("dentist", did)
+		if not dentist_id: return jsonify(success=False, error="Unknown dentist"), 404
+		try:
+				d0 = datetime.strptime(start, "%Y-%m-%d")
+				d1 = datetime.strptime(end, "%Y-%m-%d")
+		except ValueError:
+				return jsonify(success=False, error="Dates must be YYYY-MM-DD"), 400
+		if d1 < d0 or (d1 - d0).days >= AVAILABILITY_MAX_DAYS:
+				return jsonify(success=False, error=f"Range must be 1-{AVAILABILITY_MAX_DAYS} days"), 400
+		days = {}
+		for day, bm in AVAILABILITY.bitmaps(dentist_id, start, end).items():
+				days[day] = [t for i, t in enumerate(AVAILABILITY.slots) if not bm >> i & 1]
+		return jsonify(success=True, dentist=did, days=days)
+
+@APP.route("/api/availability/earliest", methods=["GET"])
+def api_earliest_slots():
+		# every slot is the same length, so the service doesn't narrow the search;
+		# it is echoed back for the booking form
+		service = request.args.get("service", "").strip()
+		specialty = request.args.get("specialty", "").strip() or None
+		start, end = date_args()
+		today = datetime.now().date()
+		start = start or today.isoformat()
+		end = end or (datetime.strptime(start, "%Y-%m-%d").date() + timedelta(days=EARLIEST_MAX_DAYS - 1)).isoformat()
+		if (datetime.strptime(end, "%Y-%m-%d") - datetime.strptime(start, "%Y-%m-%d")).days not in range(EARLIEST_MAX_DAYS):
+				return jsonify(success=False, error=f"Range must be 1-{EARLIEST_MAX_DAYS} days"), 400
+		try:
+				limit = max(1, min(int(request.args.get("limit", 5)), EARLIEST_MAX_RESULTS))
+		except ValueError:
+				return jsonify(success=False, error="limit must be a number"), 400
+		slots = earliest_free_slots(start, end, limit=limit, specialty=specialty)
+		for s in slots:
+				s["dentist_id"] = public_id("dentist", s["dentist_id"])
+		return jsonify(success=True, service=service, specialty=specialty, data=slots)
+
+# ---------- template registry ----------
+TEMPLATES = {
+    "base.html": BASE_TEMPLATE,
+    "register.html": REGISTER_TEMPLATE,
+    "login.html": LOGIN_TEMPLATE,
+    "book.html": BOOK_TEMPLATE,
+    "moderator.html": MODERATOR_TEMPLATE,
+    "home.html": HOME_TEMPLATE,
+}
+TEMPLATE_CACHE = {}   # name -> compiled jinja Template
+PRERENDERED = {}      # name -> html for pages without request data
+
+def load_templates():
+    APP.jinja_loader = ChoiceLoader([DictLoader(TEMPLATES), APP.jinja_loader])
+    APP.jinja_env.loader = APP.jinja_loader
+    TEMPLATE_CACHE.clear()
+    PRERENDERED.clear()
+    for name in TEMPLATES:
+        TEMPLATE_CACHE[name] = APP.jinja_env.get_template(name)
+
+def render(name, **context):
+    tpl = TEMPLATE_CACHE[name]
+    if APP.config["STREAM_TEMPLATES"]:
+        # streamed output renders while being sent, so it isn't timed here
+        return APP.response_class(stream_template(tpl, **context))
+    started = time.perf_counter()
+    html = render_template(tpl, **context)
+    METRICS.observe("template_render_seconds", time.perf_counter() - started, template=name)
+    return html
+
+load_templates()
+
+# ---------------- BULK IMPORT / EXPORT ----------------
+BULK_TABLES = {
+    "patients": ("patient", ["patient_id", "name", "age", "contact"]),
+    "dentists": ("dentist", ["dentist_id", "name", "specialty"]),
+    "appointments": ("appointments", ["appointment_id", "patient_id", "dentist_id", "service",
+                                      "date", "time", "status", "created_at", "starts_at"]),
+}
+
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+def read_records(fh, fmt):
+    if fmt == "csv":
+        yield from csv.DictReader(fh)
+    else:
+        for line in fh:
+            if line.strip():
+                yield json.loads(line)
+
+# insert triggers that maintain a derived table -> how to rebuild it in one pass
+REBUILT_BY_TRIGGER = {
+    "appointment_fts_ai": rebuild_search_index,
+    "appointment_counts_ai": rebuild_status_counts,
+}
+
+def _drop_secondary_indexes(conn, table):
+    # Unique indexes stay: they are what rejects duplicate rows during the load.
+    # The per-row insert triggers of derived tables go too; those tables are
+    # rebuilt in one pass afterwards.
+    rows = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE tbl_name=? AND sql IS NOT NULL "
+        f"AND (type='index' OR (type='trigger' AND name IN ({','.join('?' * len(REBUILT_BY_TRIGGER))})))",
+        (table, *REBUILT_BY_TRIGGER)).fetchall()
+    dropped = []
+    for kind, name, sql in rows:
+        if not sql.lstrip().upper().startswith("CREATE UNIQUE"):
+            conn.execute(f"DROP {kind.upper()} {name}")
+            dropped.append((kind, name, sql))
+    return dropped
+
+def _import_id(conn, kind, value):
+    # integer ids are taken as they are; anything else is a pre-migration uuid
+    value = str(value or "").strip()
+    if value.isdigit():
+        return int(value)
+    row = conn.execute(statement("legacy_id"), (kind, value)).fetchone() if value else None
+    return row[0] if row else None
+
+def import_records(kind, records, batch_size=5000, drop_indexes=False):
+    """Insert records in batched transactions. Appointments may reference
+    patients/dentists by id, by pre-migration uuid or by name
+    ("patient"/"dentist"); unknown names are created. A record without an
+    integer id of its own gets a new one. Returns (inserted, skipped)."""
+    table, cols = BULK_TABLES[kind]
+    conn = get_conn()
+    patients, dentists = {}, {}
+    if kind == "appointments":
+        for pid, name in conn.execute("SELECT patient_id, name FROM patient"):
+            patients.setdefault(name, pid)
+        for did, name in conn.execute("SELECT dentist_id, name FROM dentist"):
+            dentists.setdefault(name, did)
+    dropped = _drop_secondary_indexes(conn, table) if drop_indexes else []
+    sql = f"INSERT OR IGNORE INTO {table} ({','.join(cols)}) VALUES ({','.join('?' * len(cols))})"
+    inserted = skipped = 0
+    batch = []
+
+    def resolve(mapping, name, insert, extra):
+        # new names are inserted right away for their id; flush() commits them
+        ref = mapping.get(name)
+        if ref is None:
+            ref = mapping[name] = conn.execute(statement(insert), (name,) + extra).lastrowid
+        return ref
+
+    def flush():
+        nonlocal inserted, skipped
+        with conn:
+            done = conn.executemany(sql, batch).rowcount
+        inserted += done
+        skipped += len(batch) - done
+        batch.clear()
+
+    try:
+        for rec in records:
+            row = dict(rec)
+            if kind == "appointments":
+                row["patient_id"] = _import_id(conn, "patient", row.get("patient_id"))
+                if row["patient_id"] is None:
+                    row["patient_id"] = resolve(patients, row.get("patient", ""), "insert_patient", ("", ""))
+                row["dentist_id"] = _import_id(conn, "dentist", row.get("dentist_id"))
+                if row["dentist_id"] is None:
+                    row["dentist_id"] = resolve(dentists, row.get("dentist", ""), "insert_dentist", ("General",))
+                row.setdefault("status", "pending")
+                row.setdefault("created_at", datetime.utcnow().isoformat())
+                if not row.get("starts_at"):
+                    row["starts_at"] = canonical_start(row.get("date", ""), row.get("time", ""))
+            id_col = cols[0]
+            row[id_col] = int(row[id_col]) if str(row.get(id_col) or "").strip().isdigit() else None
+            batch.append(tuple(row.get(col, "") for col in cols))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        for kind, name, _ in dropped:
+            if kind == "trigger":
+                REBUILT_BY_TRIGGER[name](conn)
+        for _, _, ddl in dropped:
+            conn.execute(ddl)
+        conn.commit()
+    return inserted, skipped
+
+def export_records(kind, fh, fmt, chunk_size=5000):
+    table, cols = BULK_TABLES[kind]
+    c = get_conn().execute(f"SELECT {','.join(cols)} FROM {table} ORDER BY rowid")
+    writer = csv.writer(fh) if fmt == "csv" else None
+    if writer:
+        writer.writerow(cols)
+    count = 0
+    while True:
+        rows = c.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            if writer:
+                writer.writerow(row)
+            else:
+                fh.write(json.dumps(dict(zip(cols, row))) + "\n")
+        count += len(rows)
+    return count
+
+# ---------------- APP FACTORY / SERVER ----------------
+server_log = logging.getLogger("app.server")
+
+WORKER = None   # this process's worker number under serve()
+
+def publish_metrics():
+    # atomically replace this worker's snapshot in METRICS_DIR
+    path = os.path.join(APP.config["METRICS_DIR"], f"worker-{WORKER}.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fh:
+        json.dump(METRICS.snapshot(), fh)
+    os.replace(tmp, path)
+
+def collect_metrics():
+    """{worker: snapshot} for every worker that has published one. Another
+    worker's numbers are at most METRICS_PUBLISH_INTERVAL old; a replaced
+    worker takes over its predecessor's file, which reads as a counter reset."""
+    workers = {}
+    directory = APP.config["METRICS_DIR"]
+    for name in os.listdir(directory):
+        m = re.fullmatch(r"worker-(\d+)\.json", name)
+        if not m:
+            continue
+        try:
+            with open(os.path.join(directory, name)) as fh:
+                workers[int(m.group(1))] = json.load(fh)
+        except (OSError, ValueError):
+            continue
+    return workers
+
+def start_metrics_publisher(interval):
+    """Run publish_metrics() every `interval` seconds on a daemon thread."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                publish_metrics()
+            except OSError:
+                server_log.exception("publishing metrics failed")
+    thread = threading.Thread(target=loop, name="metrics-publisher", daemon=True)
+    thread.start()
+    return thread
+
+@contextmanager
+def startup_phase(name, timings=None):
+    # times one startup step into the app_startup_seconds gauge
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        METRICS.set("app_startup_seconds", elapsed, phase=name)
+        if timings is not None:
+            timings[name] = elapsed
+
+def create_app(config=None, migrate=True, warm=True):
+    """Configure the app from `config` and return it. `config` holds
+    APP.config keys, plus DATABASE for the sqlite file. Pool, caches and
+    templates live at module level, so there is one app per process and a
+    second call reconfigures it (closing the pool, emptying the caches and
+    rate limits).
+    `migrate` brings the schema up to date; with several processes do that
+    once, before they start. `warm` runs warm_up()."""
+    global DB, AUTH_IP_LIMIT, AUTH_EMAIL_LIMIT, AUTH_HASHER, BOOKING_WRITER
+    with startup_phase("configure"):
+        config = dict(config or {})
+        DB = config.pop("DATABASE", DB)
+        APP.config.update(config)
+        cfg = APP.config
+        close_pool()
+        REFERENCE_CACHE.ttl = cfg["REFERENCE_CACHE_TTL"]
+        REFERENCE_CACHE.check_interval = cfg["REFERENCE_CACHE_CHECK"]
+        REFERENCE_CACHE.invalidate()
+        AVAILABILITY.max_entries = cfg["AVAILABILITY_CACHE_ENTRIES"]
+        AVAILABILITY.ttl = cfg["AVAILABILITY_CACHE_TTL"]
+        AVAILABILITY.clear()
+        CHANGES.keep = cfg["CHANGE_FEED_KEEP"]
+        CHANGES.poll_interval = cfg["CHANGE_FEED_POLL"]
+        CHANGES.reset()
+        AUTH_HASHER.shutdown()
+        AUTH_IP_LIMIT, AUTH_EMAIL_LIMIT, AUTH_HASHER = _auth_limits()
+        BOOKING_WRITER.stop()
+        BOOKING_WRITER = _booking_writer()
+    if migrate:
+        with startup_phase("migrate"):
+            init_db()
+    if warm:
+        warm_up()
+    return APP
+
+def warm_up():
+    """Do the work the first requests would otherwise pay for: open the
+    pool's connections (pragmas, attach, the listing statements prepared
+    and their pages read), compile the templates and pre-render the static
+    ones, load the dentists, the change feed head and the next
+    WARM_AVAILABILITY_DAYS of slot bitmaps. Returns {phase: seconds}."""
+    timings = {}
+    today = datetime.now().date()
+    with startup_phase("connections", timings):
+        pool = get_pool()
+        conns = [pool.acquire() for _ in range(pool.size)]
+        for conn in conns:
+            conn.execute(*appointments_query(limit=PAGE_SIZE + 1, start=today.isoformat())).fetchall()
+            conn.execute(statement("list_dentists")).fetchall()
+        for conn in conns:
+            pool.release(conn)
+    with startup_phase("templates", timings):
+        # compiled at import, so a forked worker normally inherits them
+        if len(TEMPLATE_CACHE) < len(TEMPLATES):
+            load_templates()
+        with APP.test_request_context("/"):
+            PRERENDERED["home.html"] = render_template(TEMPLATE_CACHE["home.html"])
+    with APP.app_context():
+        with startup_phase("reference", timings):
+            ids = [d[0] for d in get_dentists()]
+            CHANGES.head()
+        with startup_phase("availability", timings):
+            last = today + timedelta(days=APP.config["WARM_AVAILABILITY_DAYS"] - 1)
+            if ids and last >= today:
+                AVAILABILITY.bitmaps_many(ids, today.isoformat(), last.isoformat())
+    return timings
+
+def _serve_worker(sock, n):
+    global WORKER
+    from werkzeug.serving import make_server
+    WORKER = n
+    started = time.perf_counter()
+    timings = warm_up()
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, APP, threaded=True, fd=sock.fileno())
+    # finish the requests in flight, then leave serve_forever()
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    if n == 0 and APP.config["ARCHIVE_INTERVAL"]:
+        start_archiver(APP.config["ARCHIVE_INTERVAL"])
+    total = time.perf_counter() - started
+    METRICS.set("app_startup_seconds", total, phase="worker")
+    if APP.config["METRICS_DIR"]:
+        publish_metrics()
+        start_metrics_publisher(APP.config["METRICS_PUBLISH_INTERVAL"])
+    server_log.info("worker %d (pid %d) ready in %.0f ms (%s)", n, os.getpid(), total * 1000,
+                    ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in timings.items()))
+    server.serve_forever()
+    return 0
+
+def serve(host="127.0.0.1", port=8000, workers=None):
+    """Pre-fork server: bind once, then fork `workers` processes (default:
+    one per cpu) that each warm up and accept on the shared socket, with
+    their own connections and caches. A worker that dies is replaced;
+    SIGTERM/SIGINT stop them all. Run create_app() first, so migrations
+    happen once here rather than racing in every worker. Workers publish
+    their metrics to METRICS_DIR (a temporary directory unless configured),
+    so /metrics on any of them reports all of them."""
+    workers = workers or os.cpu_count() or 1
+    sock = socket.create_server((host, port), backlog=1024)
+    # every idle worker wakes for a new connection and only one accept()
+    # wins; the others must get EAGAIN rather than block where they can't
+    # see a shutdown
+    sock.setblocking(False)
+    server_log.info("listening on http://%s:%d with %d workers", host, sock.getsockname()[1], workers)
+    if not hasattr(os, "fork"):
+        return _serve_worker(sock, 0)
+    own_metrics_dir = not APP.config["METRICS_DIR"]
+    if own_metrics_dir:
+        APP.config["METRICS_DIR"] = tempfile.mkdtemp(prefix="dental-metrics-")
+    for name in os.listdir(APP.config["METRICS_DIR"]):
+        if name.startswith("worker-"):
+            os.remove(os.path.join(APP.config["METRICS_DIR"], name))
+    # nothing opened here may be shared with the workers
+    close_pool()
+    CHANGES.reset()
+    children = {}
+    stopping = False
+
+    def spawn(n):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                # the parent decides when workers stop
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                code = _serve_worker(sock, n)
+            except BaseException:
+                server_log.exception("worker %d failed", n)
+            finally:
+                os._exit(code)
+        children[pid] = n
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for n in range(workers):
+        spawn(n)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        n = children.pop(pid, None)
+        if n is not None and not stopping:
+            server_log.warning("worker %d (pid %d) exited with status %d, restarting",
+                               n, pid, os.waitstatus_to_exitcode(status))
+            time.sleep(1)
+            spawn(n)
+    sock.close()
+    if own_metrics_dir:
+        shutil.rmtree(APP.config["METRICS_DIR"], ignore_errors=True)
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dental Appointment System")
+    parser.add_argument("--db", default=DB, help="sqlite database file")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("runserver", help="run the development server (default)")
+    srv = sub.add_parser("serve", help="run the pre-fork multi-process server")
+    srv.add_argument("--host", default="127.0.0.1")
+    srv.add_argument("--port", type=int, default=8000)
+    srv.add_argument("--workers", type=int, default=0, help="worker processes; 0 = one per cpu")
+    sub.add_parser("migrate", help="bring the database schema up to date")
+    imp = sub.add_parser("import", help="bulk load CSV/NDJSON")
+    imp.add_argument("kind", choices=BULK_TABLES)
+    imp.add_argument("path", help="input file, or - for stdin")
+    imp.add_argument("--format", choices=["csv", "ndjson"])
+    imp.add_argument("--batch-size", type=int, default=5000)
+    imp.add_argument("--drop-indexes", action="store_true",
+                     help="drop non-unique indexes during the load and rebuild them after")
+    exp = sub.add_parser("export", help="dump a table as CSV/NDJSON")
+    exp.add_argument("kind", choices=BULK_TABLES)
+    exp.add_argument("path", help="output file, or - for stdout")
+    exp.add_argument("--format", choices=["csv", "ndjson"])
+    plans = sub.add_parser("check-plans", help="fail if a registered query scans a table or sorts in a temp b-tree")
+    plans.add_argument("-v", "--verbose", action="store_true", help="print every plan, not just failures")
+    sub.add_parser("rebuild-counts", help="recount the per-dentist, per-day status counters")
+    arc = sub.add_parser("archive", help="move finished appointments past the retention age to the archive db")
+    arc.add_argument("--older-than", type=int, default=APP.config["ARCHIVE_AFTER_DAYS"], metavar="DAYS")
+    arc.add_argument("--batch-size", type=int, default=APP.config["ARCHIVE_BATCH_SIZE"])
+    args = parser.parse_args(argv)
+
+    create_app({"DATABASE": args.db}, warm=False)
+    if args.command == "migrate":
+        print(f"{DB} is at schema version {schema_version(get_conn())}", file=sys.stderr)
+        return 0
+    if args.command == "serve":
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(name)s: %(message)s")
+        return serve(args.host, args.port, args.workers or None)
+    if args.command in (None, "runserver"):
+        if APP.config["ARCHIVE_INTERVAL"]:
+            start_archiver(APP.config["ARCHIVE_INTERVAL"])
+        APP.run(debug=True)
+        return 0
+    if args.command == "check-plans":
+        report = check_query_plans()
+        failed = 0
+        for name, plan, problems in report:
+            failed += bool(problems)
+            if problems or args.verbose:
+                print(f"{'FAIL' if problems else 'ok  '} {name}")
+                for step in plan:
+                    print(f"       {'!' if step in problems else ' '} {step}")
+        print(f"{failed} of {len(report)} statements / query shapes with a bad plan" if failed
+              else "all query plans use indexes", file=sys.stderr)
+        return 1 if failed else 0
+    if args.command == "rebuild-counts":
+        started = time.perf_counter()
+        conn = get_conn()
+        with conn:
+            rebuild_status_counts(conn)
+        rows = conn.execute("SELECT COUNT(*) FROM appointment_counts").fetchone()[0]
+        print(f"rebuilt {rows} status counters in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+        return 0
+    if args.command == "archive":
+        started = time.perf_counter()
+        moved = archive_appointments(args.older_than, args.batch_size)
+        elapsed = time.perf_counter() - started
+        print(f"archived {moved} appointments to {archive_path()} in {elapsed:.2f}s "
+              f"({moved / max(elapsed, 1e-9):,.0f} rows/s)", file=sys.stderr)
+        return 0
+
+    fmt = _detect_format(args.path, args.format)
+    started = time.perf_counter()
+    if args.command == "import":
+        fh = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+        with fh:
+            inserted, skipped = import_records(args.kind, read_records(fh, fmt),
+                                               batch_size=args.batch_size,
+                                               drop_indexes=args.drop_indexes)
+        count, verb = inserted, "imported"
+    else:
+        fh = sys.stdout if args.path == "-" else open(args.path, "w", newline="", encoding="utf-8")
+        with fh:
+            count = export_records(args.kind, fh, fmt)
+        skipped, verb = 0, "exported"
+    elapsed = time.perf_counter() - started
+    print(f"{verb} {count} {args.kind} in {elapsed:.2f}s ({count / max(elapsed, 1e-9):,.0f} rows/s)"
+          + (f", {skipped} skipped" if skipped else ""), file=sys.stderr)
+    return 0
+
 # Main
 if __name__ == "__main__":
-		init_db()
-		APP.run(debug=True)
\ No newline at end of file
+		sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,10 @@
+"""Load tests and benchmarks for the Dental Appointment System.
+
+    python -m bench generate bench.db --appointments 1000000
+    python -m bench run bench.db --mode client --out results.json
+    python -m bench run bench.db --mode http --threads 16 --out results.json --baseline baseline.json
+    python -m bench compare results.json baseline.json
+
+`run --baseline` (and `compare`) exit non-zero when a route's p95 or
+throughput regresses past --tolerance.
+"""
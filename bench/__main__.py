@@ -0,0 +1,100 @@
+# bench/__main__.py
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+
+import app
+from bench import dataset, load
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="build a synthetic clinic database")
+    gen.add_argument("db")
+    gen.add_argument("--dentists", type=int, default=30)
+    gen.add_argument("--patients", type=int, default=20000)
+    gen.add_argument("--appointments", type=int, default=200000)
+    gen.add_argument("--horizon", type=int, default=90, help="days of the range that lie in the future")
+    gen.add_argument("--seed", type=int, default=42)
+
+    run = sub.add_parser("run", help="drive the routes and report latency")
+    run.add_argument("db")
+    run.add_argument("--mode", choices=["client", "http"], default="client")
+    run.add_argument("--requests", type=int, default=2000)
+    run.add_argument("--threads", type=int, default=1)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--out", help="write results as JSON")
+    run.add_argument("--baseline", help="fail if results regress against this JSON file")
+    run.add_argument("--tolerance", type=float, default=0.2)
+    run.add_argument("--min-samples", type=int, default=load.MIN_SAMPLES,
+                     help="routes with fewer samples are not compared")
+
+    cmp_ = sub.add_parser("compare", help="compare two result files")
+    cmp_.add_argument("current")
+    cmp_.add_argument("baseline")
+    cmp_.add_argument("--tolerance", type=float, default=0.2)
+    cmp_.add_argument("--min-samples", type=int, default=load.MIN_SAMPLES,
+                      help="routes with fewer samples are not compared")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        started = time.perf_counter()
+        stats = dataset.generate(args.db, dentists=args.dentists, patients=args.patients,
+                                 appointments=args.appointments, horizon=args.horizon, seed=args.seed)
+        print(f"{stats} in {time.perf_counter() - started:.1f}s")
+        return 0
+
+    if args.command == "compare":
+        with open(args.current) as fh:
+            current = json.load(fh)
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        return _report_regressions(load.compare(current, baseline, args.tolerance, args.min_samples))
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        load.snapshot(args.db, tmp)
+        return _run(args)
+
+
+def _run(args):
+    app.init_db()
+    with app.APP.app_context():
+        sample = load.load_sample(seed=args.seed)
+    scenarios = load.Scenarios(sample, seed=args.seed)
+    server = None
+    if args.mode == "http":
+        server, base_url = load.start_http_server()
+        send = load.http_sender(base_url)
+    else:
+        send = load.client_sender()
+    try:
+        result = load.drive(send, scenarios, requests=args.requests, threads=args.threads, seed=args.seed)
+    finally:
+        if server:
+            server.shutdown()
+    result["meta"] = {"mode": args.mode, "db": args.db, "python": platform.python_version(),
+                      "sqlite": app.sqlite3.sqlite_version, "when": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    print(load.format_table(result))
+    if args.out:
+        with open(args.out, "w") as fh:
+            json.dump(result, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            return _report_regressions(load.compare(result, json.load(fh), args.tolerance, args.min_samples))
+    return 0
+
+
+def _report_regressions(failures):
+    for line in failures:
+        print("REGRESSION", line, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# bench/dataset.py
+# Synthetic clinic data, loaded through the app's own schema and bulk importer.
+import math
+import random
+from datetime import date, timedelta
+
+import app
+
+FIRST_NAMES = ["Maria", "John", "Anne", "Jose", "Grace", "Mark", "Paolo", "Liza", "Carlo", "Joy",
+               "Miguel", "Rosa", "Andres", "Bea", "Luis", "Carmen", "Rafael", "Nina", "Diego", "Ella"]
+LAST_NAMES = ["Santos", "Reyes", "Cruz", "Bautista", "Garcia", "Mendoza", "Torres", "Flores",
+              "Ramos", "Castillo", "Villanueva", "Aquino", "Lim", "Tan", "Dela Cruz", "Navarro"]
+SPECIALTIES = ["General", "General", "General", "Orthodontics", "Endodontics", "Pediatric",
+               "Periodontics", "Cosmetic"]
+SERVICES = [("Cleaning", 30), ("Check-up", 30), ("Tooth Extraction", 8), ("Braces Adjustment", 15),
+            ("Root Canal", 5), ("Whitening", 6)]
+# bookings per weekday (Mon..Sun) relative to a busy Monday
+WEEKDAY_LOAD = [1.0, 0.9, 0.85, 0.9, 1.0, 0.7, 0.0]
+# share of the slot grid a dentist fills on a full-load day
+DAY_FILL = 0.75
+
+
+def _slot_weights(slots):
+    # morning and late-afternoon peaks, a lunchtime dip
+    weights = []
+    for i, _ in enumerate(slots):
+        hour = 8 + i / 2
+        w = 1.0 + 0.8 * math.exp(-((hour - 9.5) ** 2) / 2) + 0.6 * math.exp(-((hour - 16) ** 2) / 2)
+        if 12 <= hour < 13:
+            w *= 0.4
+        weights.append(w)
+    return weights
+
+
+def _weighted_sample(items, weights, k, rng):
+    # weighted sampling without replacement (Efraimidis-Spirakis keys)
+    keyed = sorted(((rng.random() ** (1.0 / w), item) for item, w in zip(items, weights)), reverse=True)
+    return [item for _, item in keyed[:k]]
+
+
+def _records(dentists, patients, appointments, horizon, rng, today):
+    slots = app.TIME_SLOTS
+    slot_w = _slot_weights(slots)
+    services, service_w = zip(*SERVICES)
+    per_day = max(1, round(len(slots) * DAY_FILL))
+    # the history ramp below averages 0.8 of the weekday load
+    mean_load = sum(WEEKDAY_LOAD) / 7 * 0.8
+    days = max(1, math.ceil(appointments / (len(dentists) * per_day * mean_load)))
+    first = today - timedelta(days=max(0, days - horizon))
+    emitted = 0
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        # older history is thinner than the recent past
+        load = WEEKDAY_LOAD[day.weekday()] * (0.6 + 0.4 * offset / days)
+        if not load:
+            continue
+        iso = day.isoformat()
+        for did in dentists:
+            k = min(len(slots), max(0, round(rng.gauss(per_day * load, 1.5))))
+            for slot in _weighted_sample(slots, slot_w, k, rng):
+                if day < today:
+                    status = rng.choices(["completed", "cancelled"], [0.9, 0.1])[0]
+                else:
+                    status = rng.choices(["pending", "approved", "cancelled"], [0.5, 0.45, 0.05])[0]
+                # a minority of patients make most of the visits
+                pid = patients[min(len(patients) - 1, int(rng.paretovariate(1.2)) - 1)] \
+                    if rng.random() < 0.3 else rng.choice(patients)
+                yield {
+                    "patient_id": pid,
+                    "dentist_id": did,
+                    "service": rng.choices(services, service_w)[0],
+                    "date": iso,
+                    "time": slot,
+                    "status": status,
+                    "created_at": (day - timedelta(days=rng.randint(0, 30))).isoformat() + "T09:00:00",
+                }
+                emitted += 1
+                if emitted >= appointments:
+                    return
+
+
+def generate(path, dentists=30, patients=20000, appointments=200000, horizon=90, seed=42,
+             batch_size=20000):
+    """Create (or extend) a clinic database at `path`. `horizon` days of the
+    generated range lie in the future, the rest is history."""
+    rng = random.Random(seed)
+    app.DB = path
+    app.init_db()
+    conn = app.get_conn()
+    # explicit ids after any rows already there, so appointments can name them
+    first_dentist = conn.execute("SELECT coalesce(max(dentist_id), 0) + 1 FROM dentist").fetchone()[0]
+    first_patient = conn.execute("SELECT coalesce(max(patient_id), 0) + 1 FROM patient").fetchone()[0]
+    dentist_rows = [{"dentist_id": first_dentist + i,
+                     "name": f"Dr. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}",
+                     "specialty": rng.choice(SPECIALTIES)} for i in range(dentists)]
+    patient_rows = [{"patient_id": first_patient + i,
+                     "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}",
+                     "age": str(rng.randint(4, 85)),
+                     "contact": f"09{rng.randint(100000000, 999999999)}"} for i in range(patients)]
+    app.import_records("dentists", dentist_rows, batch_size=batch_size)
+    app.import_records("patients", patient_rows, batch_size=batch_size)
+    inserted, skipped = app.import_records(
+        "appointments",
+        _records([d["dentist_id"] for d in dentist_rows], [p["patient_id"] for p in patient_rows],
+                 appointments, horizon, rng, date.today()),
+        batch_size=batch_size, drop_indexes=True)
+    conn.execute("ANALYZE")
+    return {"dentists": dentists, "patients": patients, "appointments": inserted, "skipped": skipped}
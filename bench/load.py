@@ -0,0 +1,256 @@
+# bench/load.py
+# Drives the app's routes through the Flask test client or over local HTTP
+# and summarises latency/throughput per route.
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, timedelta
+
+import app
+from bench.dataset import FIRST_NAMES, LAST_NAMES, SERVICES
+
+# route -> relative weight in the request mix
+DEFAULT_MIX = {
+    "home": 10,
+    "book": 30,
+    "book_post": 5,
+    "moderator_search": 20,
+    "action": 10,
+    "api_dentist_add": 1,
+    "api_dentist_delete": 1,
+}
+
+
+# compare() skips routes with fewer samples than this; their p95 is noise
+MIN_SAMPLES = 30
+
+
+class Form(dict):
+    """A request body sent form-encoded instead of as JSON."""
+
+
+def snapshot(db, directory):
+    """Copy `db` and its archive db into `directory` with the sqlite backup
+    API and point the app at the copy. A run books and approves
+    appointments, so it must not touch the database it was given."""
+    app.APP.config["ARCHIVE_DB"] = None
+    copy = os.path.join(directory, os.path.basename(db))
+    app.DB = db
+    archive = app.archive_path()
+    app.DB = copy
+    for src, dst in ((db, copy), (archive, app.archive_path())):
+        if not os.path.exists(src):
+            continue
+        source, target = sqlite3.connect(src), sqlite3.connect(dst)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+    return copy
+
+
+def load_sample(size=5000, seed=0):
+    """Ids and search terms to build requests from."""
+    rng = random.Random(seed)
+    conn = app.get_conn()
+    pending = [app.public_id("appointment", r[0]) for r in conn.execute(
+        "SELECT appointment_id FROM appointments WHERE status = 'pending' LIMIT ?", (size,))]
+    terms = [n[:rng.randint(2, len(n))].lower() for n in FIRST_NAMES + LAST_NAMES]
+    dentists = [app.public_id("dentist", r[0]) for r in conn.execute("SELECT dentist_id FROM dentist")]
+    return {"appointments": pending or ["missing"], "terms": terms, "dentists": dentists or ["missing"]}
+
+
+class Scenarios:
+    """Builds (method, path, body) per route; the body is JSON unless it is
+    a Form. Dentist ids created by api_dentist_add are handed to
+    api_dentist_delete."""
+
+    def __init__(self, sample, seed=0):
+        self.sample = sample
+        self.rng = random.Random(seed)
+        self.created = []
+        self.lock = threading.Lock()
+
+    def build(self, route):
+        rng = self.rng
+        if route == "home":
+            return "GET", "/", None
+        if route == "book":
+            return "GET", "/book", None
+        if route == "book_post":
+            # a random slot over the next two months; a taken one is
+            # flashed and redirected like a successful booking
+            day = date.today() + timedelta(days=rng.randint(1, 60))
+            return "POST", "/book", Form(patient_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                                         age=str(rng.randint(5, 80)), contact=f"09{rng.randrange(10**9):09d}",
+                                         dentist=rng.choice(self.sample["dentists"]),
+                                         service=rng.choice(SERVICES)[0], date=day.isoformat(),
+                                         time=rng.choice(app.TIME_SLOTS))
+        if route == "moderator_search":
+            return "GET", "/moderator?q=" + urllib.parse.quote(rng.choice(self.sample["terms"])), None
+        if route == "action":
+            return "GET", f"/action/{rng.choice(self.sample['appointments'])}/approved", None
+        if route == "api_dentist_add":
+            return "POST", "/api/dentist/add", {"name": f"Bench Dentist {rng.randrange(10**9)}",
+                                                "specialty": "General"}
+        if route == "api_dentist_delete":
+            with self.lock:
+                did = self.created.pop() if self.created else "missing"
+            return "POST", "/api/dentist/delete", {"id": did}
+        raise ValueError(f"unknown route {route}")
+
+    def record(self, route, body):
+        if route == "api_dentist_add" and body:
+            try:
+                did = json.loads(body).get("id")
+            except ValueError:
+                did = None
+            if did:
+                with self.lock:
+                    self.created.append(did)
+
+
+def client_sender():
+    local = threading.local()
+
+    def send(method, path, body):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.APP.test_client()
+        if isinstance(body, Form):
+            resp = client.open(path, method=method, data=body)
+        else:
+            resp = client.open(path, method=method, json=body)
+        data = resp.get_data()
+        return resp.status_code, data
+    return send
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def http_sender(base_url):
+    opener = urllib.request.build_opener(_NoRedirect)
+
+    def send(method, path, body):
+        if isinstance(body, Form):
+            data, headers = urllib.parse.urlencode(body).encode(), {
+                "Content-Type": "application/x-www-form-urlencoded"}
+        elif body is not None:
+            data, headers = json.dumps(body).encode(), {"Content-Type": "application/json"}
+        else:
+            data, headers = None, {}
+        req = urllib.request.Request(base_url + path, data=data, method=method, headers=headers)
+        try:
+            with opener.open(req, timeout=30) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+    return send
+
+
+def start_http_server():
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app.APP, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def drive(send, scenarios, requests=2000, threads=1, mix=None, seed=0):
+    """Fire `requests` requests spread over `threads` workers; returns the summary."""
+    mix = mix or DEFAULT_MIX
+    routes, weights = zip(*mix.items())
+    samples = {r: [] for r in routes}
+    errors = {r: 0 for r in routes}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            route = rng.choices(routes, weights)[0]
+            method, path, body = scenarios.build(route)
+            started = time.perf_counter()
+            try:
+                status, data = send(method, path, body)
+            except Exception:
+                # connection errors and the like count as failed requests
+                status, data = 599, b""
+            elapsed = time.perf_counter() - started
+            scenarios.record(route, data)
+            with lock:
+                samples[route].append(elapsed)
+                if status >= 400:
+                    errors[route] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - started
+
+    summary = {}
+    for route in routes:
+        values = sorted(samples[route])
+        if not values:
+            continue
+        summary[route] = {
+            "count": len(values),
+            "errors": errors[route],
+            "throughput": round(len(values) / wall, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return {"wall_seconds": round(wall, 3), "requests": requests, "threads": threads, "routes": summary}
+
+
+def compare(current, baseline, tolerance=0.2, min_count=MIN_SAMPLES):
+    """Regressions of `current` against `baseline` as human-readable lines.
+    Routes with fewer than `min_count` samples on either side are skipped."""
+    failures = []
+    for route, base in baseline.get("routes", {}).items():
+        cur = current.get("routes", {}).get(route)
+        if cur is None or min(cur["count"], base["count"]) < min_count:
+            continue
+        if base["p95_ms"] and cur["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            failures.append(f"{route}: p95 {cur['p95_ms']:.2f} ms vs baseline {base['p95_ms']:.2f} ms")
+        if base["throughput"] and cur["throughput"] < base["throughput"] * (1 - tolerance):
+            failures.append(f"{route}: {cur['throughput']:.1f} req/s vs baseline {base['throughput']:.1f} req/s")
+    return failures
+
+
+def format_table(result):
+    lines = [f"{'route':<20} {'count':>7} {'err':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for route, r in result["routes"].items():
+        lines.append(f"{route:<20} {r['count']:>7} {r['errors']:>5} {r['throughput']:>9.1f} "
+                     f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# app.py and bench/ live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """create_app() on a fresh database in tmp_path; keyword arguments are
+    APP.config overrides, put back when the test ends."""
+    saved = dict(app.APP.config)
+
+    def make(**config):
+        return app.create_app(dict(config, DATABASE=str(tmp_path / "clinic.db")), warm=False)
+
+    yield make
+    app.BOOKING_WRITER.stop()
+    app.APP.config.clear()
+    app.APP.config.update(saved)
+
+
+@pytest.fixture
+def client(make_app):
+    return make_app().test_client()
+
+
+@pytest.fixture
+def dentist(client):
+    """Public id of a dentist in the `client` database."""
+    return app.public_id("dentist", app.add_dentist("Dr. Santos"))
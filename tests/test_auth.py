@@ -0,0 +1,55 @@
+# Login/register throttling: per-address and per-email token buckets, and a
+# bounded password hashing pool. Refusals come before any hashing.
+import threading
+
+import app
+
+FAST_HASH = "pbkdf2:sha256:1000"
+
+
+def _login(client, password, email="ana@example.com"):
+    return client.post("/login", data={"email": email, "password": password})
+
+
+def test_email_limit(make_app):
+    client = make_app(AUTH_EMAIL_BURST=2, PASSWORD_HASH_METHOD=FAST_HASH).test_client()
+    client.post("/register", data={"name": "Ana", "email": "ana@example.com", "password": "secret"})
+    assert _login(client, "wrong").status_code == 302
+    assert _login(client, "wrong").status_code == 302
+    # even the right password waits once the address is out of tokens
+    resp = _login(client, "secret")
+    assert resp.status_code == 429 and int(resp.headers["Retry-After"]) >= 1
+    # other accounts are unaffected
+    assert _login(client, "wrong", "ben@example.com").status_code == 302
+
+
+def test_ip_limit(make_app):
+    client = make_app(AUTH_IP_BURST=3, PASSWORD_HASH_METHOD=FAST_HASH).test_client()
+    codes = [_login(client, "wrong", f"user{i}@example.com").status_code for i in range(4)]
+    assert codes == [302, 302, 302, 429]
+    resp = client.post("/register", data={"name": "Ben", "email": "ben@example.com", "password": "secret"})
+    assert resp.status_code == 429
+
+
+def test_full_hash_pool_refuses(make_app):
+    client = make_app(AUTH_HASH_WORKERS=1, AUTH_HASH_QUEUE=0).test_client()
+    release = threading.Event()
+    app.AUTH_HASHER.submit(release.wait)
+    try:
+        resp = client.post("/register", data={"name": "Ana", "email": "ana@example.com", "password": "secret"})
+        assert resp.status_code == 503 and resp.headers["Retry-After"] == "1"
+        assert app.get_conn().execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0
+    finally:
+        release.set()
+
+
+def test_slow_hash_times_out(make_app):
+    client = make_app(AUTH_HASH_WORKERS=1, AUTH_HASH_QUEUE=1, AUTH_HASH_TIMEOUT=0.05).test_client()
+    release = threading.Event()
+    app.AUTH_HASHER.submit(release.wait)
+    try:
+        # queued behind the busy thread, then given up on
+        resp = client.post("/register", data={"name": "Ana", "email": "ana@example.com", "password": "secret"})
+        assert resp.status_code == 503
+    finally:
+        release.set()
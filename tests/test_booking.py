@@ -0,0 +1,53 @@
+# Bookings through the group-commit writer (BOOKING_GROUP_COMMIT).
+import app
+
+DAY = "2031-05-05"
+
+
+def _counter(name):
+    return dict(app.METRICS.snapshot()["counters"].get(name, [])).get((), 0)
+
+
+def test_bookings_share_a_commit(make_app):
+    make_app(BOOKING_GROUP_COMMIT=True, BOOKING_BATCH_WAIT=0.5)
+    did = app.add_dentist("Dr. Santos")
+    batches, items = _counter("booking_batches_total"), _counter("booking_batch_items_total")
+    futures = [app.BOOKING_WRITER.submit(f"Patient {i}", "", "", did, "Cleaning", DAY, slot)
+               for i, slot in enumerate(["08:00 AM", "08:30 AM", "09:00 AM"])]
+    ids = [f.result(5) for f in futures]
+    assert all(isinstance(aid, int) for aid in ids) and len(set(ids)) == 3
+    assert _counter("booking_batches_total") - batches == 1
+    assert _counter("booking_batch_items_total") - items == 3
+
+
+def test_failed_bookings_roll_back_alone(make_app):
+    make_app(BOOKING_GROUP_COMMIT=True, BOOKING_BATCH_WAIT=0.5)
+    did = app.add_dentist("Dr. Santos")
+    assert app.AVAILABILITY.free_slots(did, DAY)[:4] == ["08:00 AM", "08:30 AM", "09:00 AM", "09:30 AM"]
+    futures = [
+        app.BOOKING_WRITER.submit("Ana", "30", "0917", did, "Cleaning", DAY, "08:00 AM"),
+        # the same slot, taken earlier in the batch
+        app.BOOKING_WRITER.submit("Ben", "41", "0918", did, "Cleaning", DAY, "08:00 AM"),
+        # patient.name is NOT NULL
+        app.BOOKING_WRITER.submit(None, "", "", did, "Cleaning", DAY, "08:30 AM"),
+        # a value sqlite can't bind
+        app.BOOKING_WRITER.submit("Cy", "", "", did, object(), DAY, "09:00 AM"),
+    ]
+    assert futures[0].result(5) is not None
+    assert futures[1].result(5) is None
+    assert futures[2].result(5) is None
+    assert isinstance(futures[3].exception(5), app.sqlite3.Error)
+
+    rows = app.get_conn().execute("SELECT time FROM appointments WHERE date = ?", (DAY,)).fetchall()
+    assert rows == [("08:00 AM",)]
+    # the cached bitmap only gains the booking that committed
+    assert app.AVAILABILITY.free_slots(did, DAY)[:3] == ["08:30 AM", "09:00 AM", "09:30 AM"]
+
+
+def test_api_booking_with_group_commit(make_app):
+    client = make_app(BOOKING_GROUP_COMMIT=True).test_client()
+    did = app.public_id("dentist", app.add_dentist("Dr. Santos"))
+    booking = dict(patient_name="Ana", dentist_id=did, service="Cleaning", date=DAY, time="10:00 AM")
+    assert client.post("/api/appointments", json=booking).status_code == 201
+    assert client.post("/api/appointments", json=dict(booking, patient_name="Ben")).status_code == 409
+    assert client.post("/api/appointments", json=dict(booking, time="10:05")).status_code == 400
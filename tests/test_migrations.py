@@ -0,0 +1,85 @@
+# Upgrading a database created by the original app (uuid TEXT keys,
+# user_version 0) through every migration.
+import sqlite3
+import uuid
+
+import app
+
+# init_db() as it was before MIGRATIONS existed
+BASELINE_SCHEMA = """
+CREATE TABLE patient (
+    patient_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    age TEXT,
+    contact TEXT
+);
+CREATE TABLE dentist (
+    dentist_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    specialty TEXT
+);
+CREATE TABLE appointments (
+    appointment_id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    dentist_id TEXT NOT NULL,
+    service TEXT,
+    date TEXT,
+    time TEXT,
+    status TEXT,
+    created_at TEXT,
+    FOREIGN KEY(patient_id) REFERENCES patient(patient_id),
+    FOREIGN KEY(dentist_id) REFERENCES dentist(dentist_id)
+);
+CREATE TABLE users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL
+);
+"""
+
+
+def _baseline_db(path):
+    ids = {"ana": str(uuid.uuid4()), "ben": str(uuid.uuid4()), "dr": str(uuid.uuid4())}
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany("INSERT INTO patient VALUES (?,?,?,?)",
+                     [(ids["ana"], "Ana Reyes", "30", "0917"), (ids["ben"], "Ben Cruz", "41", "0918")])
+    conn.execute("INSERT INTO dentist VALUES (?,?,?)", (ids["dr"], "Dr. Santos", "General"))
+    rows = [
+        ("first", "ana", "Cleaning", "2027-05-17", "10:00 AM", "2027-01-01T08:00:00"),
+        # same slot, same spelling: cancelled when the unique index arrives
+        ("double", "ben", "Check-up", "2027-05-17", "10:00 AM", "2027-01-02T08:00:00"),
+        # same slot spelled differently: only caught once starts_at is the key
+        ("respelled", "ben", "Check-up", "05/17/2027", "10:00", "2027-01-03T08:00:00"),
+        ("other", "ana", "Tooth Extraction", "2027-05-18", "02:30 PM", "2027-01-04T08:00:00"),
+    ]
+    for key, patient, service, day, slot, created in rows:
+        ids[key] = str(uuid.uuid4())
+        conn.execute("INSERT INTO appointments VALUES (?,?,?,?,?,?,?,?)",
+                     (ids[key], ids[patient], ids["dr"], service, day, slot, "pending", created))
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def test_upgrade_from_baseline(tmp_path):
+    db = str(tmp_path / "baseline.db")
+    ids = _baseline_db(db)
+    app.create_app({"DATABASE": db}, warm=False)
+    conn = app.get_conn()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(app.MIGRATIONS)
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+
+    # old links still resolve, to integer rows
+    aid = {key: app.parse_id("appointment", ids[key]) for key in ("first", "double", "respelled", "other")}
+    assert all(isinstance(n, int) for n in aid.values())
+    status = dict(conn.execute("SELECT appointment_id, status FROM appointments"))
+    assert [status[aid[k]] for k in ("first", "double", "respelled", "other")] == \
+        ["pending", "cancelled", "cancelled", "pending"]
+    assert conn.execute("SELECT date, time, starts_at FROM appointments WHERE appointment_id = ?",
+                        (aid["respelled"],)).fetchone() == ("2027-05-17", "10:00 AM", "2027-05-17T10:00")
+
+    # the search index follows the new ids
+    assert conn.execute("SELECT rowid FROM appointment_fts WHERE appointment_fts MATCH 'ana'"
+                        " ORDER BY rowid").fetchall() == [(aid["first"],), (aid["other"],)]
@@ -0,0 +1,48 @@
+# Keyset pages: `next` is an opaque cursor, and a cursor we didn't make is
+# treated as no cursor.
+import base64
+import json
+
+import app
+
+
+def _book_day(client, dentist, times):
+    for i, time in enumerate(times):
+        booking = dict(patient_name=f"Patient {i}", dentist_id=dentist, service="Cleaning",
+                       date="2031-03-04", time=time)
+        assert client.post("/api/appointments", json=booking).status_code == 201
+
+
+def test_pages_follow_the_schedule(client, dentist):
+    times = ["08:00 AM", "08:30 AM", "09:00 AM", "09:30 AM", "10:00 AM"]
+    _book_day(client, dentist, times)
+    seen, after = [], ""
+    while True:
+        page = client.get(f"/api/appointments?per_page=2&fields=time&after={after}").json
+        seen += [r["time"] for r in page["data"]]
+        after = page["next"]
+        if not after:
+            break
+    assert seen == times
+
+
+def test_decode_cursor_rejects_foreign_cursors():
+    assert app.decode_cursor(app.encode_cursor(("2031-03-04T09:00", 7))) == ("2031-03-04T09:00", 7)
+    assert app.decode_cursor(app.encode_cursor((-1.5, 7))) == (-1.5, 7)
+    for key in (["2031-03-04T09:00", "x"], ["2031-03-04T09:00", 1.5], ["2031-03-04T09:00", True],
+                [None, 7], [["a"], 7], {"a": 1}, "x", [1, 2, 3]):
+        token = base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+        assert app.decode_cursor(token) is None, key
+    assert app.decode_cursor("not base64!") is None
+
+
+def test_foreign_cursor_is_a_first_page(client, dentist):
+    _book_day(client, dentist, ["09:00 AM"])
+    # a timestamp shared with a recurring occurrence, so the merge with the
+    # expanded occurrences sees the cursor too
+    client.post("/api/series", json=dict(patient_name="Ben", dentist_id=dentist, service="Cleaning",
+                                         date="2031-03-04", time="10:00 AM", interval_days=7, count=2))
+    after = app.encode_cursor(["2031-03-04T10:00", "x"])
+    resp = client.get(f"/api/appointments?fields=time&after={after}")
+    assert resp.status_code == 200
+    assert [r["time"] for r in resp.json["data"]] == ["09:00 AM", "10:00 AM", "10:00 AM"]
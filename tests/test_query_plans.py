@@ -0,0 +1,20 @@
+# check_query_plans() against real schemas: every registered statement must
+# search an index and read rows in index order, unless PLAN_ALLOW says otherwise.
+import app
+from bench import dataset
+
+
+def _problems():
+    return {name: problems for name, _, problems in app.check_query_plans() if problems}
+
+
+def test_plans_on_generated_data(tmp_path):
+    dataset.generate(str(tmp_path / "clinic.db"), dentists=10, patients=300, appointments=3000, seed=1)
+    app.get_conn().execute("ANALYZE")
+    assert _problems() == {}
+
+
+def test_plans_on_fresh_database(tmp_path):
+    app.create_app({"DATABASE": str(tmp_path / "fresh.db")}, warm=False)
+    app.get_conn().execute("ANALYZE")
+    assert _problems() == {}
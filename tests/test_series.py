@@ -0,0 +1,78 @@
+# Recurring series: occurrences are listed from the rule, and get a row of
+# their own only once something about them changes.
+import json
+
+import app
+
+LISTING = "/api/appointments?from=2031-01-01&to=2031-02-28&fields=id,date,time,status"
+
+
+def _series(client, dentist, **rule):
+    rule = dict(dict(patient_name="Ana", dentist_id=dentist, service="Cleaning",
+                     date="2031-01-07", time="09:00 AM", interval_days=7, count=4), **rule)
+    return client.post("/api/series", json=rule)
+
+
+def _listing(client):
+    return [(r["date"], r["time"], r["status"]) for r in client.get(LISTING).json["data"]]
+
+
+def _rows():
+    return app.get_conn().execute("SELECT date, time, status FROM appointments"
+                                  " WHERE series_id IS NOT NULL ORDER BY starts_at").fetchall()
+
+
+def test_series_expands_without_rows(client, dentist):
+    resp = _series(client, dentist)
+    assert resp.status_code == 201
+    assert resp.json["data"]["last_date"] == "2031-01-28"
+    assert _listing(client) == [(day, "09:00 AM", "pending")
+                                for day in ("2031-01-07", "2031-01-14", "2031-01-21", "2031-01-28")]
+    assert _rows() == []
+    # an occurrence holds its slot like a booked row
+    booking = dict(patient_name="Ben", dentist_id=dentist, service="Check-up", date="2031-01-14", time="09:00 AM")
+    assert client.post("/api/appointments", json=booking).status_code == 409
+    assert "09:00 AM" not in client.get(f"/api/availability?dentist={dentist}&start=2031-01-21").json["days"]["2031-01-21"]
+    # ...and a series can't be laid over booked slots
+    conflict = _series(client, dentist, date="2031-01-21", interval_days=14, count=2)
+    assert conflict.status_code == 409 and conflict.json["conflicts"] == ["2031-01-21"]
+
+
+def test_occurrence_changes_materialise(client, dentist):
+    _series(client, dentist)
+    ids = [r["id"] for r in client.get(LISTING).json["data"]]
+    assert client.patch(f"/api/appointments/{ids[1]}", json={"status": "approved"}).json["success"]
+    assert _rows() == [("2031-01-14", "09:00 AM", "approved")]
+    # the occurrence keeps answering to the id it was listed under
+    assert client.get(f"/api/appointments/{ids[1]}?fields=status").json["data"] == {"status": "approved"}
+    # the state machine applies to occurrences too
+    assert client.patch(f"/api/appointments/{ids[0]}", json={"status": "completed"}).status_code == 409
+    assert _rows() == [("2031-01-14", "09:00 AM", "approved")]
+
+
+def test_move_and_cancel_occurrences(client, dentist):
+    _series(client, dentist)
+    ids = [r["id"] for r in client.get(LISTING).json["data"]]
+    assert client.patch(f"/api/appointments/{ids[2]}",
+                        json={"date": "2031-01-22", "time": "11:00 AM"}).json["success"]
+    # deleting an occurrence cancels it, or the rule would bring it back
+    assert client.delete(f"/api/appointments/{ids[3]}").json["success"]
+    assert _listing(client) == [("2031-01-07", "09:00 AM", "pending"), ("2031-01-14", "09:00 AM", "pending"),
+                                ("2031-01-22", "11:00 AM", "pending"), ("2031-01-28", "09:00 AM", "cancelled")]
+    assert _rows() == [("2031-01-22", "11:00 AM", "pending"), ("2031-01-28", "09:00 AM", "cancelled")]
+    # the live dashboard hears about the move as one event with the whole slot
+    data = app.get_conn().execute("SELECT data FROM change_log WHERE op = 'move'").fetchone()[0]
+    assert json.loads(data) == {"status": "pending", "date": "2031-01-22", "time": "11:00 AM"}
+    # a cancelled occurrence stays cancelled
+    assert client.patch(f"/api/appointments/{ids[3]}", json={"status": "approved"}).status_code == 409
+
+
+def test_export_streams_occurrences_in_order(client, dentist):
+    _series(client, dentist)
+    booking = dict(patient_name="Ben", dentist_id=dentist, service="Check-up", date="2031-01-14", time="08:00 AM")
+    assert client.post("/api/appointments", json=booking).status_code == 201
+    with app.APP.app_context():
+        rows = list(app.iter_appointments(start="2031-01-01", end="2031-02-28", chunk_size=1))
+    assert [(r[5], r[6]) for r in rows] == [("2031-01-07", "09:00 AM"), ("2031-01-14", "08:00 AM"),
+                                             ("2031-01-14", "09:00 AM"), ("2031-01-21", "09:00 AM"),
+                                             ("2031-01-28", "09:00 AM")]
@@ -0,0 +1,36 @@
+# Status changes go through STATUS_TRANSITIONS, one at a time or in batches.
+import app
+
+
+def _book(client, dentist, time="09:00 AM"):
+    booking = dict(patient_name="Ana", dentist_id=dentist, service="Cleaning", date="2031-03-03", time=time)
+    return client.post("/api/appointments", json=booking).json["id"]
+
+
+def _status(client, aid):
+    return client.get(f"/api/appointments/{aid}?fields=status").json["data"]["status"]
+
+
+def test_transitions(client, dentist):
+    aid = _book(client, dentist)
+    assert client.patch(f"/api/appointments/{aid}", json={"status": "completed"}).status_code == 409
+    assert client.patch(f"/api/appointments/{aid}", json={"status": "approved"}).status_code == 200
+    assert client.patch(f"/api/appointments/{aid}", json={"status": "pending"}).status_code == 409
+    assert client.patch(f"/api/appointments/{aid}", json={"status": "completed"}).status_code == 200
+    # finished is final
+    resp = client.patch(f"/api/appointments/{aid}", json={"status": "cancelled"})
+    assert resp.status_code == 409 and resp.json["error"].startswith("Cannot")
+    assert client.delete(f"/api/appointments/{aid}").status_code == 200
+
+
+def test_batch_reports_each_appointment(client, dentist):
+    pending, approved = _book(client, dentist), _book(client, dentist, "10:00 AM")
+    client.patch(f"/api/appointments/{approved}", json={"status": "approved"})
+    missing = app.public_id("appointment", 999)
+    resp = client.post("/api/appointments/status", json={"ids": [pending, approved, missing], "status": "completed"})
+    assert resp.status_code == 200 and resp.json["success"] is False
+    results = {r["id"]: r for r in resp.json["results"]}
+    assert not results[pending]["success"] and results[pending]["error"].startswith("Cannot")
+    assert results[approved] == {"id": approved, "success": True, "error": None}
+    assert results[missing]["error"] == "Not found"
+    assert (_status(client, pending), _status(client, approved)) == ("pending", "completed")